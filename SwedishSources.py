@@ -25,6 +25,7 @@ Swedish Sources module
 # Python modules
 #
 #------------------------------------------------------------------------
+from functools import partial
 
 #------------------------------------------------------------------------
 #
@@ -51,6 +52,8 @@ from gramps.gen.const import GRAMPS_LOCALE as glocale
 
 from behave import BehaviourPage
 from bookdb import BookdbPage
+from dbsignals import DbSignals
+from links import LinkIndex
 from repo import RepoPage
 from src import SourcePage
 
@@ -63,6 +66,17 @@ config = configman.register_manager("SwedishSources")
 config.register("bookdb.url", "")
 config.register("bookdb.username", "")
 config.register("bookdb.password", "")
+config.register("bookdb.pool_size", 4)
+config.register("bookdb.pool_idle", 60)
+config.register("bookdb.cache", True)
+config.register("bookdb.memo_entries", 256)
+config.register("bookdb.memo_size", 32 * 1024 * 1024)
+config.register("bookdb.prefetch_depth", 3)
+config.register("bookdb.prefetch_rate", 256 * 1024)
+config.register("bookdb.offline", False)
+config.register("bookdb.connect_timeout", 10)
+config.register("bookdb.read_timeout", 30)
+config.register("bookdb.retries", 2)
 config.register("behavior.repo_i8n", False)
 config.register("behavior.sour_country", False)
 config.register("behavior.sour_i8n", False)
@@ -102,6 +116,11 @@ class SwedishSources(Gramplet):
 
         self.set_text(_('No Family Tree loaded.'))
 
+        #
+        # Scans of the family tree running, shown in the progress bar
+        #
+        self.scans = {}
+
         #
         # Get bookDB settings
         #
@@ -115,27 +134,112 @@ class SwedishSources(Gramplet):
         self.setup_behave()
 
         #
-        # Check if we can communicate with the server
-        # If status is OK then we have connection
+        # The links to bookDB saved with the family tree
         #
-        if self.pages['bookdb'].check_bookdb():
-            status = ""
-            if not self.pages['bookdb'].query_test():
-                status = self.pages['bookdb'].get_status()
-            else:
-                if 'status' in self.pages['bookdb'].answer:
-                    status = self.pages['bookdb'].answer['status']
+        self.links = LinkIndex()
+        self.db_closed_key = self.dbstate.connect('no-database', self.__db_closed)
 
-                #
-                #
-                #
-                self.pages['repo'] = RepoPage(self, config)
-                self.pages['sour'] = SourcePage(self, config)
+        #
+        # Changes to repositories and sources, handed to the pages in
+        # batches
+        #
+        self.signals = DbSignals()
 
+        #
+        # Check if we can communicate with the server in the background.
+        # If the server answered the same handshake before, the pages are
+        # added at once and only replaced if the server now fails,
+        # otherwise they are added when the answer arrives.
+        #
+        self.notebook = Gtk.Notebook()
+        self.notebook.connect('switch-page', self.change_page)
+        self.page_bookdb = None
+#        self.notebook.set_scrollable(False)
+
+        if self.pages['bookdb'].check_bookdb() and \
+           self.pages['bookdb'].get_handshake() == 'OK':
+            self.__connected('OK')
+            self.pages['bookdb'].query_async(self.__revalidated,
+                                             self.pages['bookdb'].test_status,
+                                             error=self.__connect_failed)
+        elif self.pages['bookdb'].check_bookdb():
+            page_wait = Gtk.Box()
+            page_wait.set_border_width(10)
+            page_wait.add(Gtk.Label(_('Connecting to bookDB...')))
+            self.notebook.append_page(page_wait, Gtk.Label(_('bookDB')))
+            self.pages['bookdb'].query_async(self.__connected,
+                                             self.pages['bookdb'].test_status,
+                                             error=self.__connect_failed)
         else:
-            status = _('Incomplete configuration')
+            self.__build_notebook(_('Incomplete configuration'))
+
+        #
+        # Progress of the scans of the family tree, below the pages
+        #
+        self.progress = Gtk.ProgressBar()
+        self.progress.set_show_text(True)
+        self.progress.set_no_show_all(True)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+        box.pack_start(self.notebook, True, True, 0)
+        box.pack_start(self.progress, False, False, 0)
+
+        self.gui.get_container_widget().remove(self.gui.textview)
+        self.gui.get_container_widget().add_with_viewport(box)
+
+        self.__print('SwedishSources::init done')
+
+    def __connect_failed(self, err):
+        """
+        The server could not be reached
+        """
+        self.__print('SwedishSources::__connect_failed')
+
+        self.__revalidated(str(getattr(err, 'reason', err)))
+
+    def __revalidated(self, status):
+        """
+        The server has answered the handshake the pages were built from,
+        if it failed the pages are dropped and the error shown
+        """
+        self.__print('SwedishSources::__revalidated')
+
+        if status == 'OK':
+            return
+
+        if self.pages['repo'] is not None or self.pages['sour'] is not None:
+            self.__db_closed()
+            self.signals = DbSignals()
+            self.pages['repo'] = None
+            self.pages['sour'] = None
+        self.__build_notebook(status)
+
+    def __connected(self, status):
+        """
+        The server has answered, if status is OK then we have connection
+        """
+        self.__print('SwedishSources::__connected')
+
+        if status == 'OK':
+            self.pages['repo'] = RepoPage(self, config)
+            self.pages['sour'] = SourcePage(self, config)
+
+        self.__build_notebook(status)
 
-        notebook = Gtk.Notebook()
+        if status == 'OK':
+            if self.dbstate.is_open():
+                self.db_changed()
+            self.update()
+
+    def __build_notebook(self, status):
+        """
+        Add the notebook pages
+        """
+        self.__print('SwedishSources::__build_notebook')
+
+        notebook = self.notebook
+        while notebook.get_n_pages() > 0:
+            notebook.remove_page(-1)
 
         if status != 'OK':
             self.page_error = Gtk.Box()
@@ -143,8 +247,7 @@ class SwedishSources(Gramplet):
             self.page_error.add(Gtk.Label(status))
             notebook.append_page(self.page_error, Gtk.Label(_('Error')))
 
-            notebook.append_page(self.pages['bookdb'].build_page(),
-                                 Gtk.Label(_('bookDB')))
+            notebook.append_page(self.__bookdb_page(), Gtk.Label(_('bookDB')))
         else:
             notebook.append_page(self.pages['sour'].build_page(),
                                  Gtk.Label(_('Sources')))
@@ -155,16 +258,18 @@ class SwedishSources(Gramplet):
             notebook.append_page(self.pages['behave'].build_page(),
                                  Gtk.Label(_('Settings')))
 
-            notebook.append_page(self.pages['bookdb'].build_page(),
-                                 Gtk.Label(_('bookDB')))
+            notebook.append_page(self.__bookdb_page(), Gtk.Label(_('bookDB')))
 
-        notebook.connect('switch-page', self.change_page)
-#        notebook.set_scrollable(False)
+        notebook.show_all()
 
-        self.gui.get_container_widget().remove(self.gui.textview)
-        self.gui.get_container_widget().add_with_viewport(notebook)
-
-        self.__print('SwedishSources::init done')
+    def __bookdb_page(self):
+        """
+        The bookDB page, built once and added again when the notebook
+        is rebuilt
+        """
+        if self.page_bookdb is None:
+            self.page_bookdb = self.pages['bookdb'].build_page()
+        return self.page_bookdb
 
     def setup_behave(self):
         """
@@ -183,6 +288,17 @@ class SwedishSources(Gramplet):
         self.pages['bookdb'].set_username(config.get('bookdb.username'))
         self.pages['bookdb'].set_password(config.get('bookdb.password'))
         self.pages['bookdb'].update_basic_auth()
+        self.pages['bookdb'].set_pool_size(config.get('bookdb.pool_size'))
+        self.pages['bookdb'].set_pool_idle(config.get('bookdb.pool_idle'))
+        self.pages['bookdb'].set_cache(config.get('bookdb.cache'))
+        self.pages['bookdb'].set_memo_limits(config.get('bookdb.memo_entries'),
+                                             config.get('bookdb.memo_size'))
+        self.pages['bookdb'].set_prefetch(config.get('bookdb.prefetch_depth'),
+                                          config.get('bookdb.prefetch_rate'))
+        self.pages['bookdb'].set_offline(config.get('bookdb.offline'))
+        self.pages['bookdb'].set_timeouts(config.get('bookdb.connect_timeout'),
+                                          config.get('bookdb.read_timeout'))
+        self.pages['bookdb'].set_retries(config.get('bookdb.retries'))
         self.pages['bookdb'].set_nothidden(False)
 
     def main(self):
@@ -191,9 +307,9 @@ class SwedishSources(Gramplet):
         """
         self.__print('SwedishSources::main')
         if not self.pages['repo'] is None:
-            self.pages['repo'].update_store()
+            self.pages['repo'].open_db()
         if not self.pages['sour'] is None:
-            self.pages['sour'].sour_update_index()
+            self.pages['sour'].open_db()
             self.pages['sour'].update_visibility()
 
     def db_changed(self):
@@ -202,24 +318,97 @@ class SwedishSources(Gramplet):
         """
         self.__print('SwedishSources::db_changed')
         if not self.pages['repo'] is None:
-            self.dbstate.db.connect('repository-add', self.pages['repo'].update)
-            self.dbstate.db.connect('repository-delete', self.pages['repo'].update)
-            self.dbstate.db.connect('repository-update', self.pages['repo'].update)
+            self.signals.set_handler('repository', partial(self.__changed, 'repo'))
         if not self.pages['sour'] is None:
-            self.dbstate.db.connect('source-add', self.pages['sour'].update)
-            self.dbstate.db.connect('source-delete', self.pages['sour'].update)
-            self.dbstate.db.connect('source-update', self.pages['sour'].update)
+            self.signals.set_handler('source', partial(self.__changed, 'sour'))
+        self.signals.connect(self.dbstate.db)
 
+        #
+        # The links of the family tree closed are saved with it, the
+        # links saved with the one opened are shown while it is scanned
+        #
+        self.__close_links()
+        data = self.links.open(self.dbstate.db) or {}
+
+        if not self.pages['repo'] is None:
+            if not self.pages['repo'].set_links(data.get('repo')):
+                self.pages['repo'].update_store()
         if not self.pages['sour'] is None:
-            self.pages['sour'].sour_update_index()
+            if not self.pages['sour'].set_links(data.get('sour')):
+                self.pages['sour'].sour_update_index()
             self.pages['sour'].update_visibility()
 
+    def __changed(self, name, handles):
+        """
+        Repositories or sources have changed, the page name keeps its
+        links up to date
+        """
+        self.pages[name].update(handles)
+        self.links.update(self.dbstate.db)
+
+    def __close_links(self):
+        """
+        Save the links of the family tree closed, unless changes to it
+        have not reached the pages
+        """
+        self.__print('SwedishSources::__close_links')
+
+        if self.signals.pending():
+            self.links.close(None)
+            return
+
+        data = {}
+        for name in ('repo', 'sour'):
+            if self.pages[name] is not None:
+                links = self.pages[name].get_links()
+                if links is not None:
+                    data[name] = links
+        if data:
+            self.links.close(data)
+
+    def __db_closed(self, *args):
+        """
+        The family tree is closed, or Gramps is exiting
+        """
+        self.__print('SwedishSources::__db_closed')
+
+        self.__close_links()
+        self.signals.disconnect()
+        for name in ('repo', 'sour'):
+            if self.pages[name] is not None:
+                self.pages[name].stop_scan()
+
+    def show_progress(self, name, text, done=0, total=0):
+        """
+        Show the progress of the scan name, text None when it has ended
+        """
+        if text is None:
+            self.scans.pop(name, None)
+        else:
+            self.scans[name] = (text, done, total)
+
+        if len(self.scans) == 0:
+            self.progress.hide()
+            return
+
+        (text, done, total) = self.scans[sorted(self.scans)[0]]
+        self.progress.set_text(_('Reading %s: %d of %d') % (text, done, total))
+        if total > 0:
+            self.progress.set_fraction(min(1.0, done / total))
+        else:
+            self.progress.pulse()
+        self.progress.show()
 
     def on_save(self):
         """
         Gramps is exiting
         """
         self.__print('SwedishSources::on_save')
+        self.__db_closed()
+        if self.db_closed_key is not None:
+            self.dbstate.disconnect(self.db_closed_key)
+            self.db_closed_key = None
+        self.pages['bookdb'].close()
         config.save()
 
     def change_page(self, notebook, page, pagenum):
@@ -228,7 +417,7 @@ class SwedishSources(Gramplet):
         """
         self.__print("SwedishSources::change_page " + page.get_name())
         if page.get_name() == "Repository":
-            self.pages['repo'].update_store()
+            self.pages['repo'].open_db()
 
     def hidden_widgets(self):
         """
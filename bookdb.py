@@ -26,15 +26,22 @@ BookDB module
 #
 #------------------------------------------------------------------------
 import base64
+import http.client
 import json
-import urllib
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import namedtuple
+from functools import partial
 
 #------------------------------------------------------------------------
 #
 # Gtk modules
 #
 #------------------------------------------------------------------------
-from gi.repository import Gtk
+from gi.repository import GLib, Gtk
 
 #------------------------------------------------------------------------
 #
@@ -42,6 +49,18 @@ from gi.repository import Gtk
 #
 #------------------------------------------------------------------------
 from gramps.gen.const import GRAMPS_LOCALE as glocale
+from gramps.gen.const import HOME_DIR
+
+from cache import DiskCache, LruCache, LRU_BYTES, LRU_ENTRIES
+from mirror import Mirror
+from pool import ConnectionPool, CircuitBreaker, backoff, POOL_IDLE, POOL_SIZE
+from pool import BREAKER_CLOSED, BREAKER_OPEN
+from prefetch import Prefetcher
+from records import decode_record
+from stats import QueryStats, LATENCY_BUCKETS
+from stream import ACCEPT_ENCODING, CHUNK_SIZE, Decompressor, JsonArrayStream, decompress
+from worker import QueryWorker, SingleFlight
+
 try:
     _trans = glocale.get_addon_translator(__file__)
 except ValueError:
@@ -55,6 +74,12 @@ _ = _trans.gettext
 
 SS_PROTOCOL_VERSION = '0.0.1'
 
+#
+# Protocol version of servers able to answer several commands in one
+# request (SS_CMD_BATCH)
+#
+SS_PROTOCOL_BATCH = '0.0.2'
+
 SS_CMD_TEST = 0
 SS_CMD_REPO = 1
 SS_CMD_CNTY = 2
@@ -65,12 +90,97 @@ SS_CMD_BREF = 6
 SS_CMD_SCBK = 7
 SS_CMD_SCBT = 8
 SS_CMD_SCBA = 9
+SS_CMD_BATCH = 10
+
+#
+# Code of a BookdbResult for a download stopped by the caller
+#
+SS_CODE_CANCELLED = -2
+
+#
+# Code of a BookdbResult when the server could not be reached
+#
+SS_CODE_UNREACHABLE = -3
+
+#
+# Number of times a failed query is sent again
+#
+SS_RETRIES = 2
+
+#
+# HTTP status codes worth retrying
+#
+SS_RETRY_CODES = (500, 502, 503, 504)
+
+#
+# Lists the server keeps change tokens for, and the field identifying
+# a row in them. The token comes in SS_TOKEN_HEADER, and sent back as
+# since= it gets the rows added, changed and deleted since then.
+#
+SS_TOKEN_HEADER = 'X-BookDB-Token'
+SS_DELTA_KEYS = {SS_CMD_BOOK: ('bdbBKid', 'aid'),
+                 SS_CMD_SCBK: ('bdbBKid', None),
+                 SS_CMD_REPO: ('rin', None)}
 
 SS_CMD = ['TestSSPV', 'getRepositories',
           'getCounties', 'getArchives',
           'getBookTypes', 'getBooks',
           'getBookRefs', 'getSCBBooks',
-          'getSCBBookTypes', 'getSCBArchive']
+          'getSCBBookTypes', 'getSCBArchive',
+          'doBatch']
+
+#
+# Seconds an answer is used from the disk cache before it is revalidated.
+# Commands not listed here are never cached on disk.
+#
+SS_CACHE_DAY = 24 * 60 * 60
+SS_CACHE_TTL = {SS_CMD_CNTY: 30 * SS_CACHE_DAY,
+                SS_CMD_ARCH: 7 * SS_CACHE_DAY,
+                SS_CMD_BTYP: 7 * SS_CACHE_DAY,
+                SS_CMD_BOOK: 1 * SS_CACHE_DAY,
+                SS_CMD_SCBK: 1 * SS_CACHE_DAY,
+                SS_CMD_SCBT: 7 * SS_CACHE_DAY,
+                SS_CMD_REPO: 0}
+
+SS_CACHE_PATH = os.path.join(HOME_DIR, 'SwedishSources', 'cache')
+
+SS_MIRROR_PATH = os.path.join(HOME_DIR, 'SwedishSources', 'mirror')
+
+#
+# Seconds an answer is kept in memory, None meaning for the whole
+# session. Commands not listed here are never kept in memory.
+#
+SS_MEMO_POLICY = {SS_CMD_REPO: 10 * 60,
+                  SS_CMD_CNTY: None,
+                  SS_CMD_ARCH: None,
+                  SS_CMD_BTYP: None,
+                  SS_CMD_BOOK: 60 * 60,
+                  SS_CMD_BREF: 60 * 60,
+                  SS_CMD_SCBK: 60 * 60,
+                  SS_CMD_SCBT: None,
+                  SS_CMD_SCBA: None}
+
+class BookdbResult(namedtuple('BookdbResult',
+                              ['payload', 'status', 'code', 'elapsed', 'size'])):
+    """
+    Answer to one bookDB query
+
+    payload is the decoded answer, rows of it being Record objects from
+    records.py, status the status text and code 0 on
+    success, -1 if the server reported an error or the HTTP status code.
+    elapsed is the number of seconds the query took and size the number
+    of bytes read from the server, 0 if the answer came from a cache or
+    another caller. The payload may be shared with the caches and must
+    not be modified.
+    """
+
+    __slots__ = ()
+
+    def ok(self):
+        """
+        Check if the query succeeded
+        """
+        return self.code == 0
 
 class BookdbPage():
     """
@@ -80,12 +190,26 @@ class BookdbPage():
     __config = None
     __debug = False
     __fields = {'url': Gtk.Entry(), 'username': Gtk.Entry(),
-                'password': Gtk.Entry(), 'message': Gtk.Label()}
+                'password': Gtk.Entry(), 'message': Gtk.Label(),
+                'breaker': Gtk.Label(), 'stats': Gtk.Label()}
     __gramplet = None
+    __breaker = None
+    __cache = None
+    __flight = None
+    __memo = None
+    __mirror = None
+    __prefetch = None
+    __pool = None
+    __stats = None
+    __prefetch_stats = None
+    __sync_stats = None
+    __local = None
+    __worker = None
     __values = {'url': "", 'username': "", 'password': "",
                 'basic_auth': "", 'nothidden': False,
-                'status': "", 'code': ""}
-    answer = {}
+                'cache': True, 'cache_ttl': dict(SS_CACHE_TTL),
+                'batch': None, 'offline': False, 'sync': None,
+                'retries': SS_RETRIES, 'timer': None}
 
     def __init__(self, gramplet, config):
         """
@@ -93,6 +217,18 @@ class BookdbPage():
         """
         self.__gramplet = gramplet
         self.__config = config
+        self.__pool = ConnectionPool(POOL_SIZE, POOL_IDLE)
+        self.__breaker = CircuitBreaker()
+        self.__stats = QueryStats(SS_CMD)
+        self.__prefetch_stats = QueryStats(SS_CMD)
+        self.__sync_stats = QueryStats(SS_CMD)
+        self.__local = threading.local()
+        self.__cache = DiskCache(SS_CACHE_PATH)
+        self.__memo = LruCache(SS_MEMO_POLICY, LRU_ENTRIES, LRU_BYTES)
+        self.__mirror = Mirror(SS_MIRROR_PATH)
+        self.__worker = QueryWorker()
+        self.__flight = SingleFlight()
+        self.__prefetch = Prefetcher(self.__worker)
 
     def set_url(self, url):
         """
@@ -100,7 +236,14 @@ class BookdbPage():
         """
         self.__print('BookDB::set_url')
 
+        if url != self.__values['url']:
+            self.__pool.close()
+            self.__breaker.reset()
+            self.__memo.invalidate()
+            self.__values['batch'] = None
         self.__values['url'] = url
+        self.__cache.set_scope(url, SS_PROTOCOL_VERSION)
+        self.__mirror.set_scope(url, SS_PROTOCOL_VERSION)
 
     def get_url(self):
         """
@@ -152,13 +295,254 @@ class BookdbPage():
         """
         return self.__values['nothidden']
 
-    def get_status(self):
+    def set_pool_size(self, size):
+        """
+        Save number of kept-alive connections
+        """
+        self.__print('BookDB::set_pool_size')
+
+        self.__pool.set_size(size)
+
+    def set_pool_idle(self, idle):
+        """
+        Save number of seconds an unused connection is kept alive
+        """
+        self.__print('BookDB::set_pool_idle')
+
+        self.__pool.set_idle(idle)
+
+    def set_cache(self, value):
+        """
+        Save if the disk cache should be used
+        """
+        self.__print('BookDB::set_cache')
+
+        self.__values['cache'] = value
+
+    def set_cache_ttl(self, cmd, ttl):
+        """
+        Save number of seconds an answer to cmd is used from the disk cache
+        """
+        self.__print('BookDB::set_cache_ttl')
+
+        if ttl is None:
+            self.__values['cache_ttl'].pop(cmd, None)
+        else:
+            self.__values['cache_ttl'][cmd] = ttl
+
+    def set_timeouts(self, connect, read):
+        """
+        Set seconds to wait for a connection and for data from the server
+        """
+        self.__print('BookDB::set_timeouts')
+
+        self.__pool.set_timeouts(connect, read)
+
+    def set_retries(self, retries):
+        """
+        Set number of times a failed query is sent again
+        """
+        self.__print('BookDB::set_retries')
+
+        self.__values['retries'] = max(0, int(retries))
+
+    def get_stats(self):
+        """
+        Return a snapshot of the counters kept per command, see QueryStats.
+        Prefetch queries are not counted here.
+        """
+        return self.__stats.snapshot()
+
+    def get_prefetch_stats(self):
+        """
+        Return a snapshot of the counters of the prefetch queries
+        """
+        return self.__prefetch_stats.snapshot()
+
+    def get_sync_stats(self):
+        """
+        Return a snapshot of the counters of the mirror sync queries
+        """
+        return self.__sync_stats.snapshot()
+
+    def reset_stats(self):
+        """
+        Start counting from zero
+        """
+        self.__print('BookDB::reset_stats')
+
+        self.__stats.reset()
+        self.__prefetch_stats.reset()
+        self.__sync_stats.reset()
+
+    def __counters(self):
+        """
+        Counters of the queries run by the calling thread
+        """
+        if getattr(self.__local, 'prefetch', False):
+            return self.__prefetch_stats
+        if self.__syncing():
+            return self.__sync_stats
+        return self.__stats
+
+    def get_breaker_state(self):
+        """
+        Return (state, failures in a row, seconds until the server is
+        tried again) of the circuit breaker
+        """
+        return self.__breaker.get_state()
+
+    def set_offline(self, value):
+        """
+        Answer all queries from the local mirror instead of the server
+        """
+        self.__print('BookDB::set_offline')
+
+        if value != self.__values['offline']:
+            self.__memo.invalidate()
+        self.__values['offline'] = value
+        if value:
+            self.__prefetch.stop()
+
+    def get_offline(self):
+        """
+        Get offline
+        """
+        return self.__values['offline']
+
+    def sync_mirror(self, callback, progress, error=None):
+        """
+        Download the catalogue to the local mirror in a worker thread
+
+        progress is called with (steps done, steps known) and callback
+        with True when the mirror is complete. Return a QueryTask,
+        cancelling it stops the sync, which goes on from where it was
+        the next time.
+        """
+        self.__print('BookDB::sync_mirror')
+
+        return self.__worker.submit(callback, self.__mirror.sync, self.__mirror_fetch,
+                                    error=error, progress=progress)
+
+    def __mirror_fetch(self, queries):
+        """
+        Fetch answers for the mirror from the server, queries being a
+        list of (command name, params). The caches are neither read nor
+        written, the mirror gets what the server has now.
+        """
+        queries = [(SS_CMD.index(cmd), params) for (cmd, params) in queries]
+        self.__local.sync = True
+        try:
+            results = self.__batch_online(queries)
+        finally:
+            self.__local.sync = False
+        for (cmd, params), res in zip(queries, results):
+            self.__sync_stats.record(cmd, res)
+        return results
+
+    def __syncing(self):
+        """
+        Check if the calling thread is syncing the mirror
+        """
+        return getattr(self.__local, 'sync', False)
+
+    def get_mirror_synced(self):
+        """
+        Time of the last complete sync of the mirror, or None
+        """
+        synced = self.__mirror.get_meta('synced')
+        if synced is None:
+            return None
+        return float(synced)
+
+    def set_prefetch(self, depth, rate):
+        """
+        Set how much is prefetched after a county is chosen, and the
+        maximum number of bytes per second used for it
+        """
+        self.__print('BookDB::set_prefetch')
+
+        self.__prefetch.set_depth(depth)
+        self.__prefetch.set_rate(rate)
+
+    def prefetch_county(self, cid):
+        """
+        Warm the caches with what is likely asked for next in a county
+        """
+        self.__print('BookDB::prefetch_county')
+
+        if cid == 0 or self.__values['offline']:
+            self.__prefetch.stop()
+        else:
+            self.__prefetch.start(partial(self.__prefetch_county, str(cid)))
+
+    def __prefetch_county(self, cid, depth):
+        """
+        Prefetch plan for a county: the archives, then the book types
+        and the books of each, archives in the county itself first
+        """
+        res = self.__prefetch_query(SS_CMD_ARCH, {'cid': cid})
+        yield res
+        if depth < 2 or not res.ok() or not isinstance(res.payload, list):
+            return
+
+        aids = [entry['bdbACid'] for entry in res.payload if entry['bdbCTid'] == cid] + \
+               [entry['bdbACid'] for entry in res.payload if entry['bdbCTid'] != cid]
+        for aid in aids:
+            yield self.__prefetch_query(SS_CMD_BTYP, {'aid': aid})
+        if depth < 3:
+            return
+        for aid in aids:
+            yield self.__prefetch_query(SS_CMD_BOOK, {'aid': aid})
+
+    def __prefetch_query(self, cmd, params):
+        """
+        Run a prefetch query, counted apart from those of the user
+        """
+        self.__local.prefetch = True
+        try:
+            return self.query(cmd, params)
+        finally:
+            self.__local.prefetch = False
+
+    def set_memo_limits(self, entries, size):
         """
-        Get status
+        Save maximum number of answers and bytes kept in memory
         """
-        self.__print('BookDB::get_status')
+        self.__print('BookDB::set_memo_limits')
 
-        return self.__values['status']
+        self.__memo.set_limits(entries, size)
+
+    def set_memo_policy(self, cmd, age):
+        """
+        Save number of seconds an answer to cmd is kept in memory
+        """
+        self.__print('BookDB::set_memo_policy')
+
+        self.__memo.set_policy(cmd, age)
+
+    def invalidate(self, cmd=None, params=None):
+        """
+        Forget answers kept in memory, for all, one command or one query
+        """
+        self.__print('BookDB::invalidate')
+
+        self.__memo.invalidate(cmd, params)
+
+    def get_memo_stats(self):
+        """
+        Get hit and miss counters of the memory cache
+        """
+        return self.__memo.get_stats()
+
+    def clear_cache(self):
+        """
+        Remove everything stored in the memory and disk cache
+        """
+        self.__print('BookDB::clear_cache')
+
+        self.__memo.invalidate()
+        self.__cache.clear()
 
     def update_basic_auth(self):
         """
@@ -198,50 +582,490 @@ class BookdbPage():
             url += "&" + key + "=" + val
         return url
 
-    def __query(self, url):
+    def __build_batch_url(self, queries):
+        """
+        Create an url string asking for several commands at once
+
+        Each command is sent as a parameter qN holding the quoted query
+        string it would have had on its own.
+        """
+        url = self.__values['url'] + '?do=' + SS_CMD[SS_CMD_BATCH]
+        url += "&sspv=" + SS_PROTOCOL_BATCH
+        url += "&n=" + str(len(queries))
+        for idx, (cmd, params) in enumerate(queries):
+            sub = 'do=' + SS_CMD[cmd]
+            for key, val in params.items():
+                sub += "&" + key + "=" + val
+            url += "&q%d=%s" % (idx, urllib.parse.quote(sub, safe=''))
+        return url
+
+    def __headers(self):
+        """
+        Create the headers sent with every request
+        """
+        headers = {'Connection': 'keep-alive', 'Accept-Encoding': ACCEPT_ENCODING}
+        if self.__values['basic_auth'] != '':
+            headers['Authorization'] = self.__values['basic_auth']
+        return headers
+
+    def __cached(self, cmd, params):
+        """
+        Look up an answer in the memory and disk cache
+
+        Returns the answer, or None, and the stale disk cache entry if
+        there is one to revalidate.
+        """
+        if self.__syncing():
+            return (None, None)
+
+        answer = self.__memo.get(cmd, params)
+        if answer is not None:
+            return (answer, None)
+
+        entry = None
+        if self.__values['cache'] and cmd in self.__values['cache_ttl']:
+            entry = self.__cache.get(SS_CMD[cmd], params)
+        if entry is not None:
+            if time.time() - entry['stored'] < self.__values['cache_ttl'][cmd]:
+                self.__memo.put(cmd, params, entry['payload'], entry['size'])
+                return (entry['payload'], None)
+        return (None, entry)
+
+    def __store(self, cmd, params, answer, size, etag=None, modified=None, token=None):
+        """
+        Save an answer in the memory and disk cache
+        """
+        if self.__syncing():
+            return
+
+        self.__memo.put(cmd, params, answer, size)
+        if self.__values['cache'] and cmd in self.__values['cache_ttl']:
+            self.__cache.put(SS_CMD[cmd], params, answer, etag, modified, token)
+
+    @staticmethod
+    def __since(cmd, params, entry):
+        """
+        Change token to ask for the changes to a stale list with, or None
+        """
+        if entry is None or not entry.get('token') or cmd not in SS_DELTA_KEYS:
+            return None
+        (key, param) = SS_DELTA_KEYS[cmd]
+        if param is not None and param not in params:
+            return None
+        if cmd == SS_CMD_REPO and 'rin' in params:
+            return None
+        if not isinstance(entry['payload'], list):
+            return None
+        return entry['token']
+
+    @staticmethod
+    def __merge(rows, delta, key):
+        """
+        Apply the rows added, changed and deleted to a list
+
+        Positions in a delta are those in the new list, so the rows that
+        are gone or changed are removed first and the new versions are
+        then put in place in order of position.
+        """
+        gone = set(delta.get('deleted', []))
+        upsert = sorted(delta.get('added', []) + delta.get('changed', []),
+                        key=lambda item: item[0])
+        gone.update(row[key] for (pos, row) in upsert)
+        ret = [row for row in rows if row[key] not in gone]
+        for (pos, row) in upsert:
+            ret.insert(pos, row)
+        return ret
+
+    @staticmethod
+    def __answer_status(answer):
+        """
+        Get status and code from a decoded answer
+        """
+        status = ""
+        code = 0
+        if 'status' in answer:
+            if answer['status'] != 'OK':
+                code = -1
+            status = answer['status']
+        return (status, code)
+
+    @staticmethod
+    def __result(start, payload, status="", code=0, size=0):
+        """
+        Create the result of a query started at start
+        """
+        return BookdbResult(payload, status, code, time.monotonic() - start, size)
+
+    def query(self, cmd, params):
+        """
+        Generic code for query to bookDB server, returns a BookdbResult
+        """
+        return self.query_stream(cmd, params, None)
+
+    def __offline(self, cmd, params, rows):
         """
-        Generic code for query to bookDB server
+        Answer a query from the mirror
         """
+        start = time.monotonic()
 
-        self.__values['status'] = ""
-        self.__values['code'] = 0
-        self.answer = {}
+        answer = self.__mirror.answer(SS_CMD[cmd], params)
+        if answer is None:
+            return self.__result(start, {}, _('Not available offline'), -1)
+        if rows is not None and isinstance(answer, list):
+            rows(answer)
+        return self.__result(start, answer)
+
+    def query_stream(self, cmd, params, rows):
+        """
+        Query the bookDB server, returns a BookdbResult
+
+        In offline mode the answer comes from the local mirror.
+        """
+        if self.__values['offline']:
+            res = self.__offline(cmd, params, rows)
+        else:
+            res = self.__stream_online(cmd, params, rows)
+        self.__counters().record(cmd, res)
+        return res
+
+    def __stream_online(self, cmd, params, rows):
+        """
+        Query the bookDB server, see query_stream
+
+        If rows is given and the answer is a list, rows is called with
+        the records decoded so far while the rest is still downloading.
+        If rows returns False the download is abandoned.
+
+        Identical queries running at the same time, from any thread, are
+        merged into one request whose result goes to every caller.
+
+        Answers are first looked up in the memory cache. Answers to
+        commands with a TTL are also kept in the disk cache, where a fresh
+        entry is used as is and a stale one is revalidated with the ETag
+        and Last-Modified validators the server sent when it was stored.
+
+        No state is shared between calls except the caches and the
+        connection pool, so queries may run in many threads at once.
+        """
+        start = time.monotonic()
+
+        (answer, entry) = self.__cached(cmd, params)
+        if answer is not None:
+            self.__counters().count(cmd, 'hits')
+            if rows is not None and isinstance(answer, list):
+                rows(answer)
+            return self.__result(start, answer)
+        self.__counters().count(cmd, 'misses')
+
+        since = self.__since(cmd, params, entry)
+        if since is None:
+            url = self.__build_url(cmd, params)
+        else:
+            url = self.__build_url(cmd, dict(params, since=since))
+        key = (url, self.__values['basic_auth'])
+
+        while True:
+            (res, merged) = self.__flight.run(
+                key, lambda: self.__fetch_retry(start, cmd, params, url, entry, rows))
+            if not merged:
+                return res
+            if res.code != SS_CODE_CANCELLED:
+                self.__counters().count(cmd, 'merged')
+                break
+            # The caller doing the request gave up, try again
+
+        if rows is not None and res.ok() and isinstance(res.payload, list):
+            rows(res.payload)
+        return self.__result(start, res.payload, res.status, res.code)
+
+    def __fetch_retry(self, start, cmd, params, url, entry, rows):
+        """
+        Send a query, retrying with backoff if the server does not answer
+        or answers with a server error
+
+        Nothing is sent while the circuit breaker is open. A streamed
+        query is not retried once records have been handed to rows.
+        """
+        streamed = []
+        if rows is not None:
+            def counted(books):
+                streamed.append(len(books))
+                return rows(books)
+        else:
+            counted = None
+
+        attempt = 0
+        while True:
+            if not self.__breaker.allow():
+                return self.__result(start, {}, _('bookDB unavailable'), SS_CODE_UNREACHABLE)
+            try:
+                res = self.__fetch(start, cmd, params, url, entry, counted)
+            except urllib.error.HTTPError:
+                self.__breaker.success()
+                raise
+            except (OSError, http.client.HTTPException) as err:
+                self.__breaker.failure()
+                res = self.__result(start, {}, str(getattr(err, 'reason', err)),
+                                    SS_CODE_UNREACHABLE)
+            else:
+                if res.code not in SS_RETRY_CODES:
+                    self.__breaker.success()
+                    return res
+                self.__breaker.failure()
+
+            if attempt >= self.__values['retries'] or streamed:
+                return res
+            self.__print('BookDB::__fetch_retry %s' % res.status)
+            time.sleep(backoff(attempt))
+            attempt += 1
+
+    def __fetch(self, start, cmd, params, url, entry, rows):
+        """
+        Send a query to the server, see query_stream
+        """
+        headers = self.__headers()
+        size = 0
+        since = self.__since(cmd, params, entry)
+        if entry is not None and since is None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('modified'):
+                headers['If-Modified-Since'] = entry['modified']
 
         try:
-            req = urllib.request.Request(url)
-        except ValueError as err:
-            self.__values['status'] = _('Incomplete configuration')
-            self.__values['code'] = -1
-            return True
+            resp = self.__pool.open(url, headers)
+        except ValueError:
+            return self.__result(start, {}, _('Incomplete configuration'), -1)
 
-        if self.__values['basic_auth'] != '':
-            req.add_header("Authorization", self.__values['basic_auth'])
         try:
-            resp = urllib.request.urlopen(req)
-            j = json.load(resp)
-            if 'status' in j:
-                if j['status'] != 'OK':
-                    self.__values['code'] = -1
-                self.__values['status'] = j['status']
+            with resp:
+                if resp.status == 304 and entry is not None:
+                    resp.read()
+                    self.__cache.touch(SS_CMD[cmd], params, entry)
+                    self.__memo.put(cmd, params, entry['payload'], entry['size'])
+                    if rows is not None and isinstance(entry['payload'], list):
+                        rows(entry['payload'])
+                    return self.__result(start, entry['payload'])
+                if resp.status >= 400:
+                    resp.read()
+                    raise urllib.error.HTTPError(url, resp.status, resp.reason,
+                                                 resp.headers, None)
+                if rows is None:
+                    body = resp.read()
+                    size = len(body)
+                    decode = time.monotonic()
+                    j = json.loads(decompress(resp.headers.get('Content-Encoding'),
+                                              body).decode('utf-8'),
+                                   object_hook=decode_record)
+                    self.__counters().decoded(cmd, time.monotonic() - decode)
+                else:
+                    (j, size, decode) = self.__read_stream(resp, rows)
+                    self.__counters().decoded(cmd, decode)
+                    if j is None:
+                        return self.__result(start, {}, _('Cancelled'),
+                                             SS_CODE_CANCELLED, size)
+            (status, code) = self.__answer_status(j)
+            token = resp.headers.get(SS_TOKEN_HEADER)
+            memo = size
+            if code == 0 and since is not None and isinstance(j, dict) and 'token' in j:
+                token = j['token']
+                j = self.__merge(entry['payload'], j, SS_DELTA_KEYS[cmd][0])
+                memo = entry['size']
+                if rows is not None:
+                    rows(j)
+            if code == 0:
+                self.__store(cmd, params, j, memo,
+                             resp.headers.get('ETag'),
+                             resp.headers.get('Last-Modified'), token)
         except urllib.error.HTTPError as err:
             if err.code == 401:
-                self.__values['status'] = _('Authentication Required')
-                self.__values['code'] = err.code
-                j = {'status': self.__values['status'], 'code': self.__values['code']}
+                status = _('Authentication Required')
             elif err.code == 404:
-                self.__values['status'] = _('Unknown Page')
-                self.__values['code'] = err.code
-                j = {'status': self.__values['status'], 'code': self.__values['code']}
-            elif err.code == 500 or err.code == 503:
-                self.__values['status'] = err.reason
-                self.__values['code'] = err.code
-                j = {'status': self.__values['status'], 'code': self.__values['code']}
+                status = _('Unknown Page')
+            elif err.code in SS_RETRY_CODES:
+                status = err.reason
             else:
                 raise
+            code = err.code
+            j = {'status': status, 'code': code}
 
-        self.answer = j
+        return self.__result(start, j, status, code, size)
+
+    @staticmethod
+    def __read_stream(resp, rows):
+        """
+        Read and decode an answer chunk by chunk, handing records to rows
+
+        Returns the decoded answer, or None if rows asked to stop, the
+        number of bytes read and the seconds spent decoding.
+        """
+        dec = Decompressor(resp.headers.get('Content-Encoding'))
+        doc = JsonArrayStream(decode_record)
+        size = 0
+        decode = 0.0
+        while True:
+            data = resp.read(CHUNK_SIZE)
+            if not data:
+                break
+            size += len(data)
+            now = time.monotonic()
+            new = doc.feed(dec.feed(data))
+            decode += time.monotonic() - now
+            if new and rows(new) is False:
+                return (None, size, decode)
+        now = time.monotonic()
+        new = doc.feed(dec.flush())
+        if new and rows(new) is False:
+            return (None, size, decode + time.monotonic() - now)
+        j = doc.close()
+        return (j, size, decode + time.monotonic() - now)
+
+    def query_batch(self, queries):
+        """
+        Run several queries, a list of (cmd, params), and return a list
+        of BookdbResult in the same order
+
+        Queries not answered by the caches are sent in one request if the
+        server speaks SS_PROTOCOL_BATCH. If it does not, that is
+        remembered until the url changes and the queries are sent one by
+        one instead. In offline mode the answers come from the local mirror.
+        """
+        self.__print('BookDB::query_batch')
+
+        if self.__values['offline']:
+            results = [self.__offline(cmd, params, None) for (cmd, params) in queries]
+        else:
+            results = self.__batch_online(queries)
+        for (cmd, params), res in zip(queries, results):
+            self.__counters().record(cmd, res)
+        return results
+
+    def __batch_online(self, queries):
+        """
+        Run several queries against the server, see query_batch
+        """
+        start = time.monotonic()
+        results = [None] * len(queries)
+        missing = []
+        for idx, (cmd, params) in enumerate(queries):
+            (answer, entry) = self.__cached(cmd, params)
+            if answer is not None:
+                self.__counters().count(cmd, 'hits')
+                results[idx] = self.__result(start, answer)
+            else:
+                missing.append(idx)
+
+        if len(missing) > 1 and self.__values['batch'] is not False:
+            answers = self.__query_batch([queries[idx] for idx in missing], start)
+            if answers is not None:
+                for idx, res in zip(missing, answers):
+                    self.__counters().count(queries[idx][0], 'misses')
+                    results[idx] = res
+                missing = []
+
+        for idx in missing:
+            results[idx] = self.__stream_online(queries[idx][0], queries[idx][1], None)
+
+        return results
+
+    def __query_batch(self, queries, start):
+        """
+        Send several queries in one request
+
+        Returns a list of BookdbResult, or None if the request failed and
+        the queries should be sent one by one.
+        """
+        url = self.__build_batch_url(queries)
+
+        if not self.__breaker.allow():
+            return None
+        try:
+            resp = self.__pool.open(url, self.__headers())
+            with resp:
+                body = resp.read()
+        except ValueError:
+            return None
+        except (OSError, http.client.HTTPException):
+            self.__breaker.failure()
+            return None
+        if resp.status in SS_RETRY_CODES:
+            self.__breaker.failure()
+            return None
+        self.__breaker.success()
+        if resp.status == 404:
+            self.__values['batch'] = False
+        if resp.status >= 400:
+            return None
+
+        try:
+            decode = time.monotonic()
+            j = json.loads(decompress(resp.headers.get('Content-Encoding'),
+                                      body).decode('utf-8'), object_hook=decode_record)
+            self.__counters().decoded(SS_CMD_BATCH, time.monotonic() - decode)
+        except ValueError:
+            self.__values['batch'] = False
+            return None
+        if not isinstance(j, dict) or j.get('status') != 'OK' or \
+           not isinstance(j.get('results'), list) or len(j['results']) != len(queries):
+            self.__values['batch'] = False
+            return None
+        self.__values['batch'] = True
+
+        results = []
+        size = len(body) // len(queries)
+        for (cmd, params), answer in zip(queries, j['results']):
+            (status, code) = self.__answer_status(answer)
+            if code == 0:
+                self.__store(cmd, params, answer, size)
+            results.append(self.__result(start, answer, status, code, size))
+        return results
+
+    def __run(self, cmd, params, default):
+        """
+        Run a query and return the answer, or default on error
+        """
+        res = self.query(cmd, params)
+        if not res.ok():
+            print("Error: ", res.status, res.code)
+            return default
+        return res.payload
+
+    def query_stream_async(self, callback, cmd, params, rows, error=None):
+        """
+        Run query_stream in a worker thread
+
+        rows is called in the GLib main loop with each list of records as
+        they arrive, and callback with the BookdbResult at the end. Return
+        a QueryTask, cancelling it also stops the download.
+        """
+        self.__print('BookDB::query_stream_async')
+
+        return self.__worker.submit(callback, self.query_stream, cmd, params,
+                                    error=error, progress=rows)
+
+    def __run_batch(self, queries):
+        """
+        Run several queries and return a tuple of answers, {} on error
+        """
+        answers = []
+        for res in self.query_batch(queries):
+            if not res.ok():
+                print("Error: ", res.status, res.code)
+                answers.append({})
+            else:
+                answers.append(res.payload)
+        return tuple(answers)
+
+    def query_async(self, callback, func, *args, error=None):
+        """
+        Call func(*args) in a worker thread, typically one of the query
+        methods, and pass the result to callback in the GLib main loop.
+
+        Return a QueryTask that can be cancelled.
+        """
+        self.__print('BookDB::query_async')
 
-        return self.__values['code'] != 0
+        return self.__worker.submit(callback, func, *args, error=error)
 
     def query_archive(self, aid):
         """
@@ -249,15 +1073,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_archive')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_ARCH, {'aid': str(aid)})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_ARCH, {'aid': str(aid)}, {})
 
     def query_archives(self, cid):
         """
@@ -265,15 +1081,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_archives')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_ARCH, {'cid': str(cid)})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_ARCH, {'cid': str(cid)}, {})
 
     def query_book(self, bid):
         """
@@ -281,15 +1089,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_book')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_BOOK, {'bid': str(bid)})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_BOOK, {'bid': str(bid)}, {})
 
     def query_bookrefs(self, bid):
         """
@@ -297,15 +1097,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_bookrefs')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_BREF, {'bid': str(bid)})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_BREF, {'bid': str(bid)}, {})
 
     def query_books(self, aid):
         """
@@ -313,15 +1105,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_books')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_BOOK, {'aid': str(aid)})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_BOOK, {'aid': str(aid)}, {})
 
     def query_booktypes_arch(self, aid):
         """
@@ -329,15 +1113,38 @@ class BookdbPage():
         """
         self.__print('BookDB::query_booktypes_arch')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_BTYP, {'aid': str(aid)})
+        return self.__run(SS_CMD_BTYP, {'aid': str(aid)}, {})
 
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+    def query_chur_book_info(self, aid, bid):
+        """
+        Make a query about an archive and a book in it
+        """
+        self.__print('BookDB::query_chur_book_info')
+
+        return self.__run_batch([(SS_CMD_ARCH, {'aid': str(aid)}),
+                                 (SS_CMD_BOOK, {'bid': str(bid)})])
+
+    def query_chur_books_info(self, aid, bids):
+        """
+        Make a query about an archive and several books in it, return
+        (ac_info, list of bk_info)
+        """
+        self.__print('BookDB::query_chur_books_info')
+
+        answers = self.__run_batch([(SS_CMD_ARCH, {'aid': str(aid)})] +
+                                   [(SS_CMD_BOOK, {'bid': str(bid)}) for bid in bids])
+        return (answers[0], list(answers[1:]))
+
+    def query_bookrefs_many(self, bids):
+        """
+        Make a query about the book refs in NAD of several books, return
+        a dict from book to answer
+        """
+        self.__print('BookDB::query_bookrefs_many')
+
+        bids = [str(bid) for bid in bids]
+        answers = self.__run_batch([(SS_CMD_BREF, {'bid': bid}) for bid in bids])
+        return dict(zip(bids, answers))
 
     def query_counties(self):
         """
@@ -345,15 +1152,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_counties')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_CNTY, {})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_CNTY, {}, {})
 
     def query_repositories(self):
         """
@@ -361,15 +1160,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_repositories')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_REPO, {})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_REPO, {}, {})
 
     def query_repository(self, rin):
         """
@@ -377,15 +1168,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_repository')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_REPO, {'rin': rin})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_REPO, {'rin': rin}, {})
 
     def query_scb_archive(self):
         """
@@ -393,15 +1176,28 @@ class BookdbPage():
         """
         self.__print('BookDB::query_scb_archive')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_SCBA, {})
+        return self.__run(SS_CMD_SCBA, {}, {})
 
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+    def query_scb_book_info(self, bid):
+        """
+        Make a query about the SCB archive, a SCB book and all SCB booktypes
+        """
+        self.__print('BookDB::query_scb_book_info')
+
+        return self.__run_batch([(SS_CMD_SCBA, {}),
+                                 (SS_CMD_BOOK, {'bid': str(bid)}),
+                                 (SS_CMD_SCBT, {})])
+
+    def query_scb_books_info(self, bids):
+        """
+        Make a query about the SCB archive, several SCB books and all SCB
+        booktypes, return (ac_info, list of bk_info, bt_info)
+        """
+        self.__print('BookDB::query_scb_books_info')
+
+        answers = self.__run_batch([(SS_CMD_SCBA, {}), (SS_CMD_SCBT, {})] +
+                                   [(SS_CMD_BOOK, {'bid': str(bid)}) for bid in bids])
+        return (answers[0], list(answers[2:]), answers[1])
 
     def query_scb_booktypes(self):
         """
@@ -409,15 +1205,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_scb_booktypes')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_SCBT, {})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_SCBT, {}, {})
 
     def query_scb_books(self, cid):
         """
@@ -425,15 +1213,7 @@ class BookdbPage():
         """
         self.__print('BookDB::query_scb_books')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_SCBK, {'cid': str(cid)})
-
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
-            return {}
-        else:
-            return self.answer
+        return self.__run(SS_CMD_SCBK, {'cid': str(cid)}, {})
 
     def query_test(self):
         """
@@ -441,15 +1221,49 @@ class BookdbPage():
         """
         self.__print('BookDB::query_test')
 
-        self.__values['status'] = ""
-        self.__values['code'] = -1
-        url = self.__build_url(SS_CMD_TEST, {})
+        return self.__run(SS_CMD_TEST, {}, None)
+
+    def test_status(self):
+        """
+        Ping the server and return the status, 'OK' if all is well
+
+        The answer is remembered for the url, user and protocol version,
+        see get_handshake.
+        """
+        self.__print('BookDB::test_status')
+
+        res = self.query(SS_CMD_TEST, {})
+        status = ""
+        if not res.ok():
+            print("Error: ", res.status, res.code)
+            status = res.status
+        elif 'status' in res.payload:
+            status = res.payload['status']
+        if self.__values['cache'] and not self.__values['offline']:
+            self.__cache.put(SS_CMD[SS_CMD_TEST], self.__handshake_key(),
+                             status if status == 'OK' else None)
+        return status
+
+    def __handshake_key(self):
+        """
+        Params the handshake is cached with, the url and protocol version
+        are part of the disk cache scope
+        """
+        return {'user': self.__values['username']}
+
+    def get_handshake(self):
+        """
+        Status of the last successful handshake with the server, from an
+        earlier session too, or None
+        """
+        self.__print('BookDB::get_handshake')
 
-        if self.__query(url):
-            print("Error: ", self.__values['status'], self.__values['code'])
+        if not self.__values['cache']:
             return None
-        else:
-            return self.answer
+        entry = self.__cache.get(SS_CMD[SS_CMD_TEST], self.__handshake_key())
+        if entry is None:
+            return None
+        return entry['payload']
 
     @staticmethod
     def __create_label(field, xalign=None):
@@ -519,6 +1333,11 @@ class BookdbPage():
         button1.connect("clicked", self.__button_clicked)
         hbox.pack_start(button1, True, True, 0)
 
+        button3 = Gtk.Button.new_with_label(_('Clear cache'))
+        button3.set_name("Clear")
+        button3.connect("clicked", self.__button_clicked)
+        hbox.pack_start(button3, True, True, 0)
+
         self.__fields['message'].set_text("")
         self.__fields['message'].set_property("width-request", 150)
         self.__fields['message'].set_justify(Gtk.Justification.LEFT)
@@ -527,10 +1346,46 @@ class BookdbPage():
 
         grid.attach_next_to(hbox, label1, Gtk.PositionType.BOTTOM, 3, 1)
 
+        hbox2 = Gtk.Box(spacing=6)
+
+        button4 = Gtk.CheckButton(_("Offline"), name="Offline")
+        button4.set_active(self.get_offline())
+        button4.connect("toggled", self.__button_clicked)
+        hbox2.pack_start(button4, False, False, 0)
+
+        button5 = Gtk.Button.new_with_label(_('Sync mirror'))
+        button5.set_name("Sync")
+        button5.connect("clicked", self.__button_clicked)
+        hbox2.pack_start(button5, False, False, 0)
+
+        grid.attach_next_to(hbox2, hbox, Gtk.PositionType.BOTTOM, 3, 1)
+
+        self.__fields['breaker'].set_xalign(0.0)
+        grid.attach_next_to(self.__fields['breaker'], hbox2, Gtk.PositionType.BOTTOM, 3, 1)
+
+        self.__fields['stats'].set_xalign(0.0)
+        self.__fields['stats'].set_selectable(True)
+        grid.attach_next_to(self.__fields['stats'], self.__fields['breaker'],
+                            Gtk.PositionType.BOTTOM, 3, 1)
+
+        self.__show_state()
+        self.close()
+        self.__values['timer'] = GLib.timeout_add_seconds(1, self.__show_state)
+
         page.add(grid)
 
         return page
 
+    def close(self):
+        """
+        Stop showing the state on the page, called when the gramplet is closed
+        """
+        self.__print('BookDB::close')
+
+        if self.__values['timer'] is not None:
+            GLib.source_remove(self.__values['timer'])
+            self.__values['timer'] = None
+
     def __changed_url(self, field):
         """
         Save url if field has changed
@@ -591,19 +1446,118 @@ class BookdbPage():
         btn = button.get_name()
         if btn == 'Save':
             self.__button_update()
-            self.__gramplet.on_save()
+            self.__config.save()
         elif btn == 'Test':
             self.__button_update()
-            status = ""
-            if not self.query_test():
-                status = self.__values['status']
-            else:
-                if 'status' in self.answer:
-                    status = self.answer['status']
-            self.__fields['message'].set_text(status)
+            self.__breaker.reset()
+            self.__fields['message'].set_text(_('Testing...'))
+            self.query_async(self.__fields['message'].set_text, self.test_status,
+                             error=self.__test_failed)
+        elif btn == 'Clear':
+            self.clear_cache()
+            self.__fields['message'].set_text(_('Cache cleared'))
         elif btn == 'Visible':
             self.__fields['password'].set_visibility(button.get_active())
             self.set_nothidden(button.get_active())
+        elif btn == 'Offline':
+            self.set_offline(button.get_active())
+            self.__config.set('bookdb.offline', button.get_active())
+        elif btn == 'Sync':
+            task = self.__values['sync']
+            if task is not None and not task.done():
+                task.cancel()
+                self.__values['sync'] = None
+                self.__fields['message'].set_text(_('Sync stopped'))
+            else:
+                self.__button_update()
+                self.__fields['message'].set_text(_('Syncing...'))
+                self.__values['sync'] = self.sync_mirror(self.__synced, self.__sync_progress,
+                                                         error=self.__sync_failed)
+
+    def __sync_progress(self, progress):
+        """
+        Show how far the mirror sync has come
+        """
+        self.__fields['message'].set_text(_('Syncing %d/%d') % progress)
+
+    def __synced(self, complete):
+        """
+        The mirror sync is done or was stopped
+        """
+        self.__values['sync'] = None
+        if complete:
+            self.__fields['message'].set_text(_('Mirror up to date'))
+        else:
+            self.__fields['message'].set_text(_('Sync stopped'))
+
+    def __sync_failed(self, err):
+        """
+        The mirror sync failed, it goes on from there next time
+        """
+        self.__values['sync'] = None
+        self.__test_failed(err)
+
+    def __show_state(self):
+        """
+        Show the state of the circuit breaker and the query statistics,
+        called once a second
+        """
+        self.__show_breaker()
+        self.__fields['stats'].set_markup('<tt>%s</tt>' %
+                                          GLib.markup_escape_text(self.__stats_summary()))
+        return True
+
+    def __stats_summary(self):
+        """
+        One line of statistics per command used
+        """
+        lines = ['%-16s %6s %8s %8s %9s %8s %6s' %
+                 (_('Command'), _('Calls'), _('p50 ms'), _('p95 ms'), _('KiB'),
+                  _('Hits'), _('Errors'))]
+        for name, stats in sorted(self.__stats.snapshot().items()):
+            if stats['calls'] == 0:
+                continue
+            ms = []
+            for pct in (50, 95):
+                val = QueryStats.percentile(stats['latency'], pct)
+                ms.append('-' if val is None else '>%d' % (LATENCY_BUCKETS[-1] * 1000)
+                          if val == float('inf') else '%d' % (val * 1000))
+            lines.append('%-16s %6d %8s %8s %9.1f %8s %6d' %
+                         (name, stats['calls'], ms[0], ms[1], stats['bytes'] / 1024.0,
+                          '%d/%d' % (stats['hits'], stats['hits'] + stats['misses']),
+                          sum(stats['errors'].values())))
+        for (label, counters) in ((_('Prefetched'), self.__prefetch_stats),
+                                  (_('Mirror sync'), self.__sync_stats)):
+            snapshot = counters.snapshot().values()
+            calls = sum(stats['calls'] for stats in snapshot)
+            if calls != 0:
+                lines.append('%-16s %6d %8s %8s %9.1f' %
+                             (label, calls, '', '',
+                              sum(stats['bytes'] for stats in snapshot) / 1024.0))
+        return '\n'.join(lines)
+
+    def __show_breaker(self):
+        """
+        Show the state of the circuit breaker
+        """
+        (state, failures, wait) = self.__breaker.get_state()
+        if state == BREAKER_OPEN:
+            text = _('Server down, trying again in %d s') % int(wait + 0.5)
+        elif state == BREAKER_CLOSED and failures == 0:
+            text = _('Server up')
+        elif state == BREAKER_CLOSED:
+            text = _('Server up, %d failures in a row') % failures
+        else:
+            text = _('Server down, trying again')
+        if self.__values['offline']:
+            text = _('Offline') + ', ' + text
+        self.__fields['breaker'].set_text(text)
+
+    def __test_failed(self, err):
+        """
+        Show why the server could not be reached
+        """
+        self.__fields['message'].set_text(str(getattr(err, 'reason', err)))
 
     def __print(self, str):
         """
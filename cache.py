@@ -0,0 +1,325 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Cache module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from records import decode_record, encode_record
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+LRU_ENTRIES = 256
+LRU_BYTES = 32 * 1024 * 1024
+
+def cache_key(*parts):
+    """
+    Create a stable hash from strings and dicts
+    """
+    sha = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, dict):
+            part = json.dumps(sorted(part.items()))
+        sha.update(str(part).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+class DiskCache():
+    """
+    Persistent cache of bookDB answers
+
+    Every answer is stored as a json file in a directory for the
+    current scope, the scope being the server url and protocol version.
+    An entry holds the answer, the time it was stored, the validators
+    (ETag and Last-Modified) the server sent with it and the change
+    token of a list, if the server sent one.
+    """
+
+    __debug = False
+
+    def __init__(self, path):
+        """
+        init
+        """
+        self.__values = {'path': path, 'scope': None}
+
+    def set_scope(self, url, version):
+        """
+        Select the directory used for url and protocol version
+        """
+        self.__print('DiskCache::set_scope')
+
+        self.__values['scope'] = os.path.join(self.__values['path'],
+                                              cache_key(url, version))
+
+    def __file(self, cmd, params):
+        """
+        Name of the file holding an entry
+        """
+        return os.path.join(self.__values['scope'], cache_key(cmd, params) + '.json')
+
+    def get(self, cmd, params):
+        """
+        Return the entry stored for cmd and params, or None
+        """
+        if self.__values['scope'] is None:
+            return None
+
+        try:
+            with open(self.__file(cmd, params), encoding='utf-8') as fil:
+                entry = json.load(fil, object_hook=decode_record)
+                size = os.fstat(fil.fileno()).st_size
+        except (OSError, ValueError):
+            return None
+
+        if 'stored' not in entry or 'payload' not in entry:
+            return None
+        entry['size'] = size
+        return entry
+
+    def put(self, cmd, params, payload, etag=None, modified=None, token=None):
+        """
+        Store an answer
+        """
+        if self.__values['scope'] is None:
+            return
+
+        entry = {'cmd': cmd, 'params': params, 'stored': time.time(),
+                 'etag': etag, 'modified': modified, 'token': token,
+                 'payload': payload}
+        self.__write(self.__file(cmd, params), entry)
+
+    def touch(self, cmd, params, entry):
+        """
+        Mark a revalidated entry as fresh again
+        """
+        if self.__values['scope'] is None:
+            return
+
+        entry['stored'] = time.time()
+        self.__write(self.__file(cmd, params), entry)
+
+    def __write(self, name, entry):
+        """
+        Write an entry, replacing the old file in one step
+        """
+        try:
+            os.makedirs(self.__values['scope'], exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.__values['scope'], suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fil:
+                json.dump(entry, fil, default=encode_record)
+            os.replace(tmp, name)
+        except OSError as err:
+            print("Error: ", err)
+
+    def clear(self):
+        """
+        Remove all entries in the current scope
+        """
+        self.__print('DiskCache::clear')
+
+        if self.__values['scope'] is not None:
+            shutil.rmtree(self.__values['scope'], ignore_errors=True)
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
+
+class LruCache():
+    """
+    Bounded in-memory cache of bookDB answers
+
+    Entries are keyed on (cmd, params) and evicted least recently used
+    first when either the number of entries or their total size goes
+    over the limits. The policy maps each command to the number of
+    seconds an entry is kept, None meaning for the whole session.
+    Commands missing in the policy are never stored.
+    """
+
+    __debug = False
+
+    def __init__(self, policy, entries=LRU_ENTRIES, size=LRU_BYTES):
+        """
+        init
+        """
+        self.__lock = threading.Lock()
+        self.__store = collections.OrderedDict()
+        self.__values = {'policy': dict(policy), 'entries': entries,
+                         'size': size, 'used': 0}
+        self.__stats = {}
+
+    @staticmethod
+    def __key(cmd, params):
+        """
+        Create the key for cmd and params
+        """
+        return (cmd, tuple(sorted(params.items())))
+
+    def __count(self, cmd, what):
+        """
+        Count a hit or a miss, lock must be held
+        """
+        stats = self.__stats.setdefault(cmd, {'hits': 0, 'misses': 0})
+        stats[what] += 1
+
+    def set_limits(self, entries, size):
+        """
+        Set maximum number of entries and total size in bytes
+        """
+        self.__print('LruCache::set_limits')
+
+        with self.__lock:
+            self.__values['entries'] = max(0, int(entries))
+            self.__values['size'] = max(0, int(size))
+            self.__shrink_locked()
+
+    def set_policy(self, cmd, age):
+        """
+        Set number of seconds an answer to cmd is kept, None for ever
+        """
+        self.__print('LruCache::set_policy')
+
+        self.__values['policy'][cmd] = age
+
+    def remove_policy(self, cmd):
+        """
+        Stop storing answers to cmd
+        """
+        self.__print('LruCache::remove_policy')
+
+        self.__values['policy'].pop(cmd, None)
+        self.invalidate(cmd)
+
+    def handles(self, cmd):
+        """
+        Check if answers to cmd are stored
+        """
+        return cmd in self.__values['policy']
+
+    def get(self, cmd, params):
+        """
+        Return the answer stored for cmd and params, or None
+        """
+        if not self.handles(cmd):
+            return None
+
+        key = self.__key(cmd, params)
+        age = self.__values['policy'][cmd]
+        with self.__lock:
+            entry = self.__store.get(key)
+            if entry is not None and age is not None:
+                if time.monotonic() - entry[1] >= age:
+                    self.__drop_locked(key)
+                    entry = None
+            if entry is None:
+                self.__count(cmd, 'misses')
+                return None
+            self.__store.move_to_end(key)
+            self.__count(cmd, 'hits')
+            return entry[0]
+
+    def put(self, cmd, params, payload, size):
+        """
+        Store an answer of size bytes
+        """
+        if not self.handles(cmd) or size > self.__values['size']:
+            return
+
+        key = self.__key(cmd, params)
+        with self.__lock:
+            if key in self.__store:
+                self.__drop_locked(key)
+            self.__store[key] = (payload, time.monotonic(), size)
+            self.__values['used'] += size
+            self.__shrink_locked()
+
+    def __drop_locked(self, key):
+        """
+        Remove one entry, lock must be held
+        """
+        entry = self.__store.pop(key)
+        self.__values['used'] -= entry[2]
+
+    def __shrink_locked(self):
+        """
+        Evict entries until the cache is within its limits, lock must be held
+        """
+        while self.__store and \
+              (len(self.__store) > self.__values['entries'] or
+               self.__values['used'] > self.__values['size']):
+            key = next(iter(self.__store))
+            self.__drop_locked(key)
+
+    def invalidate(self, cmd=None, params=None):
+        """
+        Remove all entries, all for cmd, or the one for cmd and params
+        """
+        self.__print('LruCache::invalidate')
+
+        with self.__lock:
+            if cmd is None:
+                self.__store.clear()
+                self.__values['used'] = 0
+            elif params is not None:
+                key = self.__key(cmd, params)
+                if key in self.__store:
+                    self.__drop_locked(key)
+            else:
+                for key in [key for key in self.__store if key[0] == cmd]:
+                    self.__drop_locked(key)
+
+    def get_stats(self):
+        """
+        Return hit and miss counters per command, and current usage
+        """
+        with self.__lock:
+            return {'entries': len(self.__store), 'size': self.__values['used'],
+                    'commands': {cmd: dict(val) for cmd, val in self.__stats.items()}}
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
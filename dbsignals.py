@@ -0,0 +1,180 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Database signals module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+from functools import partial
+import time
+
+#------------------------------------------------------------------------
+#
+# Gtk modules
+#
+#------------------------------------------------------------------------
+from gi.repository import GLib
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+#
+# Seconds without signals that ends a burst, and the longest a burst
+# may go on before the handles collected so far are handed out
+#
+SIGNAL_QUIET = 0.25
+SIGNAL_MAX_WAIT = 2.0
+
+SIGNAL_ACTIONS = ('add', 'update', 'delete')
+
+class DbSignals():
+    """
+    The add, update and delete signals of a database, handed out in batches
+
+    The signals of each object type are connected once per database.
+    The handles they carry are collected until no signal has arrived
+    for SIGNAL_QUIET seconds, or SIGNAL_MAX_WAIT seconds have passed,
+    then the handler of each object type is called once with all
+    handles added, updated or deleted during the burst.
+    """
+
+    __debug = False
+
+    def __init__(self, quiet=SIGNAL_QUIET, max_wait=SIGNAL_MAX_WAIT):
+        """
+        init
+        """
+        self.__values = {'db': None, 'keys': [], 'handlers': {},
+                         'quiet': quiet, 'max_wait': max_wait,
+                         'source': None, 'first': 0.0, 'last': 0.0}
+        self.__pending = {}
+
+    def set_handler(self, obj_type, handler):
+        """
+        Call handler with the list of handles changed for obj_type,
+        such as 'source' or 'repository'
+        """
+        self.__print('DbSignals::set_handler ' + obj_type)
+
+        self.__values['handlers'][obj_type] = handler
+        if self.__values['db'] is not None:
+            self.__connect_type(obj_type)
+
+    def connect(self, db):
+        """
+        Listen to db, nothing is done if it already is
+        """
+        if db is self.__values['db']:
+            return
+        self.__print('DbSignals::connect')
+
+        self.disconnect()
+        self.__values['db'] = db
+        for obj_type in self.__values['handlers']:
+            self.__connect_type(obj_type)
+
+    def __connect_type(self, obj_type):
+        """
+        Connect the signals of one object type, if not done
+        """
+        if any(key[0] == obj_type for key in self.__values['keys']):
+            return
+        for action in SIGNAL_ACTIONS:
+            key = self.__values['db'].connect('%s-%s' % (obj_type, action),
+                                              partial(self.__signal, obj_type))
+            self.__values['keys'].append((obj_type, key))
+
+    def disconnect(self):
+        """
+        Stop listening, handles not yet handed out are dropped
+        """
+        self.__print('DbSignals::disconnect')
+
+        if self.__values['db'] is not None:
+            for (obj_type, key) in self.__values['keys']:
+                try:
+                    self.__values['db'].disconnect(key)
+                except (KeyError, AttributeError):
+                    pass
+        self.__values['db'] = None
+        self.__values['keys'] = []
+        self.__pending = {}
+        if self.__values['source'] is not None:
+            GLib.source_remove(self.__values['source'])
+            self.__values['source'] = None
+
+    def pending(self):
+        """
+        Check if there are handles not yet handed out
+        """
+        return any(len(handles) != 0 for handles in self.__pending.values())
+
+    def __signal(self, obj_type, handles):
+        """
+        A signal has arrived, save its handles
+        """
+        self.__pending.setdefault(obj_type, set()).update(handles)
+        self.__values['last'] = time.monotonic()
+        if self.__values['source'] is None:
+            self.__values['first'] = self.__values['last']
+            self.__arm(self.__values['quiet'])
+
+    def __arm(self, secs):
+        """
+        Call flush after secs
+        """
+        self.__values['source'] = GLib.timeout_add(int(secs * 1000) + 1,
+                                                   self.__flush)
+
+    def __flush(self):
+        """
+        Hand out the handles if the burst is over, called in the main loop
+        """
+        now = time.monotonic()
+        quiet = now - self.__values['last']
+        if quiet < self.__values['quiet'] and \
+           now - self.__values['first'] < self.__values['max_wait']:
+            self.__arm(self.__values['quiet'] - quiet)
+            return False
+
+        self.__values['source'] = None
+        pending = self.__pending
+        self.__pending = {}
+        self.__print('DbSignals::__flush ' +
+                     ', '.join('%s %d' % (obj_type, len(handles))
+                               for obj_type, handles in pending.items()))
+        for obj_type, handles in pending.items():
+            handler = self.__values['handlers'].get(obj_type)
+            if handler is not None:
+                handler(list(handles))
+        return False
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
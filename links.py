@@ -0,0 +1,148 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Links module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import json
+import os
+import tempfile
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+LINKS_FILE = 'swedishsources-links.json'
+LINKS_VERSION = 3
+
+class LinkIndex():
+    """
+    The bookDB links of a family tree, saved next to the database
+
+    The links are the RIN urls of the repositories and the BDBRIN
+    attributes of the sources, as the repository and source pages
+    keep them. They are saved in the family tree directory when the
+    tree is closed, together with a stamp of the database: its id and
+    the number of sources and repositories in it. The stamp is taken
+    when the tree is opened and again after each change handed to the
+    pages, so the links saved are used only if the tree looks the same
+    when it is opened next time. The stamp does not catch every change,
+    the pages show the links at once and check them against the tree
+    in the background.
+    """
+
+    __debug = False
+
+    def __init__(self):
+        """
+        init
+        """
+        self.__values = {'path': None, 'stamp': None}
+
+    def open(self, db):
+        """
+        Select the family tree db, return the saved links or None
+        """
+        self.__print('LinkIndex::open')
+
+        self.__values['path'] = None
+        self.__values['stamp'] = None
+        try:
+            path = db.get_save_path()
+        except AttributeError:
+            return None
+        if not path or not os.path.isdir(path):
+            return None
+        self.__values['path'] = path
+        self.update(db)
+
+        try:
+            with open(os.path.join(path, LINKS_FILE), encoding='utf-8') as fil:
+                data = json.load(fil)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(data, dict) or data.get('version') != LINKS_VERSION:
+            return None
+        if self.__values['stamp'] is None or data.get('stamp') != self.__values['stamp']:
+            self.__print('LinkIndex::open changed')
+            return None
+        return data
+
+    def update(self, db):
+        """
+        Take a new stamp of db, after its sources or repositories changed
+        """
+        if self.__values['path'] is None:
+            return
+        try:
+            self.__values['stamp'] = {'dbid': db.get_dbid(),
+                                      'sources': db.get_number_of_sources(),
+                                      'repositories': db.get_number_of_repositories()}
+        except Exception as err:
+            print("Error: ", err)
+            self.__values['stamp'] = None
+
+    def close(self, data):
+        """
+        Save the links of the family tree closed, data is a dict
+        holding the links of each page, None if they are not up to
+        date, the saved ones are then removed
+        """
+        self.__print('LinkIndex::close')
+
+        path = self.__values['path']
+        stamp = self.__values['stamp']
+        self.__values['path'] = None
+        self.__values['stamp'] = None
+        if path is None:
+            return
+
+        name = os.path.join(path, LINKS_FILE)
+        if data is None or stamp is None:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+            return
+
+        data = dict(data)
+        data['version'] = LINKS_VERSION
+        data['stamp'] = stamp
+        try:
+            fd, tmp = tempfile.mkstemp(dir=path, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fil:
+                json.dump(data, fil)
+            os.replace(tmp, name)
+        except OSError as err:
+            print("Error: ", err)
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
@@ -0,0 +1,524 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Mirror module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import json
+import os
+import sqlite3
+import threading
+import time
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from cache import cache_key
+from records import decode_record, encode_record
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+#
+# Number of book queries sent in one request while syncing
+#
+MIRROR_BATCH = 50
+
+MIRROR_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS steps (step TEXT PRIMARY KEY, done REAL)",
+    "CREATE TABLE IF NOT EXISTS answered (step TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS answers (cmd TEXT PRIMARY KEY, data TEXT)",
+    "CREATE TABLE IF NOT EXISTS counties "
+    "(cid TEXT PRIMARY KEY, pos INTEGER, row TEXT)",
+    "CREATE TABLE IF NOT EXISTS archives "
+    "(aid TEXT PRIMARY KEY, row TEXT, detail TEXT)",
+    "CREATE TABLE IF NOT EXISTS county_archives "
+    "(cid TEXT, pos INTEGER, aid TEXT, PRIMARY KEY (cid, pos))",
+    "CREATE TABLE IF NOT EXISTS booktypes (aid TEXT PRIMARY KEY, data TEXT)",
+    "CREATE TABLE IF NOT EXISTS books "
+    "(bid TEXT PRIMARY KEY, aid TEXT, cid TEXT, pos INTEGER, row TEXT, detail TEXT)",
+    "CREATE INDEX IF NOT EXISTS books_aid ON books (aid, pos)",
+    "CREATE INDEX IF NOT EXISTS books_cid ON books (cid, pos)",
+    "CREATE TABLE IF NOT EXISTS bookrefs (nid TEXT PRIMARY KEY, data TEXT)",
+    "CREATE TABLE IF NOT EXISTS repositories "
+    "(rin TEXT PRIMARY KEY, pos INTEGER, row TEXT, detail TEXT)",
+]
+
+class SyncStopped(Exception):
+    """
+    A sync was stopped before it was done
+    """
+
+def _dump(value):
+    """
+    Encode a record for the database
+    """
+    return json.dumps(value, sort_keys=True, separators=(',', ':'),
+                      default=encode_record)
+
+class Mirror():
+    """
+    Local copy of the bookDB catalogue in a SQLite file
+
+    There is one file per server url and protocol version. It is filled
+    by sync, in steps that are each committed on their own, so a sync
+    that is stopped goes on where it was the next time. Once a sync has
+    been through all steps, the next one starts over but only fetches
+    the details of books that are new or changed in the lists. The steps
+    of the last complete sync are kept apart from those of the running
+    one, so the mirror goes on answering while a new sync is made.
+
+    answer returns the same answer the server would give, or None if
+    the mirror does not hold it.
+    """
+
+    __debug = False
+
+    def __init__(self, path):
+        """
+        init
+        """
+        self.__lock = threading.RLock()
+        self.__values = {'path': path, 'file': None, 'db': None}
+
+    def set_scope(self, url, version):
+        """
+        Select the file used for url and protocol version
+        """
+        self.__print('Mirror::set_scope')
+
+        name = os.path.join(self.__values['path'],
+                            'mirror-%s.sqlite' % cache_key(url, version))
+        with self.__lock:
+            if name == self.__values['file']:
+                return
+            self.close()
+            self.__values['file'] = name
+
+    def __open(self):
+        """
+        Return the database connection, opening it if needed. Lock must
+        be held.
+        """
+        if self.__values['db'] is None and self.__values['file'] is not None:
+            os.makedirs(self.__values['path'], exist_ok=True)
+            db = sqlite3.connect(self.__values['file'], check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            for sql in MIRROR_SCHEMA:
+                db.execute(sql)
+            db.commit()
+            self.__values['db'] = db
+        return self.__values['db']
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self.__lock:
+            if self.__values['db'] is not None:
+                self.__values['db'].close()
+                self.__values['db'] = None
+
+    def clear(self):
+        """
+        Remove everything in the mirror
+        """
+        self.__print('Mirror::clear')
+
+        with self.__lock:
+            self.close()
+            if self.__values['file'] is not None:
+                for suffix in ('', '-wal', '-shm'):
+                    try:
+                        os.remove(self.__values['file'] + suffix)
+                    except OSError:
+                        pass
+
+    def __fetchone(self, sql, args=()):
+        """
+        Run a query and return the first row, or None
+        """
+        with self.__lock:
+            try:
+                db = self.__open()
+                if db is None:
+                    return None
+                return db.execute(sql, args).fetchone()
+            except sqlite3.Error as err:
+                print("Error: ", err)
+                return None
+
+    def __fetchall(self, sql, args=()):
+        """
+        Run a query and return all rows
+        """
+        with self.__lock:
+            try:
+                db = self.__open()
+                if db is None:
+                    return []
+                return db.execute(sql, args).fetchall()
+            except sqlite3.Error as err:
+                print("Error: ", err)
+                return []
+
+    def __done(self, step):
+        """
+        Check if a step has been synced in the running sync
+        """
+        return self.__fetchone("SELECT 1 FROM steps WHERE step = ?", (step,)) is not None
+
+    def __answered(self, step):
+        """
+        Check if a step has been synced in the running or last complete sync
+        """
+        return self.__fetchone("SELECT 1 FROM steps WHERE step = ? UNION ALL "
+                               "SELECT 1 FROM answered WHERE step = ?",
+                               (step, step)) is not None
+
+    def __rows(self, step, sql, args):
+        """
+        List of records for a step, None if it has not been synced
+        """
+        if not self.__answered(step):
+            return None
+        return [json.loads(row[0], object_hook=decode_record)
+                for row in self.__fetchall(sql, args)]
+
+    def __single(self, sql, args):
+        """
+        One stored json value, or None
+        """
+        row = self.__fetchone(sql, args)
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0], object_hook=decode_record)
+
+    def get_meta(self, key, default=None):
+        """
+        Get a value about the mirror
+        """
+        row = self.__fetchone("SELECT value FROM meta WHERE key = ?", (key,))
+        if row is None:
+            return default
+        return row[0]
+
+    def answer(self, cmd, params):
+        """
+        Answer a query from the mirror, None if it is not there
+        """
+        if cmd == 'TestSSPV':
+            if self.get_meta('synced') is None:
+                return None
+            return {'status': 'OK'}
+        if cmd == 'getCounties':
+            return self.__rows('counties',
+                               "SELECT row FROM counties ORDER BY pos", ())
+        if cmd == 'getRepositories':
+            if 'rin' in params:
+                return self.__single("SELECT detail FROM repositories WHERE rin = ?",
+                                     (params['rin'],))
+            return self.__rows('repos',
+                               "SELECT row FROM repositories ORDER BY pos", ())
+        if cmd == 'getArchives':
+            if 'aid' in params:
+                return self.__single("SELECT detail FROM archives WHERE aid = ?",
+                                     (params['aid'],))
+            return self.__rows('county:' + params.get('cid', ''),
+                               "SELECT a.row FROM county_archives c JOIN archives a "
+                               "ON a.aid = c.aid WHERE c.cid = ? ORDER BY c.pos",
+                               (params.get('cid', ''),))
+        if cmd == 'getBookTypes':
+            return self.__single("SELECT data FROM booktypes WHERE aid = ?",
+                                 (params.get('aid', ''),))
+        if cmd == 'getBooks':
+            if 'bid' in params:
+                return self.__single("SELECT detail FROM books WHERE bid = ?",
+                                     (params['bid'],))
+            return self.__rows('archive:' + params.get('aid', ''),
+                               "SELECT row FROM books WHERE aid = ? ORDER BY pos",
+                               (params.get('aid', ''),))
+        if cmd == 'getBookRefs':
+            return self.__single("SELECT data FROM bookrefs WHERE nid = ?",
+                                 (params.get('bid', ''),))
+        if cmd == 'getSCBBooks':
+            return self.__rows('scb:' + params.get('cid', ''),
+                               "SELECT row FROM books WHERE cid = ? ORDER BY pos",
+                               (params.get('cid', ''),))
+        if cmd in ('getSCBBookTypes', 'getSCBArchive'):
+            return self.__single("SELECT data FROM answers WHERE cmd = ?", (cmd,))
+        return None
+
+    def __write(self, step, func, *args):
+        """
+        Store the answers of a step in one transaction and mark it done
+        """
+        with self.__lock:
+            db = self.__open()
+            with db:
+                func(db, *args)
+                db.execute("INSERT OR REPLACE INTO steps VALUES (?, ?)",
+                           (step, time.time()))
+
+    def sync(self, fetch, report):
+        """
+        Download the catalogue, returns True when the mirror is complete
+
+        fetch is called with a list of (command name, params) and returns
+        a list of BookdbResult. report is called with (steps done, steps
+        known) and returns False to stop, the sync then goes on from the
+        same step next time.
+        """
+        self.__print('Mirror::sync')
+
+        with self.__lock:
+            if self.__open() is None:
+                return False
+            if self.get_meta('complete') == '1':
+                #
+                # Start a new pass, only changes are fetched. The steps
+                # of the last pass go on answering until it is done.
+                #
+                db = self.__open()
+                with db:
+                    db.execute("INSERT OR IGNORE INTO answered SELECT step FROM steps")
+                    db.execute("DELETE FROM steps")
+                    db.execute("DELETE FROM meta WHERE key = 'complete'")
+
+        progress = {'done': 0, 'total': 4}
+
+        def step(name, func):
+            """
+            Run a step unless done in an earlier sync
+            """
+            if not alive():
+                raise SyncStopped()
+            if not self.__done(name):
+                func(name)
+            progress['done'] += 1
+
+        def alive():
+            """
+            Report progress, False if the sync is to stop
+            """
+            return report((progress['done'], progress['total']))
+
+        def get(*queries):
+            """
+            Fetch answers, raising an error if any failed
+            """
+            results = fetch(list(queries))
+            for res in results:
+                if not res.ok():
+                    raise IOError('%s %s' % (res.status, res.code))
+            return [res.payload for res in results]
+
+        try:
+            step('counties', lambda name: self.__sync_counties(name, get))
+            step('repos', lambda name: self.__sync_repos(name, get))
+            step('scb', lambda name: self.__write(
+                name, self.__store_answers, get(('getSCBBookTypes', {}),
+                                                ('getSCBArchive', {}))))
+
+            cids = [row[0] for row in self.__fetchall("SELECT cid FROM counties ORDER BY pos")]
+            progress['total'] += 2 * len(cids)
+            for cid in cids:
+                step('county:' + cid, lambda name: self.__sync_county(name, cid, get))
+                step('scb:' + cid, lambda name: self.__sync_scb(name, cid, get))
+
+            aids = [row[0] for row in self.__fetchall(
+                "SELECT DISTINCT aid FROM county_archives ORDER BY aid")]
+            progress['total'] += 2 * len(aids) + len(cids)
+            for aid in aids:
+                step('archive:' + aid, lambda name: self.__sync_archive(name, aid, get))
+            for aid in aids:
+                step('details:' + aid, lambda name: self.__sync_details(
+                    name, "aid = ?", aid, get, alive))
+            for cid in cids:
+                step('scbdetails:' + cid, lambda name: self.__sync_details(
+                    name, "cid = ?", cid, get, alive))
+        except SyncStopped:
+            return False
+
+        alive()
+        self.__write('complete', self.__complete, {'complete': '1', 'synced': str(time.time())})
+        return True
+
+    @classmethod
+    def __complete(cls, db, values):
+        """
+        Make the steps of the sync done the ones answering
+        """
+        db.execute("DELETE FROM answered")
+        db.execute("INSERT INTO answered SELECT step FROM steps")
+        cls.__store_meta(db, values)
+
+    @staticmethod
+    def __store_meta(db, values):
+        """
+        Store values about the mirror
+        """
+        for key, value in values.items():
+            db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def __store_answers(db, answers):
+        """
+        Store the SCB book types and archive
+        """
+        for cmd, data in zip(('getSCBBookTypes', 'getSCBArchive'), answers):
+            db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?)", (cmd, _dump(data)))
+
+    def __sync_counties(self, name, get):
+        """
+        Fetch the counties
+        """
+        (counties,) = get(('getCounties', {}))
+
+        def store(db):
+            db.execute("DELETE FROM counties")
+            for idx, row in enumerate(counties):
+                db.execute("INSERT INTO counties VALUES (?, ?, ?)",
+                           (row['bdbCTid'], idx, _dump(row)))
+        self.__write(name, store)
+
+    def __sync_repos(self, name, get):
+        """
+        Fetch the repositories and the details of each
+        """
+        (repos,) = get(('getRepositories', {}))
+        details = get(*[('getRepositories', {'rin': row['rin']}) for row in repos])
+
+        def store(db):
+            db.execute("DELETE FROM repositories")
+            for idx, (row, detail) in enumerate(zip(repos, details)):
+                db.execute("INSERT INTO repositories VALUES (?, ?, ?, ?)",
+                           (row['rin'], idx, _dump(row), _dump(detail)))
+        self.__write(name, store)
+
+    def __sync_county(self, name, cid, get):
+        """
+        Fetch the archives listed for a county
+        """
+        (archives,) = get(('getArchives', {'cid': cid}))
+
+        def store(db):
+            db.execute("DELETE FROM county_archives WHERE cid = ?", (cid,))
+            for idx, row in enumerate(archives):
+                aid = row['bdbACid']
+                data = _dump(row)
+                db.execute("INSERT INTO county_archives VALUES (?, ?, ?)", (cid, idx, aid))
+                old = db.execute("SELECT row FROM archives WHERE aid = ?", (aid,)).fetchone()
+                if old is None:
+                    db.execute("INSERT INTO archives VALUES (?, ?, NULL)", (aid, data))
+                elif old[0] != data:
+                    db.execute("UPDATE archives SET row = ? WHERE aid = ?", (data, aid))
+        self.__write(name, store)
+
+    def __store_books(self, db, where, value, books):
+        """
+        Replace the list of books in an archive or SCB county. Details of
+        new or changed books are removed, so they are fetched again.
+        """
+        stored = dict(db.execute("SELECT bid, row FROM books WHERE %s" % where, (value,)))
+        keep = set()
+        aid = value if where.startswith('aid') else None
+        cid = value if where.startswith('cid') else None
+        for idx, row in enumerate(books):
+            bid = row['bdbBKid']
+            data = _dump(row)
+            keep.add(bid)
+            if stored.get(bid) == data:
+                db.execute("UPDATE books SET pos = ? WHERE bid = ?", (idx, bid))
+            else:
+                db.execute("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, NULL)",
+                           (bid, aid, cid, idx, data))
+        for bid in set(stored) - keep:
+            db.execute("DELETE FROM books WHERE bid = ?", (bid,))
+
+    def __sync_scb(self, name, cid, get):
+        """
+        Fetch the SCB books of a county
+        """
+        (books,) = get(('getSCBBooks', {'cid': cid}))
+        self.__write(name, self.__store_books, "cid = ?", cid, books)
+
+    def __sync_archive(self, name, aid, get):
+        """
+        Fetch an archive, its book types and its books
+        """
+        (detail, btypes, books) = get(('getArchives', {'aid': aid}),
+                                      ('getBookTypes', {'aid': aid}),
+                                      ('getBooks', {'aid': aid}))
+
+        def store(db):
+            db.execute("UPDATE archives SET detail = ? WHERE aid = ?", (_dump(detail), aid))
+            db.execute("INSERT OR REPLACE INTO booktypes VALUES (?, ?)", (aid, _dump(btypes)))
+            self.__store_books(db, "aid = ?", aid, books)
+        self.__write(name, store)
+
+    def __sync_details(self, name, where, value, get, alive):
+        """
+        Fetch the details and book refs of books not yet known, in batches
+        committed one by one
+        """
+        while True:
+            bids = [row[0] for row in self.__fetchall(
+                "SELECT bid FROM books WHERE %s AND detail IS NULL ORDER BY pos LIMIT ?" % where,
+                (value, MIRROR_BATCH))]
+            if not bids:
+                break
+            details = get(*[('getBooks', {'bid': bid}) for bid in bids])
+            nids = [detail['nadBKid'] for detail in details
+                    if detail.get('nadBKid', '0') != '0']
+            refs = get(*[('getBookRefs', {'bid': nid}) for nid in nids]) if nids else []
+
+            def store(db):
+                for bid, detail in zip(bids, details):
+                    db.execute("UPDATE books SET detail = ? WHERE bid = ?",
+                               (_dump(detail), bid))
+                for nid, ref in zip(nids, refs):
+                    db.execute("INSERT OR REPLACE INTO bookrefs VALUES (?, ?)",
+                               (nid, _dump(ref)))
+            with self.__lock:
+                db = self.__open()
+                with db:
+                    store(db)
+            if not alive():
+                raise SyncStopped()
+        self.__write(name, lambda db: None)
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
@@ -0,0 +1,395 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Connection pool module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import http.client
+import random
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+POOL_SIZE = 4
+POOL_IDLE = 60
+
+#
+# Seconds to wait for a connection, and for data once connected
+#
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+#
+# Consecutive failures opening the breaker, and seconds before a
+# request is let through again to probe the server
+#
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+
+#
+# Retry backoff, seconds before the first retry and the most waited
+#
+RETRY_BASE = 0.5
+RETRY_CAP = 8.0
+
+#
+# Errors raised when a kept-alive connection has been dropped by the
+# server while it was idle in the pool.
+#
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+class PooledResponse():
+    """
+    Response from a pooled connection
+
+    The connection is handed back to the pool when the response is
+    closed, but only if the body has been read to the end and the
+    server has not asked to close the connection.
+    """
+
+    def __init__(self, pool, key, conn, resp):
+        """
+        init
+        """
+        self.__pool = pool
+        self.__key = key
+        self.__conn = conn
+        self.__resp = resp
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, amt=None):
+        """
+        Read from the response body
+        """
+        return self.__resp.read(amt)
+
+    def close(self):
+        """
+        Release the connection
+        """
+        if self.__conn is None:
+            return
+
+        reuse = self.__resp.isclosed() and not self.__resp.will_close
+        self.__resp.close()
+        if reuse:
+            self.__pool.release(self.__key, self.__conn)
+        else:
+            self.__conn.close()
+        self.__conn = None
+
+class ConnectionPool():
+    """
+    Pool of HTTP/1.1 keep-alive connections
+    """
+
+    __debug = False
+
+    def __init__(self, size=POOL_SIZE, idle=POOL_IDLE):
+        """
+        init
+        """
+        self.__lock = threading.Lock()
+        self.__idle = {}
+        self.__values = {'size': size, 'idle': idle,
+                         'connect': CONNECT_TIMEOUT, 'read': READ_TIMEOUT}
+
+    def set_size(self, size):
+        """
+        Set number of idle connections kept per server
+        """
+        self.__print('ConnectionPool::set_size')
+
+        self.__values['size'] = max(0, int(size))
+        self.evict()
+
+    def set_idle(self, idle):
+        """
+        Set number of seconds an idle connection is kept
+        """
+        self.__print('ConnectionPool::set_idle')
+
+        self.__values['idle'] = max(0, int(idle))
+        self.evict()
+
+    def set_timeouts(self, connect, read):
+        """
+        Set seconds to wait for a connection and for data, idle
+        connections are closed so all use the new values
+        """
+        self.__print('ConnectionPool::set_timeouts')
+
+        self.__values['connect'] = max(0.1, float(connect))
+        self.__values['read'] = max(0.1, float(read))
+        self.close()
+
+    @staticmethod
+    def __split(url):
+        """
+        Split url into a pool key and the request target
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError('unknown url: %s' % url)
+
+        port = parts.port
+        if port is None:
+            port = 443 if parts.scheme == 'https' else 80
+
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        return (parts.scheme, parts.hostname, port), target
+
+    def __connect(self, key):
+        """
+        Open a new connection
+        """
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.__values['connect'],
+                                               context=ssl.create_default_context())
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.__values['connect'])
+        conn.connect()
+        conn.sock.settimeout(self.__values['read'])
+        return conn
+
+    def __acquire(self, key):
+        """
+        Fetch an idle connection, or None if there is none
+        """
+        with self.__lock:
+            self.__evict_locked()
+            idle = self.__idle.get(key, [])
+            if idle:
+                return idle.pop()[0]
+        return None
+
+    def release(self, key, conn):
+        """
+        Hand a connection back to the pool
+        """
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.__values['size']:
+                idle.append((conn, time.monotonic()))
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def __evict_locked(self):
+        """
+        Close connections that have been idle too long, lock must be held
+        """
+        limit = time.monotonic() - self.__values['idle']
+        for key in list(self.__idle):
+            keep = []
+            for conn, used in self.__idle[key]:
+                if used < limit or len(keep) >= self.__values['size']:
+                    conn.close()
+                else:
+                    keep.append((conn, used))
+            if keep:
+                self.__idle[key] = keep
+            else:
+                del self.__idle[key]
+
+    def evict(self):
+        """
+        Close connections that have been idle too long
+        """
+        with self.__lock:
+            self.__evict_locked()
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        self.__print('ConnectionPool::close')
+
+        with self.__lock:
+            for idle in self.__idle.values():
+                for conn, used in idle:
+                    conn.close()
+            self.__idle = {}
+
+    def open(self, url, headers):
+        """
+        Send a GET request and return a PooledResponse
+
+        A request on a reused connection that the server has dropped is
+        sent once more on a fresh connection.
+        """
+        key, target = self.__split(url)
+
+        conn = self.__acquire(key)
+        while True:
+            reused = conn is not None
+            try:
+                if not reused:
+                    conn = self.__connect(key)
+                conn.request('GET', target, headers=headers)
+                resp = conn.getresponse()
+            except STALE_ERRORS as err:
+                conn.close()
+                if reused:
+                    self.__print('ConnectionPool::open reconnect')
+                    conn = None
+                    continue
+                raise urllib.error.URLError(err)
+            except (OSError, http.client.HTTPException) as err:
+                if conn is not None:
+                    conn.close()
+                raise urllib.error.URLError(err)
+            return PooledResponse(self, key, conn, resp)
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
+
+def backoff(attempt):
+    """
+    Seconds to wait before retry number attempt, counted from 0
+
+    Exponential with full jitter, so clients that failed together do not
+    come back together.
+    """
+    return random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt))
+
+class CircuitBreaker():
+    """
+    Fail fast while the server is known to be down
+
+    The breaker opens after a number of failures in a row. While open
+    no request is let through, until the reset time has passed and one
+    request is allowed to probe the server (half open). The probe
+    closes the breaker if it succeeds and opens it again if it fails.
+    """
+
+    __debug = False
+
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        """
+        init
+        """
+        self.__lock = threading.Lock()
+        self.__values = {'failures': failures, 'reset': reset,
+                         'state': BREAKER_CLOSED, 'count': 0, 'opened': 0.0,
+                         'probing': False, 'probed': 0.0}
+
+    def allow(self):
+        """
+        Check if a request may be sent
+        """
+        with self.__lock:
+            if self.__values['state'] == BREAKER_CLOSED:
+                return True
+            if self.__values['state'] == BREAKER_OPEN:
+                if time.monotonic() - self.__values['opened'] < self.__values['reset']:
+                    return False
+                self.__print('CircuitBreaker::allow half open')
+                self.__values['state'] = BREAKER_HALF_OPEN
+                self.__values['probing'] = False
+            #
+            # One probe at a time, unless it never reported back
+            #
+            now = time.monotonic()
+            if self.__values['probing'] and \
+               now - self.__values['probed'] < self.__values['reset']:
+                return False
+            self.__values['probing'] = True
+            self.__values['probed'] = now
+            return True
+
+    def success(self):
+        """
+        A request got an answer
+        """
+        with self.__lock:
+            self.__values['state'] = BREAKER_CLOSED
+            self.__values['count'] = 0
+            self.__values['probing'] = False
+
+    def failure(self):
+        """
+        A request got no answer
+        """
+        with self.__lock:
+            self.__values['count'] += 1
+            if self.__values['state'] == BREAKER_HALF_OPEN or \
+               self.__values['count'] >= self.__values['failures']:
+                self.__print('CircuitBreaker::failure open')
+                self.__values['state'] = BREAKER_OPEN
+                self.__values['opened'] = time.monotonic()
+            self.__values['probing'] = False
+
+    def reset(self):
+        """
+        Close the breaker, as if the server was known to be up
+        """
+        self.success()
+
+    def get_state(self):
+        """
+        Return (state, failures in a row, seconds until a probe is allowed)
+        """
+        with self.__lock:
+            wait = 0.0
+            if self.__values['state'] == BREAKER_OPEN:
+                wait = max(0.0, self.__values['reset'] -
+                           (time.monotonic() - self.__values['opened']))
+            return (self.__values['state'], self.__values['count'], wait)
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
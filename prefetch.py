@@ -0,0 +1,182 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Prefetch module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import threading
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+#
+# Depth 0 turns prefetching off, 1 fetches the archives in a county,
+# 2 also their book types and 3 also their books
+#
+PREFETCH_DEPTH = 3
+
+#
+# Bytes per second, 0 for no limit
+#
+PREFETCH_RATE = 256 * 1024
+
+#
+# Seconds to wait before looking again if interactive queries are done
+#
+PREFETCH_POLL = 0.05
+
+class Prefetcher():
+    """
+    Background thread warming the caches
+
+    A plan is a function called with the depth, returning an iterator
+    that runs one query each step and yields its BookdbResult. Only one
+    plan runs at a time, starting a new one abandons the old. Before each
+    step the prefetcher waits until the worker has no queries of its own,
+    and after it sleeps long enough to keep within the byte rate.
+    """
+
+    __debug = False
+
+    def __init__(self, worker, depth=PREFETCH_DEPTH, rate=PREFETCH_RATE):
+        """
+        init
+        """
+        self.__cond = threading.Condition()
+        self.__values = {'worker': worker,
+                         'depth': depth, 'rate': rate,
+                         'plan': None, 'generation': 0, 'thread': None}
+
+    def set_depth(self, depth):
+        """
+        Set how deep plans go, 0 turns prefetching off
+        """
+        self.__print('Prefetcher::set_depth')
+
+        self.__values['depth'] = max(0, int(depth))
+        if self.__values['depth'] == 0:
+            self.stop()
+
+    def set_rate(self, rate):
+        """
+        Set maximum number of bytes per second, 0 for no limit
+        """
+        self.__print('Prefetcher::set_rate')
+
+        self.__values['rate'] = max(0, int(rate))
+
+    def start(self, plan):
+        """
+        Run a plan instead of the current one
+        """
+        self.__print('Prefetcher::start')
+
+        if self.__values['depth'] == 0:
+            return
+        with self.__cond:
+            self.__values['generation'] += 1
+            self.__values['plan'] = plan
+            if self.__values['thread'] is None:
+                self.__values['thread'] = threading.Thread(
+                    target=self.__loop, name='bookdb-prefetch', daemon=True)
+                self.__values['thread'].start()
+            self.__cond.notify()
+
+    def stop(self):
+        """
+        Abandon the current plan
+        """
+        self.__print('Prefetcher::stop')
+
+        with self.__cond:
+            self.__values['generation'] += 1
+            self.__values['plan'] = None
+
+    def __current(self, generation):
+        """
+        Check if a plan is still the one to run
+        """
+        return generation == self.__values['generation']
+
+    def __wait(self, generation, seconds):
+        """
+        Sleep, waking up early if the plan is replaced. Returns False
+        if the plan is no longer current.
+        """
+        with self.__cond:
+            if seconds > 0 and self.__current(generation):
+                self.__cond.wait(seconds)
+            return self.__current(generation)
+
+    def __loop(self):
+        """
+        Run plans as they are started
+        """
+        while True:
+            with self.__cond:
+                while self.__values['plan'] is None:
+                    self.__cond.wait()
+                plan = self.__values['plan']
+                self.__values['plan'] = None
+                generation = self.__values['generation']
+            try:
+                self.__run(plan, generation)
+            except Exception as err:
+                print("Error: ", err)
+
+    def __run(self, plan, generation):
+        """
+        Run the steps of a plan until done or replaced
+        """
+        self.__print('Prefetcher::__run')
+
+        steps = iter(plan(self.__values['depth']))
+        while True:
+            #
+            # Interactive queries go first
+            #
+            while self.__values['worker'].busy():
+                if not self.__wait(generation, PREFETCH_POLL):
+                    return
+            if not self.__current(generation):
+                return
+
+            res = next(steps, None)
+            if res is None:
+                return
+
+            rate = self.__values['rate']
+            if rate > 0 and res.size > 0:
+                if not self.__wait(generation, float(res.size) / rate):
+                    return
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
@@ -0,0 +1,209 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Records module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import sys
+
+#------------------------------------------------------------------------
+#
+# Records
+#
+#------------------------------------------------------------------------
+
+class Record():
+    """
+    Compact record decoded from a bookDB answer
+
+    The fields are slots named as the keys in the answer, and a record
+    is read like the dict it replaces: record['bdbACname'], get, keys,
+    items and in. Keys not known to the class are kept in a small dict.
+    Values of the fields in _interned are interned, so the many records
+    sharing a type or county id share one string.
+    """
+
+    __slots__ = ('_extra',)
+
+    _fields = ()
+    _interned = frozenset()
+    _known = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Collect the field names of a record class
+        """
+        super().__init_subclass__(**kwargs)
+        cls._fields = cls.__slots__
+        cls._known = frozenset(cls.__slots__)
+
+    def __init__(self, values):
+        """
+        init
+        """
+        extra = None
+        for key, value in values.items():
+            if key in self._interned and isinstance(value, str):
+                value = sys.intern(value)
+            if key in self._known:
+                setattr(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        self._extra = extra
+
+    def __getitem__(self, key):
+        if key in self._known:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def get(self, key, default=None):
+        """
+        Get a field, or default if it is not set
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def keys(self):
+        """
+        Names of the fields that are set
+        """
+        ret = [key for key in self._fields if hasattr(self, key)]
+        if self._extra is not None:
+            ret.extend(self._extra)
+        return ret
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        """
+        (name, value) of the fields that are set
+        """
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """
+        The record as a dict, as it was in the answer
+        """
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+class County(Record):
+    """
+    Row of getCounties
+    """
+    __slots__ = ('bdbCTid', 'bdbCTname')
+    _interned = frozenset(__slots__)
+
+class Archive(Record):
+    """
+    Row of getArchives, with the details when asked for by aid
+    """
+    __slots__ = ('bdbACid', 'bdbACname', 'bdbCTid', 'bdbACauthor', 'bdbREid',
+                 'bdbACref', 'bdbBKchk')
+    _interned = frozenset(('bdbCTid', 'bdbREid'))
+
+class Book(Record):
+    """
+    Row of getBooks and getSCBBooks, with the details when asked for by bid
+    """
+    __slots__ = ('bdbBKid', 'nadBTid', 'nadBTidSpec', 'nadBKperiod', 'bdbBKsignum',
+                 'nadBKextra', 'nadBTidReal', 'nadSTsignum', 'nadBKvol', 'nadBKid',
+                 'nadBKchkBr', 'adBKid', 'adBKvol', 'adACchkBK', 'bdbBKchk')
+    _interned = frozenset(('nadBTid', 'nadBTidSpec', 'nadBTidReal', 'nadBKperiod',
+                           'nadSTsignum', 'nadBKextra', 'nadBKvol'))
+
+class BookRef(Record):
+    """
+    Row of getBookRefs
+    """
+    __slots__ = ('nadBRtype', 'nadBRref')
+    _interned = frozenset(('nadBRtype',))
+
+class Repository(Record):
+    """
+    Row of getRepositories
+    """
+    __slots__ = ('rin', 'name', 'gramps_id', 'type', 'ref')
+    _interned = frozenset(('type', 'ref', 'gramps_id'))
+
+class RepositoryInfo(Record):
+    """
+    Row of getRepositories rin=
+    """
+    __slots__ = ('bdbRItype', 'bdbRIinfo', 'bdbRIrow')
+    _interned = frozenset(('bdbRItype', 'bdbRIrow'))
+
+def decode_record(values):
+    """
+    json object_hook turning bookDB rows into records, anything else is
+    left a dict
+    """
+    if 'bdbBKid' in values:
+        return Book(values)
+    if 'bdbACid' in values:
+        return Archive(values)
+    if 'bdbCTid' in values and 'bdbCTname' in values:
+        return County(values)
+    if 'nadBRtype' in values:
+        return BookRef(values)
+    if 'bdbRItype' in values:
+        return RepositoryInfo(values)
+    if 'rin' in values and 'name' in values:
+        return Repository(values)
+    return values
+
+def encode_record(value):
+    """
+    json default, writing a record as the dict it came from
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError('%r is not JSON serializable' % value)
@@ -25,6 +25,7 @@ Repository Page module
 # Python modules
 #
 #------------------------------------------------------------------------
+from functools import partial
 
 #------------------------------------------------------------------------
 #
@@ -43,6 +44,10 @@ from gramps.gen.lib import Address
 from gramps.gen.lib import Repository, RepositoryType
 from gramps.gen.lib import Url, UrlType
 from gramps.gen.const import GRAMPS_LOCALE as glocale
+
+from scan import repository_rins, scan_repositories
+from worker import IdleTask
+
 try:
     _trans = glocale.get_addon_translator(__file__)
 except ValueError:
@@ -65,7 +70,9 @@ class RepoPage():
                 'add_btn': None, 'add_label': None}
     __gramplet = None
     __values = {'repo': 0, 'repo_name': None, 'repo_sel': [],
-                'page': None}
+                'page': None, 'by_rin': {}, 'by_ref': {},
+                'db': None, 'url': None, 'links': {}, 'repo_rins': {},
+                'scan': None, 'seen': None, 'add': None}
     trans = None
 
     def __init__(self, gramplet, config):
@@ -77,7 +84,7 @@ class RepoPage():
         self.__gramplet = gramplet
         self.__config = config
 
-    def __add_repo_rin(self):
+    def __add_repo_rin(self, repo_rin):
         """
         Create a RIN record to be added to the url list
         """
@@ -85,7 +92,7 @@ class RepoPage():
 
         rin = Url()
         rin.set_path(self.__gramplet.pages['bookdb'].get_url())
-        rin.set_description('RIN ' + self.__values['repo_sel'][0])
+        rin.set_description('RIN ' + repo_rin)
         rin.set_type(UrlType.UNKNOWN)
 
         return rin
@@ -105,16 +112,48 @@ class RepoPage():
 
     def __add_repo(self):
         """
-        Save current configuration
+        Fetch the repository selected in the background, it is added
+        when the answer arrives
         """
         self.__print("RepoPage::__add_repo")
 
-        bdb_info = self.__gramplet.pages['bookdb'].query_repository(self.__values['repo_sel'][0])
+        # the links loaded with the family tree must be checked first
+        if self.__values['scan'] is not None and self.__values['seen'] is not None:
+            self.__values['scan'].finish()
+            if self.__values['repo_sel'][0] in self.__values['links']:
+                self.__fields['add_btn'].set_sensitive(False)
+                return
+
+        rin = self.__values['repo_sel'][0]
+        bookdb = self.__gramplet.pages['bookdb']
+        self.__fields['add_btn'].set_sensitive(False)
+        self.__values['add'] = bookdb.query_async(partial(self.__fetched_repo, rin),
+                                                  bookdb.query_repository, rin,
+                                                  error=self.__fetch_failed)
+
+    def __fetch_failed(self, err):
+        """
+        The repository could not be fetched
+        """
+        self.__values['add'] = None
+        print("Error: ", err)
+        self.__fields['add_btn'].set_sensitive(True)
+
+    def __fetched_repo(self, rin, bdb_info):
+        """
+        Save the repository fetched
+        """
+        self.__print("RepoPage::__fetched_repo")
+
+        self.__values['add'] = None
+        if not bdb_info:
+            self.__fields['add_btn'].set_sensitive(True)
+            return
 
         repo = Repository()
-        repo.set_type(self.get_type(self.__values['repo_sel'][0]))
+        repo.set_type(self.get_type(rin))
 
-        repo.add_url(self.__add_repo_rin())
+        repo.add_url(self.__add_repo_rin(rin))
 
         inter = self.__config.get('behavior.repo_i8n')
 
@@ -205,7 +244,47 @@ class RepoPage():
 #            print(self.__values['repo_sel'][:])
             self.__fields['add_btn'].set_sensitive(True)
             self.__fields['add_label'].set_text(self.__values['repo_sel'][1])
-        self.update_store()
+
+    def __fill_repo(self, repos):
+        """
+        Fill repo_name with all repositories known by bookDB
+        """
+        self.__print('RepoPage::__fill_repo')
+
+        for entry in repos:
+            self.__values['repo_name'].append([entry['rin'], entry['name'],
+                                               entry['gramps_id'], entry['type'],
+                                               entry['ref']])
+        self.__update_index()
+        if self.__values['db'] is None:
+            self.update_store()
+        else:
+            self.__refresh_store()
+
+    def __update_index(self):
+        """
+        Index the rows in repo_name by rin and by ref
+        """
+        self.__print('RepoPage::__update_index')
+
+        by_rin = {}
+        by_ref = {}
+        if self.__values['repo_name'] is not None:
+            for row in self.__values['repo_name']:
+                by_rin[row[0]] = row.iter
+                if row[4] != '':
+                    by_ref[row[4]] = row.iter
+        self.__values['by_rin'] = by_rin
+        self.__values['by_ref'] = by_ref
+
+    def __row(self, index, key):
+        """
+        Return the row in repo_name with key in index, or None
+        """
+        tree_iter = self.__values[index].get(key)
+        if tree_iter is None:
+            return None
+        return self.__values['repo_name'][tree_iter]
 
     @staticmethod
     def __fix_phone(phone):
@@ -277,13 +356,9 @@ class RepoPage():
 
             page.add(repo_box)
 
-            repos = self.__gramplet.pages['bookdb'].query_repositories()
             self.__values['repo_name'] = Gtk.ListStore(str, str, str, str, str)
-            for entry in repos:
-                self.__values['repo_name'].append([entry['rin'], entry['name'],
-                                                   entry['gramps_id'], entry['type'],
-                                                   entry['ref']])
-            self.update_store()
+            bookdb = self.__gramplet.pages['bookdb']
+            bookdb.query_async(self.__fill_repo, bookdb.query_repositories)
 
             tree = Gtk.TreeView(self.__values['repo_name'])
             renderer = Gtk.CellRendererText()
@@ -311,53 +386,119 @@ class RepoPage():
         """
         Return gramps_id for Repository
         """
-        for entry in list(self.__values['repo_name']):
-            if entry[0] == rin:
-                return entry[2]
-        return ''
+        row = self.__row('by_rin', rin)
+        if row is None:
+            return ''
+        return row[2]
 
     def get_gramps_id_by_ref(self, ref):
         """
         Return gramps_id for Repository by ref
         """
-        for entry in list(self.__values['repo_name']):
-            if entry[4] == ref:
-                return entry[2]
-        return ''
+        row = self.__row('by_ref', ref)
+        if row is None:
+            return ''
+        return row[2]
 
     def get_rin_by_ref(self, ref):
         """
         Return rin for Repository by ref
         """
-        for entry in list(self.__values['repo_name']):
-            if entry[4] == ref:
-                return entry[0]
-        return 0
+        row = self.__row('by_ref', ref)
+        if row is None:
+            return 0
+        return row[0]
 
     def get_type(self, rin):
         """
         Return gramps RepoType for Repository
         """
-        for entry in list(self.__values['repo_name']):
-            if entry[0] == rin:
-                return int(entry[3])
-        return 4
+        row = self.__row('by_rin', rin)
+        if row is None:
+            return 4
+        return int(row[3])
 
     def get_name(self, rin):
         """
         Return gramps RepoType for Repository
         """
-        for entry in list(self.__values['repo_name']):
-            if entry[0] == rin:
-                return entry[1]
-        return ''
+        row = self.__row('by_rin', rin)
+        if row is None:
+            return ''
+        return row[1]
 
     def update(self, obj):
         """
         called from Swedish Sources on db changes
+
+        obj is the list of repository handles added, updated or deleted,
+        only these are read again.
+        """
+        self.__print('RepoPage::update')
+
+        if self.__values['db'] is not self.__gramplet.dbstate.db:
+            self.update_store()
+            return
+
+        # repositories changed are not checked again by a running scan
+        if self.__values['seen'] is not None:
+            self.__values['seen'].update(obj)
+
+        changed = set()
+        for handle in obj:
+            changed.update(self.__unlink_repo(handle))
+            if self.__gramplet.dbstate.db.has_repository_handle(handle):
+                changed.update(self.__link_repo(handle))
+        for rin in changed:
+            self.__show_link(rin)
+
+    def open_db(self):
         """
-#        print(obj)
-        self.update_store()
+        Scan the repositories if the database or bookDB url has changed
+        """
+        self.__print('RepoPage::open_db')
+
+        if self.__values['db'] is not self.__gramplet.dbstate.db or \
+           self.__values['url'] != self.__gramplet.pages['bookdb'].get_url():
+            self.update_store()
+
+    def get_links(self):
+        """
+        Return the links to bookDB, to be saved with the family tree
+        """
+        self.__print('RepoPage::get_links')
+
+        if self.__values['db'] is None or self.__values['scan'] is not None:
+            return None
+        return {'url': self.__values['url'],
+                'links': self.__values['links'],
+                'repo_rins': self.__values['repo_rins']}
+
+    def set_links(self, data):
+        """
+        Show links saved with the family tree while it is scanned
+
+        Returns False if they are not usable.
+        """
+        self.__print('RepoPage::set_links')
+
+        if not data or data.get('url') != self.__gramplet.pages['bookdb'].get_url():
+            return False
+
+        self.stop_scan()
+        self.__values['db'] = self.__gramplet.dbstate.db
+        self.__values['url'] = data['url']
+        self.__values['links'] = {rin: tuple(link) for rin, link in data['links'].items()}
+        self.__values['repo_rins'] = data['repo_rins']
+        self.__refresh_store()
+
+        # the saved links are checked against the repositories, those
+        # not found are removed when the scan is done
+        self.__values['seen'] = set()
+        self.__values['scan'] = IdleTask(self.__scan(), self.__scanned,
+                                         self.__scan_progress,
+                                         error=self.__scan_failed)
+        return True
 
     def update_store(self):
         """
@@ -370,44 +511,178 @@ class RepoPage():
 
         In the description of the url the text constant "RIN "
         is followed by the internal id for the repository in bookDB.
+
+        All repositories are read, this is only needed when a database
+        is opened, later changes are handled by update. They are read
+        in slices of the main loop and every row is updated as soon as
+        its repository is found.
         """
         self.__print("RepoPage::update_store")
 
-        found = []
-        url = self.__gramplet.pages['bookdb'].get_url()
+        self.stop_scan()
+        self.__values['db'] = self.__gramplet.dbstate.db
+        self.__values['url'] = self.__gramplet.pages['bookdb'].get_url()
+        self.__values['links'] = {}
+        self.__values['repo_rins'] = {}
+        self.__refresh_store()
 
-        # check all repositories for RIN information
-        for handle in self.__gramplet.dbstate.db.get_repository_handles():
+        self.__values['scan'] = IdleTask(self.__scan(), self.__scanned,
+                                         self.__scan_progress,
+                                         error=self.__scan_failed)
 
-            # fetch a repository
-            repo = self.__gramplet.dbstate.db.get_repository_from_handle(handle)
+    def __scan(self):
+        """
+        Generator reading all repositories, yields (read, total) now and then
 
-            # if no urls, skip this repositoy
-            if len(repo.urls) == 0:
-                continue
+        When the links were loaded, the repositories read are collected
+        in seen and only those whose links differ are linked again.
+        """
+        total = self.__values['db'].get_number_of_repositories()
+        seen = self.__values['seen']
 
-            # For each url, check if it contains RIN information
-            for post in repo.urls:
-                if post.type != UrlType.UNKNOWN:
-                    continue
-                if post.path != url:
-                    continue
-                if post.get_description()[:4] != "RIN ":
+        # check all repositories for RIN information, the raw data is
+        # read and only repositories with RIN urls are looked at
+        for item in scan_repositories(self.__values['db'], self.__values['url'],
+                                      ticks=True):
+            if isinstance(item, int):
+                yield (item, total)
+                continue
+            (handle, data, rins) = item
+            if seen is not None:
+                seen.add(handle)
+                if self.__linked(handle, data, rins):
+                    yield None
                     continue
+                for rin in self.__unlink_repo(handle):
+                    self.__show_link(rin)
+            self.__add_links(handle, data, rins)
+            for rin in rins:
+                self.__show_link(rin)
+            yield None
 
-                # Yes, extract bookDB RIN
-                rin = post.get_description()[4:].strip()
+        if seen is not None:
+            # repositories deleted or without RIN since the links were saved
+            for handle in [handle for handle in self.__values['repo_rins']
+                           if handle not in seen]:
+                for rin in self.__unlink_repo(handle):
+                    self.__show_link(rin)
 
-                # Check if it is in repo_name
-                for row in list(self.__values['repo_name']):
-                    if row[0] == rin:
-                        row[2] = repo.get_gramps_id()
-                        row[3] = str(repo.get_type())
-                        found.append(rin)
+    def __scan_progress(self, value):
+        """
+        Show how far the scan has come
+        """
+        self.__gramplet.show_progress('repo', _('Repositories'), value[0], value[1])
 
-        # clear the gramps id and type for every repository not found
-        if not self.__values['repo_name'] is None:
-            for row in list(self.__values['repo_name']):
-                if row[0] in found:
-                    continue
-                row[2] = ""
+    def __scanned(self):
+        """
+        All repositories have been read
+        """
+        self.__print("RepoPage::__scanned")
+
+        self.__values['scan'] = None
+        self.__values['seen'] = None
+        self.__gramplet.show_progress('repo', None)
+
+    def __scan_failed(self, err):
+        """
+        The scan stopped with an error, it is done again next time
+        """
+        self.__print("RepoPage::__scan_failed")
+
+        print("Error: ", err)
+        self.__values['scan'] = None
+        self.__values['seen'] = None
+        self.__values['db'] = None
+        self.__gramplet.show_progress('repo', None)
+
+    def stop_scan(self):
+        """
+        Stop reading the repositories
+        """
+        self.__print("RepoPage::stop_scan")
+
+        if self.__values['scan'] is not None:
+            self.__values['scan'].cancel()
+            self.__values['scan'] = None
+            self.__values['seen'] = None
+            # the links are not complete
+            self.__values['db'] = None
+            self.__gramplet.show_progress('repo', None)
+
+    def __add_links(self, handle, data, rins):
+        """
+        Add the RINs of a repository, given its raw data, to the links
+        """
+        self.__values['repo_rins'][handle] = rins
+        for rin in rins:
+            self.__values['links'][rin] = (handle, data[1],
+                                           str(RepositoryType(data[2])))
+
+    def __linked(self, handle, data, rins):
+        """
+        Check if the links of a repository, given its raw data, are right
+        """
+        if self.__values['repo_rins'].get(handle) != rins:
+            return False
+        link = (handle, data[1], str(RepositoryType(data[2])))
+        return all(self.__values['links'].get(rin) == link for rin in rins)
+
+    def __link_repo(self, handle):
+        """
+        Add the RINs of a repository to the links, return the RINs
+        """
+        data = self.__values['db'].get_raw_repository_data(handle)
+        if data is None:
+            return []
+
+        rins = repository_rins(data, self.__values['url'])
+        if len(rins) != 0:
+            self.__add_links(handle, data, rins)
+        return rins
+
+    def __unlink_repo(self, handle):
+        """
+        Remove the RINs of a repository from the links, return the RINs
+        """
+        rins = self.__values['repo_rins'].pop(handle, [])
+        for rin in rins:
+            link = self.__values['links'].get(rin)
+            if link is None or link[0] != handle:
+                continue
+            del self.__values['links'][rin]
+
+            # another repository may point to the same RIN
+            for other, other_rins in self.__values['repo_rins'].items():
+                if rin in other_rins:
+                    self.__link_repo(other)
+                    break
+        return rins
+
+    def __show_link(self, rin):
+        """
+        Set gramps_id and type in the row for rin
+        """
+        row = self.__row('by_rin', rin)
+        if row is None:
+            return
+        link = self.__values['links'].get(rin)
+        if link is None:
+            row[2] = ""
+        else:
+            row[2] = link[1]
+            row[3] = link[2]
+
+    def __refresh_store(self):
+        """
+        Set gramps_id and type in every row of repo_name from the links
+        """
+        self.__print("RepoPage::__refresh_store")
+
+        if self.__values['repo_name'] is None:
+            return
+
+        if len(self.__values['by_rin']) != len(self.__values['repo_name']):
+            self.__update_index()
+
+        for row in self.__values['repo_name']:
+            self.__show_link(row[0])
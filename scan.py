@@ -0,0 +1,155 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Scan module
+
+Finds the bookDB links in the raw data of sources and repositories,
+without creating Source and Repository objects.
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import pickle
+
+#------------------------------------------------------------------------
+#
+# GRAMPS modules
+#
+#------------------------------------------------------------------------
+from gramps.gen.lib import UrlType
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+#
+# Position of the attribute list in the raw data of a Source, and of
+# the url list in the raw data of a Repository
+#
+SOURCE_ATTRIBUTES = 9
+REPOSITORY_URLS = 6
+
+SOURCE_MARKER = b'BDBRIN'
+REPOSITORY_MARKER = b'RIN '
+
+#
+# Records read between the counts handed out when ticks are asked for
+#
+SCAN_TICK = 1000
+
+def source_rins(data):
+    """
+    Return the values of the BDBRIN attributes in raw source data
+    """
+    rins = []
+    for attr in data[SOURCE_ATTRIBUTES]:
+        # (privacy, (type, custom type), value)
+        if attr[1][1] == 'BDBRIN':
+            rins.append(attr[2])
+    return rins
+
+def repository_rins(data, url):
+    """
+    Return the bookDB RINs in the urls of raw repository data
+    """
+    rins = []
+    for post in data[REPOSITORY_URLS]:
+        # (privacy, path, description, (type, custom type))
+        if post[3][0] != UrlType.UNKNOWN:
+            continue
+        if post[1] != url:
+            continue
+        if post[2][:4] != "RIN ":
+            continue
+        rins.append(post[2][4:].strip())
+    return rins
+
+def iter_raw(db, table, marker, ticks=False):
+    """
+    Iterate over (handle, raw data) of the records in table
+
+    In a DB-API database the pickled records not holding the marker
+    are skipped without being unpickled. Other databases hand out
+    every record through their cursor. If ticks is True the number
+    of records read so far is also handed out now and then.
+    """
+    count = 0
+    dbapi = getattr(db, 'dbapi', None)
+    if dbapi is not None and hasattr(dbapi, 'cursor'):
+        with dbapi.cursor() as cursor:
+            cursor.execute("SELECT handle, blob_data FROM %s" % table)
+            # the number of rows fetched at a time is set by the
+            # database, it may be one
+            rows = cursor.fetchmany()
+            while rows:
+                for (handle, blob) in rows:
+                    if marker not in blob:
+                        continue
+                    data = pickle.loads(blob)
+                    yield (data[0], data)
+                if ticks and (count + len(rows)) // SCAN_TICK != count // SCAN_TICK:
+                    yield count + len(rows)
+                count += len(rows)
+                rows = cursor.fetchmany()
+        return
+
+    with getattr(db, 'get_%s_cursor' % table)() as cursor:
+        for (handle, data) in cursor:
+            # the handle is the first item, and a str in all databases
+            yield (data[0], data)
+            count += 1
+            if ticks and count % SCAN_TICK == 0:
+                yield count
+
+def scan_sources(db, ticks=False):
+    """
+    Iterate over (handle, raw data, rins) of the sources with BDBRIN,
+    and the number of sources read if ticks is True
+    """
+    for item in iter_raw(db, 'source', SOURCE_MARKER, ticks):
+        if isinstance(item, int):
+            yield item
+            continue
+        (handle, data) = item
+        if len(data[SOURCE_ATTRIBUTES]) == 0:
+            continue
+        rins = source_rins(data)
+        if len(rins) != 0:
+            yield (handle, data, rins)
+
+def scan_repositories(db, url, ticks=False):
+    """
+    Iterate over (handle, raw data, rins) of the repositories with RIN
+    urls, and the number of repositories read if ticks is True
+    """
+    for item in iter_raw(db, 'repository', REPOSITORY_MARKER, ticks):
+        if isinstance(item, int):
+            yield item
+            continue
+        (handle, data) = item
+        if len(data[REPOSITORY_URLS]) == 0:
+            continue
+        rins = repository_rins(data, url)
+        if len(rins) != 0:
+            yield (handle, data, rins)
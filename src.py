@@ -24,6 +24,7 @@ Source Page module
 # Python modules
 #
 #------------------------------------------------------------------------
+from functools import partial
 
 #------------------------------------------------------------------------
 #
@@ -43,6 +44,11 @@ from gramps.gen.lib import Source
 from gramps.gen.lib import SourceMediaType
 from gramps.gen.lib import SrcAttribute
 from gramps.gen.const import GRAMPS_LOCALE as glocale
+
+from bookdb import SS_CMD_BOOK, SS_CMD_SCBK
+from scan import scan_sources, source_rins
+from worker import IdleTask
+
 try:
     _trans = glocale.get_addon_translator(__file__)
 except ValueError:
@@ -73,6 +79,8 @@ class SourcePage():
     __gramplet = None
     __values = {'arch': 0, 'arch_name': None,
                 'book': 0,
+                'book_type': '0',
+                'book_types': {},
                 'book_list': [[PAGE_UNKNOWN, _('Choose Book Type')],
                               [PAGE_CHURCH, _('Church Books')],
                               [PAGE_SCB, _('SCB Extracts from Church Books 1860-1949')]],
@@ -83,8 +91,14 @@ class SourcePage():
                 'cnty_list': [[0, _('Choose County')]],
                 'cnty_name': None,
                 'cnty_page': {PAGE_CHURCH: 0, PAGE_SCB: 0},
+                'db': None,
+                'found': set(),
                 'page': None,
-                'rin': {},
+                'links': {},
+                'scan': None,
+                'seen': None,
+                'sour_rins': {},
+                'tasks': {},
                 'type': PAGE_DEFAULT, 'type_name': None}
     trans = None
 
@@ -99,14 +113,136 @@ class SourcePage():
 
     def __add_book(self):
         """
-        Add a book
+        Add the books selected
+
+        The details of all books are fetched in the background, then
+        one source per book is added in a single transaction.
         """
         self.__print('SourcePage::__add_book')
 
+        # the links loaded with the family tree must be checked first
+        if self.__values['scan'] is not None and self.__values['seen'] is not None:
+            self.__values['scan'].finish()
+            self.__values['book_sel'] = [row for row in self.__values['book_sel']
+                                         if self.get_handle(row[0]) is None]
+            if len(self.__values['book_sel']) == 0:
+                self.__fields['add_btn'].set_sensitive(False)
+                self.__fields['add_label'].set_text("")
+
+        books = [row[:2] for row in self.__values['book_sel']]
+        if len(books) == 0:
+            return
+        self.__fields['add_btn'].set_sensitive(False)
+
         if self.__values['type'] == PAGE_CHURCH:
-            self.__add_chur_book()
+            self.__submit('add', partial(self.__fetched_chur_books, books),
+                          self.__fetch_chur_books, self.__values['arch'],
+                          [book[0] for book in books], error=self.__fetch_failed)
         if self.__values['type'] == PAGE_SCB:
-            self.__add_scb_book()
+            self.__submit('add', partial(self.__fetched_scb_books, books),
+                          self.__fetch_scb_books, [book[0] for book in books],
+                          error=self.__fetch_failed)
+
+    def __fetch_failed(self, err):
+        """
+        The books to add could not be fetched
+        """
+        self.__values['tasks'].pop('add', None)
+        print("Error: ", err)
+        self.__fields['add_btn'].set_sensitive(len(self.__values['book_sel']) != 0)
+
+    def __fetch_bookrefs(self, bk_infos):
+        """
+        Fetch the NAD book refs of the books, called in a worker thread
+        """
+        bookdb = self.__gramplet.pages['bookdb']
+        nad = [bk_info['nadBKid'] for bk_info in bk_infos
+               if bk_info.get('nadBKid', '0') != '0']
+        if len(nad) == 0:
+            return {}
+        return bookdb.query_bookrefs_many(nad)
+
+    def __fetch_chur_books(self, aid, bids):
+        """
+        Fetch archive, books and book refs, called in a worker thread
+        """
+        (ac_info, bk_infos) = self.__gramplet.pages['bookdb'].query_chur_books_info(aid, bids)
+        return (ac_info, bk_infos, self.__fetch_bookrefs(bk_infos))
+
+    def __fetch_scb_books(self, bids):
+        """
+        Fetch SCB archive, books, booktypes and book refs, called in a
+        worker thread
+        """
+        (ac_info, bk_infos, bt_info) = self.__gramplet.pages['bookdb'].query_scb_books_info(bids)
+        return (ac_info, bk_infos, bt_info, self.__fetch_bookrefs(bk_infos))
+
+    def __fetched_chur_books(self, books, result):
+        """
+        The details of the church books have arrived
+        """
+        self.__print('SourcePage::__fetched_chur_books')
+
+        self.__values['tasks'].pop('add', None)
+        (ac_info, bk_infos, br_infos) = result
+        if not self.__fetched_ok(ac_info, bk_infos):
+            return
+        sources = []
+        for book, bk_info in zip(books, bk_infos):
+            sour = self.__create_chur_source(book, ac_info, bk_info, br_infos)
+            if sour is None:
+                self.__fields['add_btn'].set_sensitive(True)
+                return
+            sources.append(sour)
+        self.__add_sources(sources)
+
+    def __fetched_scb_books(self, books, result):
+        """
+        The details of the SCB books have arrived
+        """
+        self.__print('SourcePage::__fetched_scb_books')
+
+        self.__values['tasks'].pop('add', None)
+        (ac_info, bk_infos, bt_info, br_infos) = result
+        if not self.__fetched_ok(ac_info, bk_infos):
+            return
+        sources = []
+        for book, bk_info in zip(books, bk_infos):
+            sour = self.__create_scb_source(book, ac_info, bk_info, bt_info, br_infos)
+            if sour is None:
+                self.__fields['add_btn'].set_sensitive(True)
+                return
+            sources.append(sour)
+        self.__add_sources(sources)
+
+    def __fetched_ok(self, ac_info, bk_infos):
+        """
+        Check that the archive and every book were fetched
+        """
+        if not ac_info or not all(bk_infos):
+            print("Error: ", _("bookDB did not answer for all books"))
+            self.__fields['add_btn'].set_sensitive(True)
+            return False
+        return True
+
+    def __add_sources(self, sources):
+        """
+        Add sources to the database in one transaction
+
+        The index is updated once the signals of the transaction
+        have been handed to update.
+        """
+        self.__print('SourcePage::__add_sources')
+
+        # begin transaction
+        with DbTxn("SwedishSources", self.__gramplet.dbstate.db, batch=False) as self.trans:
+            for sour in sources:
+                self.__gramplet.dbstate.db.add_source(sour, self.trans)
+                self.__gramplet.dbstate.db.commit_source(sour, self.trans)
+
+        self.__values['book_sel'] = []
+        self.__fields['add_btn'].set_sensitive(False)
+        self.__fields['add_label'].set_text("")
 
     def __add_book__create_ad_repo_ref(self, bk_info):
         """
@@ -133,9 +269,9 @@ class SourcePage():
 
         return rref
 
-    def __add_book__create_nad_repo_ref(self, bk_info):
+    def __add_book__create_nad_repo_ref(self, bk_info, br_info):
         """
-        Add a NAD repo ref
+        Add a NAD repo ref, br_info being the book refs in NAD
         """
         self.__print('SourcePage::__add_book__create_nad_repo_ref')
         from gramps.gui.dialog import ErrorDialog
@@ -149,8 +285,6 @@ class SourcePage():
                         self.__gramplet.pages['repo'].get_name(rin))
             return None
 
-        br_info = self.__gramplet.pages['bookdb'].query_bookrefs(bk_info['nadBKid'])
-        print(br_info)
         for entry in br_info:
             rref = RepoRef()
             repo = self.__gramplet.dbstate.db.get_repository_from_gramps_id(gramps_id)
@@ -221,15 +355,11 @@ class SourcePage():
 
         return prefix
 
-    def __add_chur_book(self):
+    def __create_chur_source(self, book, ac_info, bk_info, br_infos):
         """
-        Add a church book
+        Create the source of a church book, book being (bid, name)
         """
-        self.__print("SourcePage::__add_chur_book")
-
-        ac_info = self.__gramplet.pages['bookdb'].query_archive(self.__values['arch'])
-
-        bk_info = self.__gramplet.pages['bookdb'].query_book(self.__values['book_sel'][0])
+        self.__print("SourcePage::__create_chur_source")
 
         sour = Source()
 
@@ -237,55 +367,20 @@ class SourcePage():
 
 #        if self.__config.get('behaviour.sour_avoid_signum'):
 
-        title = prefix + ac_info['bdbACname'] + ', ' + self.__values['book_sel'][1].strip()
+        title = prefix + ac_info['bdbACname'] + ', ' + book[1].strip()
         sour.set_title(title)
         sour.set_abbreviation(title)
 
         author = prefix + ac_info['bdbACauthor']
         sour.set_author(author)
 
-        attr = SrcAttribute()
-        attr.set_type('BDBRIN')
-        attr.set_value(str(self.__values['book_sel'][0]))
-        sour.add_attribute(attr)
-
-        rref = self.__add_book__create_repo_ref(ac_info, bk_info)
-        if rref is None:
-            return
-        sour.add_repo_reference(rref)
-
-        if bk_info['nadBKid'] != '0':
-            rrefs = self.__add_book__create_nad_repo_ref(bk_info)
-            if rrefs is None:
-                return
-            for rref in rrefs:
-                sour.add_repo_reference(rref)
+        return self.__add_book__links(sour, book, ac_info, bk_info, br_infos)
 
-        if bk_info['adBKid'] != '0':
-            rref = self.__add_book__create_ad_repo_ref(bk_info)
-            if rref is None:
-                return
-            sour.add_repo_reference(rref)
-
-        # begin transaction
-        with DbTxn("SwedishSources", self.__gramplet.dbstate.db, batch=False) as self.trans:
-            self.__gramplet.dbstate.db.add_source(sour, self.trans)
-            self.__gramplet.dbstate.db.commit_source(sour, self.trans)
-
-        self.sour_update_index()
-        self.update_book_store()
-
-    def __add_scb_book(self):
+    def __create_scb_source(self, book, ac_info, bk_info, bt_info, br_infos):
         """
-        Add a SCB book
+        Create the source of a SCB book, book being (bid, name)
         """
-        self.__print("SourcePage::__add_scb_book")
-
-        ac_info = self.__gramplet.pages['bookdb'].query_scb_archive()
-
-        bk_info = self.__gramplet.pages['bookdb'].query_book(self.__values['book_sel'][0])
-
-        bt_info = self.__gramplet.pages['bookdb'].query_scb_booktypes()
+        self.__print("SourcePage::__create_scb_source")
 
         sour = Source()
 
@@ -302,36 +397,38 @@ class SourcePage():
         author = ac_info['bdbACauthor']
         sour.set_author(author)
 
+        return self.__add_book__links(sour, book, ac_info, bk_info, br_infos)
+
+    def __add_book__links(self, sour, book, ac_info, bk_info, br_infos):
+        """
+        Add the BDBRIN attribute and the repo refs to a source, return
+        None if a repository is missing
+        """
         attr = SrcAttribute()
         attr.set_type('BDBRIN')
-        attr.set_value(str(self.__values['book_sel'][0]))
+        attr.set_value(str(book[0]))
         sour.add_attribute(attr)
 
         rref = self.__add_book__create_repo_ref(ac_info, bk_info)
         if rref is None:
-            return
+            return None
         sour.add_repo_reference(rref)
 
         if bk_info['nadBKid'] != '0':
-            rrefs = self.__add_book__create_nad_repo_ref(bk_info)
+            rrefs = self.__add_book__create_nad_repo_ref(
+                bk_info, br_infos.get(str(bk_info['nadBKid']), []))
             if rrefs is None:
-                return
+                return None
             for rref in rrefs:
                 sour.add_repo_reference(rref)
 
         if bk_info['adBKid'] != '0':
             rref = self.__add_book__create_ad_repo_ref(bk_info)
             if rref is None:
-                return
+                return None
             sour.add_repo_reference(rref)
 
-        # begin transaction
-        with DbTxn("SwedishSources", self.__gramplet.dbstate.db, batch=False) as self.trans:
-            self.__gramplet.dbstate.db.add_source(sour, self.trans)
-            self.__gramplet.dbstate.db.commit_source(sour, self.trans)
-
-        self.sour_update_index()
-        self.update_book_store()
+        return sour
 
     def __btn_clicked(self, button):
         """
@@ -349,20 +446,19 @@ class SourcePage():
         """
         self.__print('SourcePage::__changed_book')
 
-        (model, row) = selection.get_selected()
-        if row is not None:
-            self.__values['book_sel'] = model[row][:]
-        else:
-            self.__values['book_sel'] = []
+        # only books not already in the database can be added
+        (model, paths) = selection.get_selected_rows()
+        self.__values['book_sel'] = [model[path][:] for path in paths
+                                     if model[path][2] == "" and model[path][3] != 1]
         if len(self.__values['book_sel']) == 0:
             self.__fields['add_btn'].set_sensitive(False)
             self.__fields['add_label'].set_text("")
-        elif self.__values['book_sel'][2] != "" or self.__values['book_sel'][3] == 1:
-            self.__fields['add_btn'].set_sensitive(False)
-            self.__fields['add_label'].set_text("")
+        elif len(self.__values['book_sel']) == 1:
+            self.__fields['add_btn'].set_sensitive('add' not in self.__values['tasks'])
+            self.__fields['add_label'].set_text(self.__values['book_sel'][0][1])
         else:
-            self.__fields['add_btn'].set_sensitive(True)
-            self.__fields['add_label'].set_text(self.__values['book_sel'][1])
+            self.__fields['add_btn'].set_sensitive('add' not in self.__values['tasks'])
+            self.__fields['add_label'].set_text(_('%d books') % len(self.__values['book_sel']))
         self.update_book_store()
 
     def __changed_combo(self, combo):
@@ -380,6 +476,8 @@ class SourcePage():
 
         if cname == 'type':
             if row_id != self.__values[cname]:
+                self.__cancel('book')
+                self.__cancel('add')
                 if row_id in self.__values['cnty_page']:
                     self.__values['cnty'] = self.__values['cnty_page'][row_id]
                 self.__fields['cnty'].set_active(self.__cnty_idx(self.__values['cnty']))
@@ -392,10 +490,14 @@ class SourcePage():
             if row_id != self.__values[cname]:
                 self.__values[cname] = row_id
                 self.__values['cnty_page'][self.__values['type']] = row_id
+                self.__cancel('arch')
+                self.__cancel('book')
+                self.__cancel('add')
                 self.__values['book_name'].clear()
                 if self.__values['type'] == PAGE_CHURCH:
                     self.__values['arch'] = 0
                     self.__update_chur_arch(row_id)
+                    self.__gramplet.pages['bookdb'].prefetch_county(row_id)
 #                if self.__values['type'] == PAGE_CHURCH and row_id != 0:
 #                    self.__update_chur_arch(row_id)
                 if self.__values['type'] == PAGE_SCB and row_id != 0:
@@ -404,9 +506,28 @@ class SourcePage():
         elif cname == 'arch':
             if row_id != self.__values[cname]:
                 self.__values[cname] = row_id
+                self.__cancel('add')
                 if self.__values['type'] == PAGE_CHURCH and row_id != 0:
                     self.chur_book_update(row_id)
-                    self.update_book_store()
+
+    def __cancel(self, name):
+        """
+        Cancel a pending bookDB query
+        """
+        task = self.__values['tasks'].pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    def __submit(self, name, callback, func, *args, error=None):
+        """
+        Run a bookDB query in the background, replacing a pending one
+        with the same name. The callback is called with the answer, or
+        error with the exception raised.
+        """
+        self.__cancel(name)
+        self.__values['tasks'][name] = \
+            self.__gramplet.pages['bookdb'].query_async(callback, func, *args,
+                                                        error=error)
 
     def __cnty_idx(self, value):
         """
@@ -482,29 +603,43 @@ class SourcePage():
         # If county is given, query for all archives
         #
         if cid != 0:
+            self.__submit('arch', partial(self.__fill_chur_arch, cid),
+                          self.__gramplet.pages['bookdb'].query_archives, cid)
+        else:
+            self.__cancel('arch')
 
-            #
-            # Refill arch_name with information again
-            #
-            archives = self.__gramplet.pages['bookdb'].query_archives(cid)
-            for entry in archives:
-                name = entry['bdbACname']
-                if entry['bdbCTid'] != str(cid):
-                    name = '%s <i>(%s)</i>' % (name, self.__cnty_name(int(entry['bdbCTid'])))
-                self.__values['arch_name'].append([int(entry['bdbACid']), name])
-
-            #
-            # Select witch entry to make active
-            #
-            if len(self.__values['arch_name']) == 2:
-                self.__values['arch'] = 1
-            else:
-                self.__values['arch'] = 0
-            self.__fields['arch'].set_active(self.__values['arch'])
+        self.__update_chur_arch_button()
+
+    def __fill_chur_arch(self, cid, archives):
+        """
+        Fill arch_name with the archives in a county
+        """
+        self.__print('SourcePage::__fill_chur_arch')
+
+        #
+        # Refill arch_name with information again
+        #
+        for entry in archives:
+            name = entry['bdbACname']
+            if entry['bdbCTid'] != str(cid):
+                name = '%s <i>(%s)</i>' % (name, self.__cnty_name(int(entry['bdbCTid'])))
+            self.__values['arch_name'].append([int(entry['bdbACid']), name])
 
         #
-        # If only one chooise, disable the button
+        # Select witch entry to make active
         #
+        if len(self.__values['arch_name']) == 2:
+            self.__values['arch'] = 1
+        else:
+            self.__values['arch'] = 0
+        self.__fields['arch'].set_active(self.__values['arch'])
+
+        self.__update_chur_arch_button()
+
+    def __update_chur_arch_button(self):
+        """
+        If only one chooise, disable the button
+        """
         if len(self.__values['arch_name']) < 2:
             self.__fields['arch'].set_button_sensitivity(Gtk.SensitivityType.OFF)
         else:
@@ -545,13 +680,31 @@ class SourcePage():
         #
         self.__values['book_name'].clear()
 
-        btypes = self.__gramplet.pages['bookdb'].query_scb_booktypes()
+        self.__submit('book', partial(self.__stream_scb_book, cid),
+                      self.__gramplet.pages['bookdb'].query_scb_booktypes)
 
-        books = self.__gramplet.pages['bookdb'].query_scb_books(cid)
+    def __stream_scb_book(self, cid, btypes):
+        """
+        Start fetching the SCB books once the book types are known
+        """
+        self.__print('SourcePage::__stream_scb_book')
+
+        if len(btypes) == 0:
+            return
+        self.__values['book_types'] = btypes
 
         self.__values['book_name'].append([0, '<b>%s</b>' % btypes[list(btypes.keys())[0]],
                                            '', 1, ''])
 
+        self.__cancel('book')
+        self.__values['tasks']['book'] = self.__gramplet.pages['bookdb'].query_stream_async(
+            self.__filled_book, SS_CMD_SCBK, {'cid': str(cid)}, self.__fill_scb_book)
+
+    def __fill_scb_book(self, books):
+        """
+        Add SCB books to book_name as they arrive
+        """
+        btypes = self.__values['book_types']
         for entry in books:
             btype = entry['nadBTid']
             boki = int(entry['bdbBKid'])
@@ -575,9 +728,8 @@ class SourcePage():
 
         if self.__values['cnty_name'] is None:
             self.__values['cnty_name'] = self.__create_liststore(self.__values['cnty_list'])
-            counties = self.__gramplet.pages['bookdb'].query_counties()
-            for entry in counties:
-                self.__values['cnty_name'].append([int(entry['bdbCTid']), entry['bdbCTname']])
+            self.__submit('cnty', self.__fill_counties,
+                          self.__gramplet.pages['bookdb'].query_counties)
 
         if self.__fields['cnty'] is None:
             self.__fields['cnty'] = self.__create_combobox('cnty_name', 'cnty')
@@ -640,6 +792,7 @@ class SourcePage():
             tree.append_column(column)
 
             select = tree.get_selection()
+            select.set_mode(Gtk.SelectionMode.MULTIPLE)
             select.connect("changed", self.__changed_book)
 
             scr = Gtk.ScrolledWindow()
@@ -672,66 +825,325 @@ class SourcePage():
         # If archive is given, query for all books
         #
         if aid != 0:
+            self.__submit('book', partial(self.__stream_chur_book, aid),
+                          self.__gramplet.pages['bookdb'].query_booktypes_arch, aid)
+        else:
+            self.__cancel('book')
 
-            btypes = self.__gramplet.pages['bookdb'].query_booktypes_arch(aid)
+        self.update_visibility()
 
-            books = self.__gramplet.pages['bookdb'].query_books(aid)
+    def __stream_chur_book(self, aid, btypes):
+        """
+        Start fetching the books in an archive once the book types are known
+        """
+        self.__print('SourcePage::__stream_chur_book')
+
+        self.__values['book_types'] = btypes
+        self.__values['book_type'] = '0'
+
+        self.__cancel('book')
+        self.__values['tasks']['book'] = self.__gramplet.pages['bookdb'].query_stream_async(
+            self.__filled_book, SS_CMD_BOOK, {'aid': str(aid)}, self.__fill_chur_book)
+
+    def __fill_chur_book(self, books):
+        """
+        Add church books to book_name as they arrive
+        """
+        btypes = self.__values['book_types']
+        btype = self.__values['book_type']
+        for entry in books:
+            if entry['nadBTid'] != btype:
+                btype = entry['nadBTid']
+                self.__values['book_name'].append([0, '<b>%s</b>' % btypes[btype], '', 1, ''])
+            bokt = btype
+            if entry['nadBTidSpec'] != '0':
+                bokt = entry['nadBTidSpec']
+            boki = int(entry['bdbBKid'])
+            bokn = '  %s %s (%s)' % (btypes[bokt], entry['nadBKperiod'], entry['bdbBKsignum'])
+            self.__values['book_name'].append([boki, bokn, '', 0, ''])
+        self.__values['book_type'] = btype
 
-            btype = '0'
-            for entry in books:
-                if entry['nadBTid'] != btype:
-                    btype = entry['nadBTid']
-                    self.__values['book_name'].append([0, '<b>%s</b>' % btypes[btype], '', 1, ''])
-                bokt = btype
-                if entry['nadBTidSpec'] != '0':
-                    bokt = entry['nadBTidSpec']
-                boki = int(entry['bdbBKid'])
-                bokn = '  %s %s (%s)' % (btypes[bokt], entry['nadBKperiod'], entry['bdbBKsignum'])
-                self.__values['book_name'].append([boki, bokn, '', 0, ''])
+    def __filled_book(self, result):
+        """
+        All books have arrived
+        """
+        self.__print('SourcePage::__filled_book')
 
+        if not result.ok():
+            print("Error: ", result.status, result.code)
+        self.update_book_store()
         self.update_visibility()
 
+    def __fill_counties(self, counties):
+        """
+        Fill cnty_name with all known counties
+        """
+        self.__print('SourcePage::__fill_counties')
+
+        for entry in counties:
+            self.__values['cnty_name'].append([int(entry['bdbCTid']), entry['bdbCTname']])
+
+    def get_links(self):
+        """
+        Return the links to bookDB, to be saved with the family tree
+        """
+        self.__print('SourcePage::get_links')
+
+        if self.__values['db'] is None or self.__values['scan'] is not None:
+            return None
+        return {'links': self.__values['links'],
+                'sour_rins': self.__values['sour_rins']}
+
+    def set_links(self, data):
+        """
+        Show links saved with the family tree while it is scanned
+
+        Returns False if they are not usable.
+        """
+        self.__print('SourcePage::set_links')
+
+        if not data or not isinstance(data.get('links'), dict) or \
+           not isinstance(data.get('sour_rins'), dict):
+            return False
+
+        self.stop_scan()
+        self.__values['db'] = self.__gramplet.dbstate.db
+        self.__values['links'] = {rin: tuple(link) for rin, link in data['links'].items()}
+        self.__values['sour_rins'] = data['sour_rins']
+        self.__values['found'] = set()
+        self.update_book_store()
+
+        # the saved links are checked against the sources, those
+        # not found are removed when the scan is done
+        self.__values['seen'] = set()
+        self.__values['scan'] = IdleTask(self.__scan(), self.__scanned,
+                                         self.__scan_progress,
+                                         error=self.__scan_failed)
+        return True
+
+    def open_db(self):
+        """
+        Scan the sources if the database has changed
+        """
+        self.__print('SourcePage::open_db')
+
+        if self.__values['db'] is not self.__gramplet.dbstate.db:
+            self.sour_update_index()
+
     def sour_update_index(self):
         """
         update index
+
+        All sources are read, this is only needed when a database is
+        opened, later changes are handled by update. They are read in
+        slices of the main loop and the books shown get their ID as
+        soon as their source is found.
         """
+        self.__print('SourcePage::sour_update_index')
 
-        dbstate = self.__gramplet.dbstate
+        self.stop_scan()
+        self.__values['db'] = self.__gramplet.dbstate.db
+        self.__values['links'] = {}
+        self.__values['sour_rins'] = {}
+        self.__values['found'] = set()
+        self.update_book_store()
 
-        # check all sources for RIN information
-        for handle in dbstate.db.get_source_handles():
+        self.__values['scan'] = IdleTask(self.__scan(), self.__scanned,
+                                         self.__scan_progress,
+                                         error=self.__scan_failed)
 
-            # fetch a source
-            sour = dbstate.db.get_source_from_handle(handle)
+    def __scan(self):
+        """
+        Generator reading all sources, yields (read, total) now and then.
+        The BDBRINs found are collected in found.
 
-            # check if source has any attributes, if not skip the rest
-            attr = sour.get_attribute_list()
-            if len(attr) == 0:
+        When the links were loaded, the sources read are collected in
+        seen and only those whose links differ are linked again.
+        """
+        total = self.__values['db'].get_number_of_sources()
+        seen = self.__values['seen']
+
+        # check all sources for RIN information, the raw data is read
+        # and only sources with BDBRIN attributes are looked at
+        for item in scan_sources(self.__values['db'], ticks=True):
+            if isinstance(item, int):
+                yield (item, total)
                 continue
-
-            # only check attributes of type BDBRIN
-            for i in attr:
-                if i.get_type() != 'BDBRIN':
+            (handle, data, rins) = item
+            if seen is not None:
+                seen.add(handle)
+                if self.__linked(handle, data, rins):
+                    yield None
                     continue
-                # Save rin and gramps id
-                self.__values['rin'][i.get_value()] = sour.get_gramps_id()
+                self.__values['found'].update(self.__unlink_sour(handle))
+            self.__add_links(handle, data, rins)
+            self.__values['found'].update(rins)
+            yield None
+
+        if seen is not None:
+            # sources deleted or without BDBRIN since the links were saved
+            for handle in [handle for handle in self.__values['sour_rins']
+                           if handle not in seen]:
+                self.__values['found'].update(self.__unlink_sour(handle))
+
+    def __show_found(self):
+        """
+        Show the ID of the books whose sources have been found
+        """
+        if len(self.__values['found']) != 0:
+            self.update_book_store(self.__values['found'])
+            self.__values['found'] = set()
+
+    def __scan_progress(self, value):
+        """
+        Show how far the scan has come, called once per slice
+        """
+        self.__show_found()
+        self.__gramplet.show_progress('sour', _('Sources'), value[0], value[1])
+
+    def __scanned(self):
+        """
+        All sources have been read
+        """
+        self.__print('SourcePage::__scanned')
+
+        self.__show_found()
+        self.__values['scan'] = None
+        self.__values['seen'] = None
+        self.__gramplet.show_progress('sour', None)
+
+    def __scan_failed(self, err):
+        """
+        The scan stopped with an error, it is done again next time
+        """
+        self.__print('SourcePage::__scan_failed')
+
+        print("Error: ", err)
+        self.__values['scan'] = None
+        self.__values['seen'] = None
+        self.__values['db'] = None
+        self.__gramplet.show_progress('sour', None)
+
+    def stop_scan(self):
+        """
+        Stop reading the sources
+        """
+        self.__print('SourcePage::stop_scan')
+
+        if self.__values['scan'] is not None:
+            self.__values['scan'].cancel()
+            self.__values['scan'] = None
+            self.__values['seen'] = None
+            # the links are not complete
+            self.__values['db'] = None
+            self.__gramplet.show_progress('sour', None)
+
+    def __add_links(self, handle, data, rins):
+        """
+        Add the RINs of a source, given its raw data, to the links
+        """
+        self.__values['sour_rins'][handle] = rins
+        for rin in rins:
+            # Save handle and gramps id
+            self.__values['links'][rin] = (handle, data[1])
+
+    def __linked(self, handle, data, rins):
+        """
+        Check if the links of a source, given its raw data, are right
+        """
+        if self.__values['sour_rins'].get(handle) != rins:
+            return False
+        return all(self.__values['links'].get(rin) == (handle, data[1]) for rin in rins)
+
+    def __link_sour(self, handle):
+        """
+        Add the RINs of a source to the links, return the RINs
+        """
+        data = self.__values['db'].get_raw_source_data(handle)
+        if data is None:
+            return []
+
+        rins = source_rins(data)
+        if len(rins) != 0:
+            self.__add_links(handle, data, rins)
+        return rins
+
+    def __unlink_sour(self, handle):
+        """
+        Remove the RINs of a source from the links, return the RINs
+        """
+        rins = self.__values['sour_rins'].pop(handle, [])
+        for rin in rins:
+            link = self.__values['links'].get(rin)
+            if link is None or link[0] != handle:
+                continue
+            del self.__values['links'][rin]
+
+            # another source may hold the same RIN
+            for other, other_rins in self.__values['sour_rins'].items():
+                if rin in other_rins:
+                    self.__link_sour(other)
+                    break
+        return rins
+
+    def get_handle(self, rin):
+        """
+        Return the handle of the source holding a bookDB RIN, or None
+        """
+        link = self.__values['links'].get(str(rin))
+        if link is None:
+            return None
+        return link[0]
+
+    def get_rins(self, handle):
+        """
+        Return the bookDB RINs held by a source
+        """
+        return list(self.__values['sour_rins'].get(handle, []))
 
     def update(self, obj):
         """
         called from Swedish Sources on db changes
+
+        obj is the list of source handles added, updated or deleted,
+        only these are read again.
         """
-        print(obj)
+        self.__print('SourcePage::update')
+
+        if self.__values['db'] is not self.__gramplet.dbstate.db:
+            self.sour_update_index()
+            self.update_book_store()
+            return
 
-    def update_book_store(self):
+        # sources changed are not checked again by a running scan
+        if self.__values['seen'] is not None:
+            self.__values['seen'].update(obj)
+
+        changed = set()
+        for handle in obj:
+            changed.update(self.__unlink_sour(handle))
+            if self.__gramplet.dbstate.db.has_source_handle(handle):
+                changed.update(self.__link_sour(handle))
+        if len(changed) != 0:
+            self.update_book_store(changed)
+
+    def update_book_store(self, rins=None):
         """
-        Update gramps_id in book_store
+        Update gramps_id in book_store, for all books or those in rins
         """
         self.__print("SourcePage::update_book_store")
 
+        if self.__values['book_name'] is None:
+            return
+
         # Check if it is in repo_store
-        for row in list(self.__values['book_name']):
-            if str(row[0]) in self.__values['rin']:
-                row[2] = self.__values['rin'][str(row[0])]
+        for row in self.__values['book_name']:
+            rin = str(row[0])
+            if rins is not None and rin not in rins:
+                continue
+            link = self.__values['links'].get(rin)
+            if link is not None:
+                row[2] = link[1]
             else:
                 row[2] = ''
 
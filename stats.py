@@ -0,0 +1,148 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Statistics module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import bisect
+import threading
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+#
+# Upper bounds in seconds of the latency histogram buckets, the last
+# bucket holds everything slower
+#
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+class QueryStats():
+    """
+    Counters per bookDB command
+
+    For each command the number of calls, a latency histogram, bytes read
+    from the server, seconds spent decoding, cache hits and misses,
+    calls merged with an identical one and the codes of failed calls.
+    """
+
+    __debug = False
+
+    def __init__(self, names):
+        """
+        init, names maps command numbers to the names used in snapshots
+        """
+        self.__lock = threading.Lock()
+        self.__names = names
+        self.__stats = {}
+
+    def __get(self, cmd):
+        """
+        Counters of a command, lock must be held
+        """
+        stats = self.__stats.get(cmd)
+        if stats is None:
+            stats = {'calls': 0, 'time': 0.0, 'bytes': 0, 'decode': 0.0,
+                     'hits': 0, 'misses': 0, 'merged': 0, 'errors': {},
+                     'latency': [0] * (len(LATENCY_BUCKETS) + 1)}
+            self.__stats[cmd] = stats
+        return stats
+
+    def record(self, cmd, res):
+        """
+        Count a finished call, res being its BookdbResult
+        """
+        with self.__lock:
+            stats = self.__get(cmd)
+            stats['calls'] += 1
+            stats['time'] += res.elapsed
+            stats['bytes'] += res.size
+            stats['latency'][bisect.bisect_left(LATENCY_BUCKETS, res.elapsed)] += 1
+            if res.code != 0:
+                stats['errors'][res.code] = stats['errors'].get(res.code, 0) + 1
+
+    def count(self, cmd, what, num=1):
+        """
+        Add to hits, misses or merged
+        """
+        with self.__lock:
+            self.__get(cmd)[what] += num
+
+    def decoded(self, cmd, seconds):
+        """
+        Add time spent decoding an answer
+        """
+        with self.__lock:
+            self.__get(cmd)['decode'] += seconds
+
+    def reset(self):
+        """
+        Start counting from zero
+        """
+        self.__print('QueryStats::reset')
+
+        with self.__lock:
+            self.__stats = {}
+
+    def snapshot(self):
+        """
+        Return a copy of all counters, keyed on command name
+        """
+        with self.__lock:
+            ret = {}
+            for cmd, stats in self.__stats.items():
+                copy = dict(stats)
+                copy['errors'] = dict(stats['errors'])
+                copy['latency'] = {'buckets': list(LATENCY_BUCKETS),
+                                   'counts': list(stats['latency'])}
+                ret[self.__names[cmd]] = copy
+            return ret
+
+    @staticmethod
+    def percentile(latency, pct):
+        """
+        Upper bound in seconds of the bucket holding a percentile of a
+        snapshot histogram, None if there is nothing counted
+        """
+        total = sum(latency['counts'])
+        if total == 0:
+            return None
+        limit = total * pct / 100.0
+        seen = 0
+        for idx, num in enumerate(latency['counts']):
+            seen += num
+            if seen >= limit:
+                break
+        if idx < len(latency['buckets']):
+            return latency['buckets'][idx]
+        return float('inf')
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
@@ -0,0 +1,180 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Stream module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import codecs
+import json
+import re
+import zlib
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+CHUNK_SIZE = 64 * 1024
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+#
+# Characters that may follow a complete number, true, false or null
+#
+SCALAR_END = ' \t\n\r,]'
+
+class Decompressor():
+    """
+    Incremental decoder of a Content-Encoding
+    """
+
+    def __init__(self, encoding):
+        """
+        init
+        """
+        encoding = (encoding or '').strip().lower()
+        self.__raw = False
+        if encoding in ('gzip', 'x-gzip'):
+            self.__zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.__zlib = zlib.decompressobj()
+            self.__raw = True
+        elif encoding in ('', 'identity'):
+            self.__zlib = None
+        else:
+            raise ValueError('unknown content encoding: %s' % encoding)
+        self.__first = True
+
+    def feed(self, data):
+        """
+        Decode a chunk of data
+        """
+        if self.__zlib is None:
+            return data
+        if self.__first and self.__raw:
+            #
+            # Some servers send deflate without the zlib header
+            #
+            self.__first = False
+            try:
+                return self.__zlib.decompress(data)
+            except zlib.error:
+                self.__zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.__first = False
+        return self.__zlib.decompress(data)
+
+    def flush(self):
+        """
+        Decode what is left
+        """
+        if self.__zlib is None:
+            return b''
+        return self.__zlib.flush()
+
+def decompress(encoding, data):
+    """
+    Decode a whole body
+    """
+    dec = Decompressor(encoding)
+    return dec.feed(data) + dec.flush()
+
+class JsonArrayStream():
+    """
+    Incremental decoder of a json document
+
+    If the document is an array, each element is handed out as soon as
+    it is complete. Any other document is decoded when it is closed.
+    object_hook is used as in json.loads.
+    """
+
+    def __init__(self, object_hook=None):
+        """
+        init
+        """
+        self.__hook = object_hook
+        self.__decoder = json.JSONDecoder(object_hook=object_hook)
+        self.__text = codecs.getincrementaldecoder('utf-8')()
+        self.__buf = ''
+        self.__state = 'start'
+        self.__items = []
+
+    def feed(self, data):
+        """
+        Add bytes, return a list of the elements completed by them
+        """
+        buf = self.__buf + self.__text.decode(data)
+        pos = 0
+        new = []
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf) or self.__state in ('other', 'end'):
+                break
+            if self.__state == 'start':
+                if buf[pos] == '[':
+                    self.__state = 'first'
+                    pos += 1
+                else:
+                    self.__state = 'other'
+            elif self.__state == 'sep':
+                if buf[pos] == ',':
+                    self.__state = 'item'
+                    pos += 1
+                elif buf[pos] == ']':
+                    self.__state = 'end'
+                    pos += 1
+                else:
+                    raise ValueError("Expecting ',' or ']' at %d" % pos)
+            elif self.__state == 'first' and buf[pos] == ']':
+                self.__state = 'end'
+                pos += 1
+            else:
+                try:
+                    item, end = self.__decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # not complete yet
+                    break
+                if not isinstance(item, (dict, list, str)) and \
+                   (end == len(buf) or buf[end] not in SCALAR_END):
+                    # a number may go on in the next chunk, as in 1. or 2e
+                    break
+                new.append(item)
+                pos = end
+                self.__state = 'sep'
+        self.__buf = buf[pos:]
+        self.__items.extend(new)
+        return new
+
+    def close(self):
+        """
+        Return the whole document
+        """
+        buf = self.__buf + self.__text.decode(b'', final=True)
+        if self.__state in ('start', 'other'):
+            return json.loads(buf, object_hook=self.__hook)
+        if self.__state != 'end' or buf.strip() != '':
+            raise ValueError('Incomplete json array')
+        return self.__items
@@ -0,0 +1,163 @@
+#
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Tests of the cache module
+
+    python3 -m unittest discover tests
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from cache import DiskCache, LruCache, cache_key
+from records import County
+
+class DiskCacheTest(unittest.TestCase):
+    """
+    Answers stored on disk, one directory per server and protocol
+    """
+
+    def setUp(self):
+        """
+        Cache in an empty directory
+        """
+        self.path = tempfile.mkdtemp()
+        self.cache = DiskCache(self.path)
+        self.cache.set_scope('https://bookdb.example.org/', '1')
+
+    def tearDown(self):
+        """
+        Remove the directory
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_put_get(self):
+        """
+        An answer is read back with its validators
+        """
+        rows = [County({'bdbCTid': '1', 'bdbCTname': 'Stockholm'})]
+        self.cache.put('getCounties', {}, rows, etag='"a"', token='t1')
+        entry = self.cache.get('getCounties', {})
+        self.assertEqual(entry['payload'], rows)
+        self.assertIsInstance(entry['payload'][0], County)
+        self.assertEqual(entry['etag'], '"a"')
+        self.assertEqual(entry['token'], 't1')
+        self.assertIsNone(self.cache.get('getCounties', {'cid': '1'}))
+
+    def test_scope(self):
+        """
+        Another server does not see the answers, clear removes them
+        """
+        self.cache.put('getCounties', {}, [])
+        self.cache.set_scope('https://other.example.org/', '1')
+        self.assertIsNone(self.cache.get('getCounties', {}))
+        self.cache.set_scope('https://bookdb.example.org/', '1')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('getCounties', {}))
+
+    def test_key(self):
+        """
+        The key does not depend on the order of the params
+        """
+        self.assertEqual(cache_key('getBooks', {'aid': '1', 'since': 'x'}),
+                         cache_key('getBooks', {'since': 'x', 'aid': '1'}))
+        self.assertNotEqual(cache_key('getBooks', {'aid': '1'}),
+                            cache_key('getBooks', {'aid': '2'}))
+
+class LruCacheTest(unittest.TestCase):
+    """
+    Answers kept in memory within limits
+    """
+
+    def test_entries(self):
+        """
+        The least recently used entry is evicted first
+        """
+        lru = LruCache({1: None}, entries=2, size=1000)
+        lru.put(1, {'a': 1}, 'one', 10)
+        lru.put(1, {'a': 2}, 'two', 10)
+        self.assertEqual(lru.get(1, {'a': 1}), 'one')
+        lru.put(1, {'a': 3}, 'three', 10)
+        self.assertIsNone(lru.get(1, {'a': 2}))
+        self.assertEqual(lru.get(1, {'a': 1}), 'one')
+        self.assertEqual(lru.get_stats()['entries'], 2)
+
+    def test_size(self):
+        """
+        Entries are evicted to keep within the size, and one larger
+        than the size is not stored
+        """
+        lru = LruCache({1: None}, entries=10, size=100)
+        lru.put(1, {'a': 1}, 'one', 60)
+        lru.put(1, {'a': 2}, 'two', 60)
+        self.assertIsNone(lru.get(1, {'a': 1}))
+        lru.put(1, {'a': 3}, 'big', 200)
+        self.assertIsNone(lru.get(1, {'a': 3}))
+        self.assertEqual(lru.get_stats()['size'], 60)
+
+    def test_policy(self):
+        """
+        Commands without a policy are not stored, entries expire
+        """
+        lru = LruCache({1: 0.05}, entries=10, size=1000)
+        lru.put(2, {}, 'other', 10)
+        self.assertIsNone(lru.get(2, {}))
+        lru.put(1, {}, 'one', 10)
+        self.assertEqual(lru.get(1, {}), 'one')
+        time.sleep(0.1)
+        self.assertIsNone(lru.get(1, {}))
+        self.assertEqual(lru.get_stats()['commands'][1], {'hits': 1, 'misses': 1})
+
+    def test_invalidate(self):
+        """
+        Forget one query, one command or everything
+        """
+        lru = LruCache({1: None, 2: None}, entries=10, size=1000)
+        for cmd in (1, 2):
+            for val in (1, 2):
+                lru.put(cmd, {'a': val}, val, 10)
+        lru.invalidate(1, {'a': 1})
+        self.assertIsNone(lru.get(1, {'a': 1}))
+        self.assertEqual(lru.get(1, {'a': 2}), 2)
+        lru.invalidate(1)
+        self.assertIsNone(lru.get(1, {'a': 2}))
+        self.assertEqual(lru.get(2, {'a': 1}), 1)
+        lru.invalidate()
+        self.assertEqual(lru.get_stats()['entries'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Tests of the records module
+
+    python3 -m unittest discover tests
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import json
+import os
+import sys
+import unittest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from records import Archive, Book, County, decode_record, encode_record
+
+ANSWER = '''[
+    {"bdbBKid": "11", "nadBTid": "C", "nadBKperiod": "1700-1750", "extra": 1},
+    {"bdbACid": "2", "bdbACname": "Arkiv", "bdbCTid": "1"},
+    {"bdbCTid": "1", "bdbCTname": "Stockholm"},
+    {"status": "OK"}
+]'''
+
+class RecordTest(unittest.TestCase):
+    """
+    Records decoded from an answer read like the dicts they replace
+    """
+
+    def setUp(self):
+        """
+        Decode the answer
+        """
+        self.rows = json.loads(ANSWER, object_hook=decode_record)
+
+    def test_classes(self):
+        """
+        Each kind of row gets its class, other objects stay dicts
+        """
+        self.assertEqual([type(row) for row in self.rows],
+                         [Book, Archive, County, dict])
+
+    def test_dict_access(self):
+        """
+        Fields, unknown keys and missing fields
+        """
+        book = self.rows[0]
+        self.assertEqual(book['bdbBKid'], '11')
+        self.assertEqual(book['extra'], 1)
+        self.assertEqual(book.get('nadBKvol', '0'), '0')
+        self.assertNotIn('nadBKvol', book)
+        self.assertIn('extra', book)
+        self.assertRaises(KeyError, lambda: book['nadBKvol'])
+        self.assertEqual(sorted(book.keys()),
+                         ['bdbBKid', 'extra', 'nadBKperiod', 'nadBTid'])
+        self.assertEqual(len(book), 4)
+
+    def test_round_trip(self):
+        """
+        Records written with encode_record give the answer back
+        """
+        text = json.dumps(self.rows, default=encode_record)
+        self.assertEqual(json.loads(text), json.loads(ANSWER))
+        self.assertEqual(self.rows[2], {'bdbCTid': '1', 'bdbCTname': 'Stockholm'})
+
+    def test_interned(self):
+        """
+        Interned fields of different records share one string
+        """
+        other = json.loads(ANSWER, object_hook=decode_record)
+        self.assertIs(self.rows[0]['nadBKperiod'], other[0]['nadBKperiod'])
+
+if __name__ == '__main__':
+    unittest.main()
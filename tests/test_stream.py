@@ -0,0 +1,129 @@
+#
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Tests of the stream module
+
+    python3 -m unittest discover tests
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import json
+import os
+import sys
+import unittest
+import zlib
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS))
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from stream import Decompressor, JsonArrayStream
+
+DOCUMENTS = [
+    '[]',
+    '[1.5]',
+    '[2e3]',
+    '[-2.5E+3, 0, -0.25e-2]',
+    '[true, false, null, 12]',
+    '[{"bdbBKid": "1", "name": "Åsele \\"AI\\""}, [1, [2]], "x,]"]',
+    ' [ 1 , 2 ] ',
+    '{"status": "OK", "code": 0}',
+]
+
+def feed_split(doc, pos):
+    """
+    Decode doc sent in two chunks split at byte pos, return the
+    elements handed out and the whole document
+    """
+    data = doc.encode('utf-8')
+    dec = JsonArrayStream()
+    items = dec.feed(data[:pos]) + dec.feed(data[pos:])
+    return (items, dec.close())
+
+class JsonArrayStreamTest(unittest.TestCase):
+    """
+    JsonArrayStream gives the same result however the document is split
+    """
+
+    def test_every_split(self):
+        """
+        Split every document at every byte
+        """
+        for doc in DOCUMENTS:
+            expected = json.loads(doc)
+            for pos in range(len(doc.encode('utf-8')) + 1):
+                with self.subTest(doc=doc, pos=pos):
+                    (items, whole) = feed_split(doc, pos)
+                    self.assertEqual(whole, expected)
+                    if isinstance(expected, list):
+                        self.assertEqual(items, expected)
+
+    def test_byte_chunks(self):
+        """
+        Feed one byte at a time
+        """
+        doc = DOCUMENTS[5].encode('utf-8')
+        dec = JsonArrayStream()
+        items = []
+        for idx in range(len(doc)):
+            items.extend(dec.feed(doc[idx:idx + 1]))
+        self.assertEqual(items, json.loads(DOCUMENTS[5]))
+        self.assertEqual(dec.close(), items)
+
+    def test_incomplete(self):
+        """
+        A truncated array is an error
+        """
+        dec = JsonArrayStream()
+        dec.feed(b'[1, 2')
+        self.assertRaises(ValueError, dec.close)
+
+class DecompressorTest(unittest.TestCase):
+    """
+    Decompressor decodes a body sent in chunks
+    """
+
+    def test_encodings(self):
+        """
+        gzip, deflate with and without zlib header, and identity
+        """
+        body = json.dumps(list(range(1000))).encode('utf-8')
+        gzip = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for (encoding, data) in (('gzip', gzip.compress(body) + gzip.flush()),
+                                 ('deflate', zlib.compress(body)),
+                                 ('deflate', raw.compress(body) + raw.flush()),
+                                 ('identity', body)):
+            with self.subTest(encoding=encoding):
+                dec = Decompressor(encoding)
+                out = b''.join(dec.feed(data[idx:idx + 100])
+                               for idx in range(0, len(data), 100))
+                self.assertEqual(out + dec.flush(), body)
+
+if __name__ == '__main__':
+    unittest.main()
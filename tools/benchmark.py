@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+#
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+bookDB client benchmark
+
+Drives BookdbPage against the stand-in server in tools/bookdb_server.py
+and reports latency percentiles, requests per second, bytes transferred
+and allocations, per command and for the user flows of the Sources page.
+Must be run with the Python that runs Gramps, since bookdb.py needs it.
+
+    python3 tools/benchmark.py --iterations 200 --output before.json
+    python3 tools/benchmark.py --iterations 200 --output after.json --compare before.json
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS))
+sys.path.insert(0, TOOLS)
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from bookdb import BookdbPage
+from bookdb_server import start_server, COUNTIES
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+def percentile(values, pct):
+    """
+    Percentile of a sorted list, by linear interpolation
+    """
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * pct / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+class Benchmark():
+    """
+    Run the cases and collect the measurements
+    """
+
+    def __init__(self, args):
+        """
+        init
+        """
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.server = start_server(username=USERNAME, password=PASSWORD,
+                                   books=args.books, archives=args.archives,
+                                   scb=args.scb, seed=args.seed,
+                                   latency=args.latency, jitter=args.jitter)
+        self.bookdb = BookdbPage(None, None)
+        self.bookdb.set_url(self.server.url)
+        self.bookdb.set_username(USERNAME)
+        self.bookdb.set_password(PASSWORD)
+        self.bookdb.update_basic_auth()
+        self.bookdb.set_cache(False)
+
+        #
+        # Pick the ids used by the cases once, so every run and every
+        # revision asks for the same things in the same order
+        #
+        self.cids = [self.rnd.randint(1, len(COUNTIES)) for i in range(args.iterations)]
+        archives = self.bookdb.query_archives(1)
+        self.aids = [self.rnd.choice(archives)['bdbACid'] for i in range(args.iterations)]
+        self.books = {}
+        for aid in set(self.aids):
+            self.books[aid] = [row['bdbBKid'] for row in self.bookdb.query_books(aid)]
+        self.bids = [self.rnd.choice(self.books[aid]) for aid in self.aids]
+        self.scb = [row['bdbBKid'] for row in self.bookdb.query_scb_books(1)]
+        self.sids = [self.rnd.choice(self.scb) for i in range(args.iterations)]
+
+    def cases(self):
+        """
+        Return (name, function of iteration number) for every case
+        """
+        bdb = self.bookdb
+        ret = [
+            ('TestSSPV', lambda i: bdb.query_test()),
+            ('getRepositories', lambda i: bdb.query_repositories()),
+            ('getRepositories rin', lambda i: bdb.query_repository(str(1 + i % 8))),
+            ('getCounties', lambda i: bdb.query_counties()),
+            ('getArchives cid', lambda i: bdb.query_archives(self.cids[i])),
+            ('getArchives aid', lambda i: bdb.query_archive(self.aids[i])),
+            ('getBookTypes', lambda i: bdb.query_booktypes_arch(self.aids[i])),
+            ('getBooks aid', lambda i: bdb.query_books(self.aids[i])),
+            ('getBooks bid', lambda i: bdb.query_book(self.bids[i])),
+            ('getBookRefs', lambda i: bdb.query_bookrefs(str(int(self.bids[i]) + 1000000))),
+            ('getSCBBooks', lambda i: bdb.query_scb_books(self.cids[i])),
+            ('getSCBBookTypes', lambda i: bdb.query_scb_booktypes()),
+            ('getSCBArchive', lambda i: bdb.query_scb_archive()),
+            ('flow county switch', self.flow_county),
+            ('flow archive switch', self.flow_archive),
+            ('flow add church book', self.flow_add_chur_book),
+            ('flow add SCB book', self.flow_add_scb_book),
+            ('flow add 40 church books', self.flow_add_chur_books)]
+        if self.args.only:
+            ret = [case for case in ret if self.args.only in case[0]]
+        return ret
+
+    def flow_county(self, i):
+        """
+        A county is chosen on the Sources page
+        """
+        self.bookdb.query_archives(self.cids[i])
+
+    def flow_archive(self, i):
+        """
+        An archive is chosen on the Sources page
+        """
+        self.bookdb.query_booktypes_arch(self.aids[i])
+        self.bookdb.query_books(self.aids[i])
+
+    def flow_add_chur_book(self, i):
+        """
+        A church book is added
+        """
+        (ac_info, bk_info) = self.bookdb.query_chur_book_info(self.aids[i], self.bids[i])
+        if bk_info.get('nadBKid', '0') != '0':
+            self.bookdb.query_bookrefs(bk_info['nadBKid'])
+
+    def flow_add_chur_books(self, i):
+        """
+        Up to 40 church books of an archive are added at once
+        """
+        (ac_info, bk_infos) = self.bookdb.query_chur_books_info(self.aids[i],
+                                                               self.books[self.aids[i]][:40])
+        nad = [bk_info['nadBKid'] for bk_info in bk_infos if bk_info.get('nadBKid', '0') != '0']
+        if nad:
+            self.bookdb.query_bookrefs_many(nad)
+
+    def flow_add_scb_book(self, i):
+        """
+        A SCB book is added
+        """
+        (ac_info, bk_info, bt_info) = self.bookdb.query_scb_book_info(self.sids[i])
+        if bk_info.get('nadBKid', '0') != '0':
+            self.bookdb.query_bookrefs(bk_info['nadBKid'])
+
+    def __prepare(self):
+        """
+        Empty the memory cache unless warm caches are measured
+        """
+        if not self.args.warm:
+            self.bookdb.invalidate()
+
+    def run_case(self, func):
+        """
+        Measure one case
+        """
+        iterations = self.args.iterations
+
+        for i in range(min(self.args.warmup, iterations)):
+            self.__prepare()
+            func(i)
+
+        self.server.reset_stats()
+        times = []
+        total = 0.0
+        for i in range(iterations):
+            self.__prepare()
+            start = time.perf_counter()
+            func(i)
+            elapsed = time.perf_counter() - start
+            times.append(elapsed)
+            total += elapsed
+        stats = self.server.get_stats()
+
+        allocs = []
+        for i in range(min(self.args.alloc_iterations, iterations)):
+            self.__prepare()
+            tracemalloc.start()
+            func(i)
+            size, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            allocs.append(peak)
+
+        times.sort()
+        return {'iterations': iterations,
+                'p50_ms': percentile(times, 50) * 1000,
+                'p95_ms': percentile(times, 95) * 1000,
+                'p99_ms': percentile(times, 99) * 1000,
+                'mean_ms': total / iterations * 1000,
+                'ops_per_s': iterations / total if total else 0.0,
+                'requests': sum(val['requests'] for val in stats.values()),
+                'bytes': sum(val['bytes'] for val in stats.values()),
+                'bytes_per_op': sum(val['bytes'] for val in stats.values()) / iterations,
+                'alloc_peak_kib': (sum(allocs) / len(allocs) / 1024) if allocs else 0.0}
+
+    def run(self):
+        """
+        Run all cases and return the report
+        """
+        results = {}
+        for name, func in self.cases():
+            results[name] = self.run_case(func)
+            self.show(name, results[name])
+        self.server.shutdown()
+        return {'meta': self.meta(), 'results': results}
+
+    def meta(self):
+        """
+        Describe the run
+        """
+        try:
+            rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                 cwd=TOOLS, capture_output=True, text=True).stdout.strip()
+        except OSError:
+            rev = ''
+        return {'revision': rev, 'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'args': vars(self.args)}
+
+    @staticmethod
+    def show(name, res, old=None):
+        """
+        Print one result line, with the change against an old result
+        """
+        line = '%-24s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %8.1f op/s  %9.0f B/op  %8.1f KiB' % \
+               (name, res['p50_ms'], res['p95_ms'], res['p99_ms'], res['ops_per_s'],
+                res['bytes_per_op'], res['alloc_peak_kib'])
+        if old is not None and old.get('p50_ms'):
+            line += '  p50 %+6.1f%%' % ((res['p50_ms'] / old['p50_ms'] - 1) * 100)
+        print(line)
+
+def main():
+    """
+    Run the benchmark from the command line
+    """
+    parser = argparse.ArgumentParser(description='bookDB client benchmark')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--alloc-iterations', type=int, default=10,
+                        help='iterations measured with tracemalloc, apart from the timing')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--archives', type=int, default=40)
+    parser.add_argument('--scb', type=int, default=120)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the server waits before every answer')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--warm', action='store_true',
+                        help='keep the memory cache between iterations')
+    parser.add_argument('--only', default='', help='run only cases containing this text')
+    parser.add_argument('--output', help='save the report as json')
+    parser.add_argument('--compare', help='json report to compare with')
+    args = parser.parse_args()
+
+    report = Benchmark(args).run()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fil:
+            json.dump(report, fil, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fil:
+            old = json.load(fil)
+        print('\nCompared with %s (%s)' % (args.compare, old['meta'].get('revision', '')))
+        for name, res in report['results'].items():
+            Benchmark.show(name, res, old['results'].get(name))
+
+if __name__ == '__main__':
+    main()
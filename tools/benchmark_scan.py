@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Family tree scan benchmark
+
+Builds a synthetic family tree and compares the two ways of finding
+the bookDB links in it: creating a Source or Repository object for
+every record, and reading the raw data with scan.py. Must be run with
+the Python that runs Gramps, since the tree is a Gramps database.
+
+    python3 tools/benchmark_scan.py --sources 200000 --path /tmp/scan-tree
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS))
+
+#------------------------------------------------------------------------
+#
+# GRAMPS modules
+#
+#------------------------------------------------------------------------
+from gramps.gen.db import DbTxn
+from gramps.gen.db.utils import make_database
+from gramps.gen.lib import Repository, RepositoryType, Source, SrcAttribute
+from gramps.gen.lib import Url, UrlType
+
+#------------------------------------------------------------------------
+#
+# Swedish Sources modules
+#
+#------------------------------------------------------------------------
+from scan import scan_repositories, scan_sources
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+URL = 'https://bookdb.example.org/'
+
+OTHER_ATTRIBUTES = ('Page', 'Film', 'Signum')
+
+def build(db, args):
+    """
+    Fill an empty database with sources and repositories
+    """
+    rnd = random.Random(args.seed)
+    with DbTxn("benchmark", db, batch=True) as trans:
+        for i in range(args.repositories):
+            repo = Repository()
+            repo.set_name('Repository %d' % i)
+            repo.set_type(RepositoryType.ARCHIVE)
+            url = Url()
+            url.set_path(URL if rnd.random() < args.linked_repositories else 'https://www.example.org/')
+            url.set_description('RIN %d' % (i + 1))
+            url.set_type(UrlType.UNKNOWN)
+            repo.add_url(url)
+            db.add_repository(repo, trans)
+
+        for i in range(args.sources):
+            sour = Source()
+            sour.set_title('Source %d' % i)
+            sour.set_author('Author %d' % (i % 1000))
+            for name in OTHER_ATTRIBUTES:
+                if rnd.random() < args.attributes:
+                    attr = SrcAttribute()
+                    attr.set_type(name)
+                    attr.set_value(str(rnd.randint(1, 1000000)))
+                    sour.add_attribute(attr)
+            if rnd.random() < args.linked:
+                attr = SrcAttribute()
+                attr.set_type('BDBRIN')
+                attr.set_value(str(i + 1))
+                sour.add_attribute(attr)
+            db.add_source(sour, trans)
+
+def object_sources(db):
+    """
+    Find the BDBRIN attributes by creating every Source
+    """
+    links = {}
+    for handle in db.get_source_handles():
+        sour = db.get_source_from_handle(handle)
+        attr = sour.get_attribute_list()
+        if len(attr) == 0:
+            continue
+        for i in attr:
+            if i.get_type() != 'BDBRIN':
+                continue
+            links[i.get_value()] = (handle, sour.get_gramps_id())
+    return links
+
+def raw_sources(db):
+    """
+    Find the BDBRIN attributes in the raw data
+    """
+    links = {}
+    for (handle, data, rins) in scan_sources(db):
+        for rin in rins:
+            links[rin] = (handle, data[1])
+    return links
+
+def object_repositories(db):
+    """
+    Find the RIN urls by creating every Repository
+    """
+    links = {}
+    for handle in db.get_repository_handles():
+        repo = db.get_repository_from_handle(handle)
+        for post in repo.urls:
+            if post.type != UrlType.UNKNOWN or post.path != URL:
+                continue
+            if post.get_description()[:4] != "RIN ":
+                continue
+            links[post.get_description()[4:].strip()] = (handle, repo.get_gramps_id())
+    return links
+
+def raw_repositories(db):
+    """
+    Find the RIN urls in the raw data
+    """
+    links = {}
+    for (handle, data, rins) in scan_repositories(db, URL):
+        for rin in rins:
+            links[rin] = (handle, data[1])
+    return links
+
+def measure(func, db, repeat):
+    """
+    Return (best time, links found) of repeat runs
+    """
+    best = None
+    links = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        links = func(db)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, links)
+
+def main():
+    """
+    Run the benchmark from the command line
+    """
+    parser = argparse.ArgumentParser(description='family tree scan benchmark')
+    parser.add_argument('--sources', type=int, default=200000)
+    parser.add_argument('--repositories', type=int, default=500)
+    parser.add_argument('--linked', type=float, default=0.01,
+                        help='part of the sources with a BDBRIN attribute')
+    parser.add_argument('--linked-repositories', type=float, default=0.2,
+                        help='part of the repositories with a RIN url')
+    parser.add_argument('--attributes', type=float, default=0.1,
+                        help='chance of each other attribute on a source')
+    parser.add_argument('--backend', default='sqlite')
+    parser.add_argument('--path', help='family tree directory, kept between runs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='save the report as json')
+    args = parser.parse_args()
+
+    path = args.path or tempfile.mkdtemp(prefix='scan-tree-')
+    os.makedirs(path, exist_ok=True)
+    db = make_database(args.backend)
+    db.load(path)
+    try:
+        if db.get_number_of_sources() == 0:
+            start = time.perf_counter()
+            build(db, args)
+            print('built %d sources and %d repositories in %.1f s' %
+                  (db.get_number_of_sources(), db.get_number_of_repositories(),
+                   time.perf_counter() - start))
+
+        report = {'sources': db.get_number_of_sources(),
+                  'repositories': db.get_number_of_repositories(),
+                  'backend': args.backend, 'results': {}}
+        for (name, old, new) in (('sources', object_sources, raw_sources),
+                                 ('repositories', object_repositories, raw_repositories)):
+            (old_time, old_links) = measure(old, db, args.repeat)
+            (new_time, new_links) = measure(new, db, args.repeat)
+            if old_links != new_links:
+                print('Error: %s: the raw scan found other links' % name)
+            report['results'][name] = {'object_s': old_time, 'raw_s': new_time,
+                                       'links': len(new_links)}
+            print('%-14s objects %8.3f s  raw %8.3f s  %6.1fx  %d links' %
+                  (name, old_time, new_time, old_time / new_time if new_time else 0.0,
+                   len(new_links)))
+    finally:
+        db.close()
+        if args.path is None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fil:
+            json.dump(report, fil, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
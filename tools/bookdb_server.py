@@ -0,0 +1,746 @@
+#!/usr/bin/env python3
+#
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Stand-in bookDB server
+
+A local server answering every SS_CMD the gramplet sends, with a
+synthetic catalogue, so the gramplet can be tested and measured without
+the real bookDB server.
+
+    python3 tools/bookdb_server.py --port 8080 --user test --password test \\
+        --books 300000 --latency 0.02 --error-rate 0.01 --errors 500,503
+
+The gramplet is then pointed at http://localhost:8080/bookdb.php
+
+Lists of books and repositories carry a change token in the
+X-BookDB-Token header. Asked again with since=<token>, the server
+answers with the rows added, changed and deleted since then, or with
+the whole list if it no longer knows that token. With --churn the
+catalogue changes now and then, so delta answers can be seen.
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib.parse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+PROTOCOL_VERSIONS = ('0.0.1', '0.0.2')
+PROTOCOL_BATCH = '0.0.2'
+
+GZIP_MIN_SIZE = 1024
+
+TOKEN_HEADER = 'X-BookDB-Token'
+
+#
+# Number of changes remembered for delta answers
+#
+CHANGE_LOG_SIZE = 10000
+
+COUNTIES = ['Stockholms län', 'Uppsala län', 'Södermanlands län',
+            'Östergötlands län', 'Jönköpings län', 'Kronobergs län',
+            'Kalmar län', 'Gotlands län', 'Blekinge län',
+            'Kristianstads län', 'Malmöhus län', 'Hallands län',
+            'Göteborgs och Bohus län', 'Älvsborgs län', 'Skaraborgs län',
+            'Värmlands län', 'Örebro län', 'Västmanlands län',
+            'Kopparbergs län', 'Gävleborgs län', 'Västernorrlands län',
+            'Jämtlands län', 'Västerbottens län', 'Norrbottens län']
+
+#
+# Regional archives, and the counties they keep the church books for
+#
+ARCHIVES = [('Riksarkivet', 'RA', []),
+            ('Stadsarkivet i Stockholm', 'SSA', [1]),
+            ('Landsarkivet i Uppsala', 'ULA', [2, 3, 4, 17, 18, 19, 20]),
+            ('Landsarkivet i Vadstena', 'VaLA', [4, 5, 6, 7]),
+            ('Landsarkivet i Visby', 'ViLA', [8]),
+            ('Landsarkivet i Lund', 'LLA', [9, 10, 11, 12]),
+            ('Landsarkivet i Göteborg', 'GLA', [13, 14, 15, 16]),
+            ('Landsarkivet i Härnösand', 'HLA', [21, 22, 23, 24])]
+
+BOOK_TYPES = {'1': 'Husförhörslängder', '2': 'Flyttningslängder',
+              '3': 'Födelse- och dopböcker', '4': 'Konfirmationslängder',
+              '5': 'Lysnings- och vigselböcker', '6': 'Död- och begravningsböcker',
+              '7': 'Församlingsböcker', '8': 'Räkenskaper', '9': 'Bilagor'}
+BOOK_SIGNUM = {'1': 'AI', '2': 'B', '3': 'C', '4': 'D', '5': 'E',
+               '6': 'F', '7': 'AII', '8': 'L', '9': 'H'}
+
+SCB_TYPES = {'0': 'SCB Utdrag ur kyrkböckerna', '1': 'Födda',
+             '2': 'Vigda', '3': 'Döda', '4': 'Inflyttade', '5': 'Utflyttade'}
+
+SCB_BASE = 50000000
+
+class Catalogue():
+    """
+    Synthetic bookDB catalogue
+
+    Nothing but the sizes is kept in memory. Every record is derived
+    from its id, so the catalogue can hold hundreds of thousands of
+    books and still answer the same way on every run with the same seed.
+    """
+
+    def __init__(self, books=20000, archives=40, scb=120, seed=1):
+        """
+        init
+        """
+        self.seed = seed
+        self.narch = archives
+        self.nscb = scb
+        self.per_arch = max(1, books // (len(COUNTIES) * archives))
+        self.lock = threading.RLock()
+        self.revision = 0
+        self.edits = {}
+        self.log = []
+        self.oldest = 0
+
+    def __rand(self, *key):
+        """
+        Random generator seeded by the catalogue seed and a record key
+        """
+        return random.Random('%s:%s' % (self.seed, ':'.join(str(k) for k in key)))
+
+    @staticmethod
+    def __region(cid):
+        """
+        Index in ARCHIVES of the regional archive of a county
+        """
+        for idx, (name, ref, counties) in enumerate(ARCHIVES):
+            if cid in counties:
+                return idx
+        return 0
+
+    def repositories(self):
+        """
+        getRepositories
+        """
+        ret = []
+        for idx, (name, ref, counties) in enumerate(ARCHIVES):
+            ret.append({'rin': str(idx + 1), 'name': name, 'gramps_id': '',
+                        'type': '4', 'ref': ''})
+        ret.append({'rin': str(len(ARCHIVES) + 1), 'name': 'ArkivDigital',
+                    'gramps_id': '', 'type': '6', 'ref': 'AD'})
+        ret.append({'rin': str(len(ARCHIVES) + 2), 'name': 'Riksarkivet (SVAR)',
+                    'gramps_id': '', 'type': '6', 'ref': 'SVAR'})
+        return ret
+
+    def repository(self, rin):
+        """
+        getRepositories rin=
+        """
+        repos = {row['rin']: row for row in self.repositories()}
+        if rin not in repos:
+            return []
+        name = repos[rin]['name']
+        rnd = self.__rand('repo', rin)
+        city = name.split()[-1]
+        host = 'arkiv%s.example.se' % rin
+        return [{'bdbRItype': 'NAME', 'bdbRIinfo': name, 'bdbRIrow': '1'},
+                {'bdbRItype': 'EMAIL', 'bdbRIinfo': 'info@' + host, 'bdbRIrow': '1'},
+                {'bdbRItype': 'WWW', 'bdbRIinfo': 'https://' + host, 'bdbRIrow': '1'},
+                {'bdbRItype': 'PHON', 'bdbRIinfo': '+46 (0)%d-%06d' %
+                                                  (rnd.randint(10, 99), rnd.randint(0, 999999)),
+                 'bdbRIrow': '1'},
+                {'bdbRItype': 'ADDR', 'bdbRIinfo': name, 'bdbRIrow': '1'},
+                {'bdbRItype': 'ADDR', 'bdbRIinfo': 'Box %d' % rnd.randint(1, 999),
+                 'bdbRIrow': '2'},
+                {'bdbRItype': 'ADDR', 'bdbRIinfo': 'SE-%03d %02d %s' %
+                                                  (rnd.randint(100, 999), rnd.randint(0, 99), city),
+                 'bdbRIrow': '3'}]
+
+    @staticmethod
+    def counties():
+        """
+        getCounties
+        """
+        return [{'bdbCTid': str(cid), 'bdbCTname': name}
+                for cid, name in enumerate(COUNTIES, 1)]
+
+    def __arch_cid(self, aid):
+        """
+        County of an archive, or None if there is no such archive
+        """
+        cid, num = divmod(aid, 1000)
+        if 1 <= cid <= len(COUNTIES) and 1 <= num <= self.narch:
+            return cid
+        return None
+
+    def archive_row(self, aid):
+        """
+        Row describing an archive in a list
+        """
+        cid = self.__arch_cid(aid)
+        rnd = self.__rand('arch', aid)
+        name = '%s församling' % rnd.choice(['Sankt Olof', 'Sankta Maria', 'Nora',
+                                             'Västra', 'Östra', 'Norra', 'Södra',
+                                             'Stora', 'Lilla', 'Gamla'])
+        return {'bdbACid': str(aid), 'bdbACname': '%s %d' % (name, aid % 1000),
+                'bdbCTid': str(cid)}
+
+    def archives(self, cid):
+        """
+        getArchives cid=
+
+        Every tenth archive of the next county is listed too, the way
+        bookDB lists parishes on a county border.
+        """
+        if not 1 <= cid <= len(COUNTIES):
+            return []
+        ret = [self.archive_row(cid * 1000 + num) for num in range(1, self.narch + 1)]
+        nxt = cid % len(COUNTIES) + 1
+        ret += [self.archive_row(nxt * 1000 + num) for num in range(10, self.narch + 1, 10)]
+        return ret
+
+    def archive(self, aid):
+        """
+        getArchives aid=
+        """
+        cid = self.__arch_cid(aid)
+        if cid is None:
+            return {}
+        ret = self.archive_row(aid)
+        region = self.__region(cid)
+        ret.update({'bdbACauthor': ret['bdbACname'] + ', kyrkoarkiv',
+                    'bdbREid': str(region + 1),
+                    'bdbACref': 'SE/%s/%05d' % (ARCHIVES[region][1], aid),
+                    'bdbBKchk': self.__check('arch', aid)})
+        return ret
+
+    def __check(self, *key):
+        """
+        Checksum of a record
+        """
+        return hashlib.md5(('%s:%s' % (self.seed, key)).encode('utf-8')).hexdigest()[:8]
+
+    def __book_types(self, aid):
+        """
+        Book types used in an archive, with the type of every book
+        """
+        rnd = self.__rand('types', aid)
+        types = []
+        for num in range(self.per_arch):
+            types.append(str(1 + num * len(BOOK_TYPES) // self.per_arch))
+        spec = {}
+        for num in range(self.per_arch):
+            if types[num] == '3' and rnd.random() < 0.2:
+                spec[num] = '9'
+        return types, spec
+
+    def booktypes(self, aid):
+        """
+        getBookTypes aid=
+        """
+        if self.__arch_cid(aid) is None:
+            return {}
+        types, spec = self.__book_types(aid)
+        used = set(types) | set(spec.values())
+        return {key: val for key, val in BOOK_TYPES.items() if key in used}
+
+    def __book_id(self, aid, num):
+        """
+        Id of book number num in an archive
+        """
+        cid, anum = divmod(aid, 1000)
+        return (((cid - 1) * self.narch) + anum - 1) * self.per_arch + num + 1
+
+    def __book_aid(self, bid):
+        """
+        Archive and number within it of a book
+        """
+        idx, num = divmod(bid - 1, self.per_arch)
+        cid, anum = divmod(idx, self.narch)
+        return (cid + 1) * 1000 + anum + 1, num
+
+    def book_row(self, bid):
+        """
+        Row describing a book in a list
+        """
+        if bid >= SCB_BASE:
+            return self.scb_book_row(bid)
+        aid, num = self.__book_aid(bid)
+        types, spec = self.__book_types(aid)
+        btype = types[num]
+        start = 1680 + (num * 7) % 230
+        ret = {'bdbBKid': str(bid), 'nadBTid': btype,
+               'nadBTidSpec': spec.get(num, '0'),
+               'nadBKperiod': '%d-%d' % (start, start + 5 + num % 10),
+               'bdbBKsignum': '%s:%d' % (BOOK_SIGNUM[btype], num + 1)}
+        if self.edits.get(bid):
+            ret.update(self.edits[bid])
+        return ret
+
+    def books(self, aid):
+        """
+        getBooks aid=
+        """
+        if self.__arch_cid(aid) is None:
+            return []
+        with self.lock:
+            return [self.book_row(bid) for bid in
+                    [self.__book_id(aid, num) for num in range(self.per_arch)]
+                    if self.edits.get(bid, True) is not None]
+
+    def edit(self, rnd):
+        """
+        Change, delete or bring back a random church book
+        """
+        aid = rnd.randint(1, len(COUNTIES)) * 1000 + rnd.randint(1, self.narch)
+        bid = self.__book_id(aid, rnd.randrange(self.per_arch))
+        with self.lock:
+            present = self.edits.get(bid, True) is not None
+            if not present or rnd.random() < 0.7:
+                start = rnd.randint(1680, 1900)
+                self.edits[bid] = {'nadBKperiod': '%d-%d' % (start, start + rnd.randint(1, 20))}
+            else:
+                self.edits[bid] = None
+            self.revision += 1
+            self.log.append((self.revision, ('book', aid), str(bid), present))
+            if len(self.log) > CHANGE_LOG_SIZE:
+                self.oldest = self.log.pop(0)[0]
+            return bid
+
+    def delta(self, scope, since, rows, key):
+        """
+        Rows of a list added, changed and deleted since a revision, or
+        None if the revision is not known. Positions are those in the
+        current list.
+        """
+        if since < self.oldest or since > self.revision:
+            return None
+        before = {}
+        for rev, where, rid, present in self.log:
+            if rev > since and where == scope and rid not in before:
+                before[rid] = present
+        pos = {row[key]: idx for idx, row in enumerate(rows)}
+        ret = {'status': 'OK', 'token': str(self.revision),
+               'added': [], 'changed': [], 'deleted': []}
+        for rid, present in before.items():
+            if rid in pos:
+                what = 'changed' if present else 'added'
+                ret[what].append([pos[rid], rows[pos[rid]]])
+            elif present:
+                ret['deleted'].append(rid)
+        return ret
+
+    def book(self, bid):
+        """
+        getBooks bid=
+        """
+        if bid >= SCB_BASE:
+            cid, num = divmod(bid - SCB_BASE, 100000)
+            if not 1 <= cid <= len(COUNTIES) or num >= self.nscb:
+                return {}
+            aid = None
+        else:
+            aid, num = self.__book_aid(bid)
+            if self.__arch_cid(aid) is None or bid < 1:
+                return {}
+            if self.edits.get(bid, True) is None:
+                return {}
+        ret = self.book_row(bid)
+        rnd = self.__rand('book', bid)
+        nad = rnd.random() < 0.9
+        ad = rnd.random() < 0.7
+        ret.update({'nadBTidReal': ret['nadBTid'],
+                    'nadSTsignum': ret['bdbBKsignum'].split(':')[0],
+                    'nadBKvol': ret['bdbBKsignum'].split(':')[-1],
+                    'nadBKid': str(bid + 1000000) if nad else '0',
+                    'nadBKchkBr': self.__check('bref', bid) if nad else '',
+                    'adBKid': str(bid + 2000000) if ad else '0',
+                    'adBKvol': 'v%d' % (bid + 3000000) if ad else '',
+                    'adACchkBK': self.__check('ad', bid) if ad else '',
+                    'bdbBKchk': self.__check('book', bid)})
+        return ret
+
+    def bookrefs(self, nid):
+        """
+        getBookRefs bid=
+        """
+        rnd = self.__rand('bref', nid)
+        ret = [{'nadBRtype': 'bildfil',
+                'nadBRref': 'Bildid C%07d_%05d' % (nid % 10000000, 1)}]
+        if rnd.random() < 0.5:
+            ret.append({'nadBRtype': 'microfilm',
+                        'nadBRref': ' %d ' % rnd.randint(100000, 999999)})
+        return ret
+
+    def scb_book_row(self, bid):
+        """
+        Row describing a SCB book in a list
+        """
+        cid, num = divmod(bid - SCB_BASE, 100000)
+        btype = str(1 + num % (len(SCB_TYPES) - 1))
+        start = 1860 + (num // (len(SCB_TYPES) - 1)) * 5 % 90
+        return {'bdbBKid': str(bid), 'nadBTid': btype,
+                'nadBKperiod': '%d-%d' % (start, start + 4),
+                'bdbBKsignum': 'SCB %s:%d' % (COUNTIES[cid - 1].split()[0], num + 1),
+                'nadBKextra': 'Del %d' % (num % 3 + 1)}
+
+    def scb_books(self, cid):
+        """
+        getSCBBooks cid=
+        """
+        if not 1 <= cid <= len(COUNTIES):
+            return []
+        return [self.scb_book_row(SCB_BASE + cid * 100000 + num)
+                for num in range(self.nscb)]
+
+    @staticmethod
+    def scb_booktypes():
+        """
+        getSCBBookTypes
+        """
+        return dict(SCB_TYPES)
+
+    def scb_archive(self):
+        """
+        getSCBArchive
+        """
+        return {'bdbACid': '0', 'bdbACname': 'Statistiska centralbyrån',
+                'bdbACauthor': 'Statistiska centralbyrån',
+                'bdbCTid': '0', 'bdbREid': '1', 'bdbACref': 'SE/RA/420267',
+                'bdbBKchk': self.__check('scb')}
+
+class BookdbServer(ThreadingHTTPServer):
+    """
+    HTTP server holding the catalogue, the options and the counters
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, catalogue, username='', password='',
+                 latency=0.0, jitter=0.0, error_rate=0.0, errors=(500,),
+                 batch=True, compress=True, path='/bookdb.php', seed=1):
+        """
+        init
+        """
+        ThreadingHTTPServer.__init__(self, address, BookdbHandler)
+        self.catalogue = catalogue
+        self.auth = ''
+        if username or password:
+            auth = '%s:%s' % (username, password)
+            self.auth = 'Basic ' + base64.standard_b64encode(auth.encode('utf-8')).decode('ascii')
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        self.batch = batch
+        self.compress = compress
+        self.path = path
+        self.modified = formatdate(time.time(), usegmt=True)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, cmd, size):
+        """
+        Count a request and the bytes sent for it
+        """
+        with self.lock:
+            stats = self.stats.setdefault(cmd, {'requests': 0, 'bytes': 0})
+            stats['requests'] += 1
+            stats['bytes'] += size
+
+    def get_stats(self):
+        """
+        Return a copy of the counters
+        """
+        with self.lock:
+            return {cmd: dict(val) for cmd, val in self.stats.items()}
+
+    def reset_stats(self):
+        """
+        Clear the counters
+        """
+        with self.lock:
+            self.stats = {}
+
+    def inject(self):
+        """
+        Return an HTTP error code to answer with, or None
+        """
+        if self.error_rate <= 0:
+            return None
+        with self.lock:
+            if self.random.random() >= self.error_rate:
+                return None
+            return self.random.choice(self.errors)
+
+    def delay(self):
+        """
+        Seconds to wait before answering
+        """
+        if self.latency <= 0 and self.jitter <= 0:
+            return 0.0
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def answer(self, params):
+        """
+        Answer one command, params being a dict of the query parameters
+        """
+        with self.catalogue.lock:
+            return self.__answer(params)
+
+    @staticmethod
+    def token(params):
+        """
+        Check if an answer is a list with a change token
+        """
+        cmd = params.get('do', '')
+        return (cmd == 'getBooks' and 'aid' in params) or cmd == 'getSCBBooks' or \
+               (cmd == 'getRepositories' and 'rin' not in params)
+
+    def __since(self, params, scope, rows, key):
+        """
+        The rows of a list, or what changed in it if since is given
+        """
+        if 'since' not in params:
+            return rows
+        try:
+            since = int(params['since'])
+        except ValueError:
+            return rows
+        delta = self.catalogue.delta(scope, since, rows, key)
+        if delta is None:
+            return rows
+        return delta
+
+    def __answer(self, params):
+        """
+        Answer one command, catalogue lock held
+        """
+        cat = self.catalogue
+        cmd = params.get('do', '')
+        sspv = params.get('sspv', '')
+        if sspv not in PROTOCOL_VERSIONS:
+            return {'status': 'Unsupported protocol version'}
+
+        def num(key):
+            try:
+                return int(params.get(key, ''))
+            except ValueError:
+                return -1
+
+        if cmd == 'TestSSPV':
+            return {'status': 'OK'}
+        if cmd == 'getRepositories':
+            if 'rin' in params:
+                return cat.repository(params['rin'])
+            return self.__since(params, ('repo',), cat.repositories(), 'rin')
+        if cmd == 'getCounties':
+            return cat.counties()
+        if cmd == 'getArchives':
+            if 'aid' in params:
+                return cat.archive(num('aid'))
+            return cat.archives(num('cid'))
+        if cmd == 'getBookTypes':
+            return cat.booktypes(num('aid'))
+        if cmd == 'getBooks':
+            if 'bid' in params:
+                return cat.book(num('bid'))
+            return self.__since(params, ('book', num('aid')), cat.books(num('aid')), 'bdbBKid')
+        if cmd == 'getBookRefs':
+            return cat.bookrefs(num('bid'))
+        if cmd == 'getSCBBooks':
+            return self.__since(params, ('scb', num('cid')), cat.scb_books(num('cid')),
+                                'bdbBKid')
+        if cmd == 'getSCBBookTypes':
+            return cat.scb_booktypes()
+        if cmd == 'getSCBArchive':
+            return cat.scb_archive()
+        if cmd == 'doBatch' and self.batch and sspv == PROTOCOL_BATCH:
+            results = []
+            for idx in range(max(0, num('n'))):
+                sub = dict(urllib.parse.parse_qsl(params.get('q%d' % idx, '')))
+                sub['sspv'] = sspv
+                results.append(self.__answer(sub))
+            return {'status': 'OK', 'results': results}
+        return {'status': 'Unknown command'}
+
+class BookdbHandler(BaseHTTPRequestHandler):
+    """
+    Request handler
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'bookDB-standin/0.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """
+        Keep quiet
+        """
+        return
+
+    def __send(self, code, body=b'', headers=None):
+        """
+        Send an answer
+        """
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        """
+        Answer a GET request
+        """
+        server = self.server
+        parts = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parts.query))
+        cmd = params.get('do', '')
+
+        delay = server.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+        if parts.path != server.path:
+            server.count(cmd, 0)
+            self.__send(404)
+            return
+        if server.auth and self.headers.get('Authorization') != server.auth:
+            server.count(cmd, 0)
+            self.__send(401, headers={'WWW-Authenticate': 'Basic realm="bookDB"'})
+            return
+        code = server.inject()
+        if code is not None:
+            server.count(cmd, 0)
+            self.__send(code)
+            return
+
+        with server.catalogue.lock:
+            revision = server.catalogue.revision
+            body = json.dumps(server.answer(params)).encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        headers = {'ETag': etag, 'Last-Modified': server.modified}
+        if server.token(params):
+            headers[TOKEN_HEADER] = str(revision)
+        if self.headers.get('If-None-Match') == etag:
+            server.count(cmd, 0)
+            self.__send(304, headers=headers)
+            return
+
+        accept = self.headers.get('Accept-Encoding', '')
+        if server.compress and len(body) >= GZIP_MIN_SIZE and \
+           'gzip' in [enc.split(';')[0].strip() for enc in accept.split(',')]:
+            body = gzip.compress(body, 6)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+
+        server.count(cmd, len(body))
+        self.__send(200, body, headers)
+
+def start_server(host='127.0.0.1', port=0, churn=0.0, **kwargs):
+    """
+    Start a server in a background thread and return it
+
+    The catalogue options (books, archives, scb, seed) and the server
+    options are passed as keywords. If churn is given, a book is edited
+    every churn seconds. The url to use is available as server.url.
+    """
+    catalogue = Catalogue(**{key: kwargs.pop(key) for key in
+                             ('books', 'archives', 'scb', 'seed') if key in kwargs})
+    server = BookdbServer((host, port), catalogue, seed=catalogue.seed, **kwargs)
+    server.url = 'http://%s:%d%s' % (host, server.server_address[1], server.path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    if churn > 0:
+        def edit():
+            rnd = random.Random(catalogue.seed)
+            while True:
+                time.sleep(churn)
+                catalogue.edit(rnd)
+        threading.Thread(target=edit, daemon=True).start()
+    return server
+
+def main():
+    """
+    Run the server from the command line
+    """
+    parser = argparse.ArgumentParser(description='Stand-in bookDB server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--path', default='/bookdb.php')
+    parser.add_argument('--user', default='')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--books', type=int, default=20000,
+                        help='number of church books in the catalogue')
+    parser.add_argument('--archives', type=int, default=40,
+                        help='number of archives per county')
+    parser.add_argument('--scb', type=int, default=120,
+                        help='number of SCB books per county')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before every answer')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random seconds added to or taken from the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests answered with an error')
+    parser.add_argument('--errors', default='500,503',
+                        help='HTTP codes used for injected errors, from 401,404,500,503')
+    parser.add_argument('--no-batch', action='store_true',
+                        help='act as a server without doBatch')
+    parser.add_argument('--no-gzip', action='store_true',
+                        help='never compress answers')
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help='seconds between edits of a random book, 0 for none')
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, path=args.path,
+                          username=args.user, password=args.password,
+                          books=args.books, archives=args.archives,
+                          scb=args.scb, seed=args.seed,
+                          latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate,
+                          errors=[int(code) for code in args.errors.split(',')],
+                          batch=not args.no_batch,
+                          compress=not args.no_gzip,
+                          churn=args.churn)
+    print('bookDB stand-in serving %s' % server.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
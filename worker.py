@@ -0,0 +1,367 @@
+# Gramps - a GTK+/GNOME based genealogy program
+#
+# Copyright (C) 2018       Mats O Jansson
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# $Id$
+"""
+Worker module
+"""
+#------------------------------------------------------------------------
+#
+# Python modules
+#
+#------------------------------------------------------------------------
+import concurrent.futures
+import threading
+import time
+
+#------------------------------------------------------------------------
+#
+# Gtk modules
+#
+#------------------------------------------------------------------------
+from gi.repository import GLib
+
+#------------------------------------------------------------------------
+#
+# Constants
+#
+#------------------------------------------------------------------------
+
+WORKER_THREADS = 4
+
+#
+# Seconds a generator run by IdleTask may use in each slice of the main loop
+#
+IDLE_SLICE = 0.02
+
+class QueryTask():
+    """
+    A function call running in a worker thread
+
+    The callback is called in the GLib main loop with the value returned
+    by the function, or the error callback with the exception raised.
+    Values the function reports while running are handed to the progress
+    callback. None of them is called once the task has been cancelled.
+    """
+
+    def __init__(self, callback, error, progress=None):
+        """
+        init
+        """
+        self.__lock = threading.Lock()
+        self.__values = {'callback': callback, 'error': error,
+                         'progress': progress,
+                         'cancelled': False, 'done': False, 'future': None}
+
+    def set_future(self, future):
+        """
+        Save the future running the function
+        """
+        with self.__lock:
+            self.__values['future'] = future
+            if self.__values['cancelled']:
+                future.cancel()
+
+    def cancel(self):
+        """
+        Cancel the task, a running function is left to finish
+        """
+        with self.__lock:
+            self.__values['cancelled'] = True
+            if self.__values['future'] is not None:
+                self.__values['future'].cancel()
+
+    def cancelled(self):
+        """
+        Check if the task has been cancelled
+        """
+        return self.__values['cancelled']
+
+    def done(self):
+        """
+        Check if the result has been delivered
+        """
+        return self.__values['done']
+
+    def report(self, value):
+        """
+        Queue a progress value for the main loop, called in the worker
+
+        Returns False if the task has been cancelled, so the function
+        can stop early.
+        """
+        if self.__values['cancelled']:
+            return False
+        GLib.idle_add(self.__progress, value)
+        return True
+
+    def __progress(self, value):
+        """
+        Hand a progress value to the callback, called in the GLib main loop
+        """
+        if not self.__values['cancelled']:
+            self.__values['progress'](value)
+        return False
+
+    def deliver(self, value, err):
+        """
+        Hand the result to the callbacks, called in the GLib main loop
+        """
+        self.__values['done'] = True
+        if self.__values['cancelled']:
+            return False
+        if err is None:
+            if self.__values['callback'] is not None:
+                self.__values['callback'](value)
+        elif self.__values['error'] is not None:
+            self.__values['error'](err)
+        else:
+            print("Error: ", err)
+        return False
+
+class QueryWorker():
+    """
+    Pool of worker threads running bookDB queries
+    """
+
+    __debug = False
+
+    def __init__(self, threads=WORKER_THREADS):
+        """
+        init
+        """
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='bookdb')
+        self.__lock = threading.Lock()
+        self.__pending = 0
+
+    @staticmethod
+    def __run(task, func, args):
+        """
+        Call the function and queue the result for the main loop
+        """
+        if task.cancelled():
+            return
+        value = None
+        err = None
+        try:
+            value = func(*args)
+        except Exception as exc:
+            err = exc
+        GLib.idle_add(task.deliver, value, err)
+
+    def submit(self, callback, func, *args, error=None, progress=None):
+        """
+        Call func(*args) in a worker thread and return a QueryTask
+
+        If progress is given, func is called with one more argument, a
+        function queueing a value for progress in the main loop.
+        """
+        self.__print('QueryWorker::submit')
+
+        task = QueryTask(callback, error, progress)
+        if progress is not None:
+            args = args + (task.report,)
+        with self.__lock:
+            self.__pending += 1
+        future = self.__executor.submit(self.__run, task, func, args)
+        future.add_done_callback(self.__finished)
+        task.set_future(future)
+        return task
+
+    def __finished(self, future):
+        """
+        A task has finished or was cancelled before it started
+        """
+        with self.__lock:
+            self.__pending -= 1
+
+    def busy(self):
+        """
+        Check if any task is queued or running
+        """
+        with self.__lock:
+            return self.__pending > 0
+
+    def shutdown(self):
+        """
+        Stop the worker threads once the queued tasks are done
+        """
+        self.__print('QueryWorker::shutdown')
+
+        self.__executor.shutdown(wait=False)
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)
+
+class SingleFlight():
+    """
+    Merge identical calls running at the same time
+
+    The first caller for a key runs the function, callers arriving
+    with the same key before it is done wait and get the same value.
+    """
+
+    def __init__(self):
+        """
+        init
+        """
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    def run(self, key, func):
+        """
+        Return (value, shared), shared being True if another caller ran func
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'value': None, 'err': None}
+                self.__calls[key] = call
+
+        if not leader:
+            call['event'].wait()
+            if call['err'] is not None:
+                raise call['err']
+            return (call['value'], True)
+
+        try:
+            call['value'] = func()
+        except Exception as err:
+            call['err'] = err
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call['event'].set()
+        return (call['value'], False)
+
+    def pending(self):
+        """
+        Number of calls running
+        """
+        with self.__lock:
+            return len(self.__calls)
+
+class IdleTask():
+    """
+    A generator run in short slices of the GLib main loop
+
+    The generator is advanced until the slice is used up, then the last
+    value it yielded that was not None is handed to the progress callback
+    and the main loop gets to run. The callback is called when the
+    generator is exhausted, or the error callback with the exception
+    it raised, unless the task has been cancelled.
+    """
+
+    __debug = False
+
+    def __init__(self, gen, callback=None, progress=None, error=None,
+                 slice=IDLE_SLICE):
+        """
+        init
+        """
+        self.__values = {'gen': gen, 'callback': callback,
+                         'progress': progress, 'error': error,
+                         'slice': slice, 'source': None}
+        self.__values['source'] = GLib.idle_add(self.__step,
+                                                priority=GLib.PRIORITY_LOW)
+
+    def __step(self):
+        """
+        Run the generator for one slice, called in the GLib main loop
+        """
+        end = time.monotonic() + self.__values['slice']
+        value = None
+        try:
+            while True:
+                item = next(self.__values['gen'])
+                if item is not None:
+                    value = item
+                if time.monotonic() >= end:
+                    break
+        except StopIteration:
+            self.__values['source'] = None
+            if self.__values['callback'] is not None:
+                self.__values['callback']()
+            return False
+        except Exception as err:
+            self.__values['source'] = None
+            if self.__values['error'] is not None:
+                self.__values['error'](err)
+            else:
+                print("Error: ", err)
+            return False
+        if value is not None and self.__values['progress'] is not None:
+            self.__values['progress'](value)
+        return True
+
+    def running(self):
+        """
+        Check if the generator has not finished yet
+        """
+        return self.__values['source'] is not None
+
+    def finish(self):
+        """
+        Run the rest of the generator now, instead of in the main loop
+        """
+        self.__print('IdleTask::finish')
+
+        if self.__values['source'] is None:
+            return
+        GLib.source_remove(self.__values['source'])
+        self.__values['source'] = None
+        try:
+            for item in self.__values['gen']:
+                pass
+        except Exception as err:
+            if self.__values['error'] is not None:
+                self.__values['error'](err)
+            else:
+                print("Error: ", err)
+            return
+        if self.__values['callback'] is not None:
+            self.__values['callback']()
+
+    def cancel(self):
+        """
+        Stop the generator
+        """
+        self.__print('IdleTask::cancel')
+
+        if self.__values['source'] is not None:
+            GLib.source_remove(self.__values['source'])
+            self.__values['source'] = None
+            try:
+                self.__values['gen'].close()
+            except Exception:
+                # the database may already be closed
+                pass
+
+    def __print(self, str):
+        """
+        print debug info
+        """
+        if self.__debug:
+            print(str)